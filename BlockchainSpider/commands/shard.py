@@ -0,0 +1,202 @@
+import csv
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+from scrapy.commands import ScrapyCommand
+from scrapy.exceptions import UsageError
+from scrapy.utils.conf import arglist_to_dict
+
+from BlockchainSpider import settings
+from BlockchainSpider.pipelines.trans import COMPRESSION_EXTENSIONS, open_csv
+
+
+class Command(ScrapyCommand):
+    """
+    Split a block range into shards, and crawl the shards in parallel worker processes.
+    Each worker has a slice of the rate budget, and writes the outputs to `<out>/shard_<i>`.
+    The outputs of shards are merged into `<out>` in the block order finally.
+
+    Example:
+    scrapy shard trans.block.evm -a providers=https://... -a start_blk=19000000 -a end_blk=19100000 --shards 4
+    """
+    requires_project = True
+    SHARD_DIR_FORMAT = 'shard_%d'
+    RANGE_ARGS = [('start_blk', 'end_blk'), ('start_slot', 'end_slot')]
+
+    def syntax(self):
+        return "[options] <spider>"
+
+    def short_desc(self):
+        return "Run a block spider in parallel processes with sharded block ranges"
+
+    def add_options(self, parser):
+        ScrapyCommand.add_options(self, parser)
+        parser.add_argument(
+            "-a", dest="spargs", action="append", default=[], metavar="NAME=VALUE",
+            help="set spider argument (may be repeated)",
+        )
+        parser.add_argument(
+            "--shards", dest="shards", type=int, default=os.cpu_count(),
+            help="the number of worker processes, the default is the number of cpu cores",
+        )
+        parser.add_argument(
+            "--merge-only", dest="merge_only", action="store_true",
+            help="merge the outputs of existing shards without crawling",
+        )
+
+    def process_options(self, args, opts):
+        ScrapyCommand.process_options(self, args, opts)
+        try:
+            opts.spargs = arglist_to_dict(opts.spargs)
+        except ValueError:
+            raise UsageError("Invalid -a value, use -a NAME=VALUE", print_help=False)
+
+    def run(self, args, opts):
+        if len(args) != 1:
+            raise UsageError()
+        spname = args[0]
+        out_dir = opts.spargs.get('out', './data')
+        shard_dirs = [
+            os.path.join(out_dir, self.SHARD_DIR_FORMAT % i)
+            for i in range(opts.shards)
+        ]
+        if not opts.merge_only:
+            if not self._crawl(spname, opts, shard_dirs):
+                self.exitcode = 1
+                return
+        merge_shards(shard_dirs, out_dir)
+        print('Merged {} shards into {}'.format(len(shard_dirs), out_dir))
+
+    def _crawl(self, spname: str, opts, shard_dirs: list) -> bool:
+        start_arg, end_arg = next(
+            (args for args in self.RANGE_ARGS if opts.spargs.get(args[0]) is not None),
+            self.RANGE_ARGS[0],
+        )
+        if opts.spargs.get(start_arg) is None or opts.spargs.get(end_arg) is None:
+            raise UsageError("Please input the block range by `{}` and `{}`".format(start_arg, end_arg))
+        start_block, end_block = int(opts.spargs[start_arg]), int(opts.spargs[end_arg])
+        shards = split_range(start_block, end_block, len(shard_dirs))
+
+        # slice the rate budget of providers for each worker,
+        # where the qps of pools in `routes` are sliced by the spider with `shards`
+        qps = float(opts.spargs.get('qps', getattr(settings, 'CONCURRENT_REQUESTS', 5)))
+        qps = qps / len(shards)
+
+        # start the workers
+        processes = list()
+        for (shard_start, shard_end), shard_dir in zip(shards, shard_dirs):
+            if not os.path.exists(shard_dir):
+                os.makedirs(shard_dir)
+            spargs = {
+                **opts.spargs,
+                start_arg: shard_start,
+                end_arg: shard_end,
+                'out': shard_dir,
+                'qps': qps,
+                'shards': len(shards),
+            }
+            cmd = [sys.executable, '-m', 'scrapy', 'crawl', spname]
+            for key, value in spargs.items():
+                cmd.extend(['-a', '%s=%s' % (key, value)])
+            for setting in opts.set:
+                cmd.extend(['-s', setting])
+            cmd.extend(['-s', 'LOG_FILE=%s' % os.path.join(shard_dir, 'crawl.log')])
+            processes.append(subprocess.Popen(cmd))
+            print('Start shard #{} to {}: {}~{}'.format(len(processes) - 1, shard_dir, shard_start, shard_end))
+
+        # wait for the workers
+        start_time = time.time()
+        returncodes = [process.wait() for process in processes]
+        print('Finished {} blocks in {:.1f}s with {} shards, exit codes: {}'.format(
+            end_block - start_block + 1, time.time() - start_time, len(shards), returncodes,
+        ))
+        return all([code == 0 for code in returncodes])
+
+
+def split_range(start_block: int, end_block: int, n: int) -> list:
+    """
+    Split the block range (both ends included) into n contiguous shards.
+
+    :param start_block:
+    :param end_block:
+    :param n:
+    :return: the list of (start_block, end_block)
+    """
+    total = end_block - start_block + 1
+    n = max(1, min(n, total))
+    shards = list()
+    for i in range(n):
+        shard_start = start_block + total * i // n
+        shard_end = start_block + total * (i + 1) // n - 1
+        shards.append((shard_start, shard_end))
+    return shards
+
+
+def merge_shards(shard_dirs: list, out_dir: str, dedup_fields: dict = None):
+    """
+    Merge the csv outputs of shards in order, where the header is kept only once.
+    The files of the same name in multiple shards (e.g., the chunks of the same block range) are concatenated,
+    and the other files are copied directly.
+
+    :param shard_dirs: the output dirs of shards
+    :param out_dir: the output dir of merged files
+    :param dedup_fields: the deduplicated field of item classes, e.g., `{'TokenPropertyItem': 'contract_address'}`,
+    where the rows are deduplicated over all files of the class, including the chunks
+    :return:
+    """
+    if dedup_fields is None:
+        dedup_fields = {'TokenPropertyItem': 'contract_address'}
+    basenames = sorted({
+        fn for shard_dir in shard_dirs if os.path.exists(shard_dir)
+        for fn in os.listdir(shard_dir) if fn.endswith(('.csv', '.csv.gz', '.csv.zst'))
+    }, key=lambda fn: [int(t) if t.isdigit() else t for t in re.split(r'(\d+)', fn)])
+    cls2seen = dict()
+    for basename in basenames:
+        fns = [
+            os.path.join(shard_dir, basename) for shard_dir in shard_dirs
+            if os.path.exists(os.path.join(shard_dir, basename))
+        ]
+        cls_name = basename.split('.')[0]
+        dedup_field = dedup_fields.get(cls_name)
+        if len(fns) == 1 and dedup_field is None:
+            shutil.copyfile(fns[0], os.path.join(out_dir, basename))
+            continue
+
+        compression = next((
+            compression for compression, ext in COMPRESSION_EXTENSIONS.items()
+            if ext and basename.endswith(ext)
+        ), None)
+        out_file, out_raw = open_csv(os.path.join(out_dir, basename), 'w', compression)
+        header = None
+        seen = cls2seen.setdefault(cls_name, set())
+        for fn in fns:
+            f, raw = open_csv(fn, 'r', compression)
+            shard_header = f.readline()
+            if shard_header == '':
+                f.close()
+                raw.close()
+                continue
+            if header is None:
+                header = shard_header
+                out_file.write(header)
+            assert shard_header == header, "Inconsistent headers of {}".format(fn)
+
+            # copy the rows directly if no deduplication
+            if dedup_field is None:
+                shutil.copyfileobj(f, out_file)
+            else:
+                writer = csv.writer(out_file)
+                idx = next(csv.reader([header])).index(dedup_field)
+                for row in csv.reader(f):
+                    if row[idx] in seen:
+                        continue
+                    seen.add(row[idx])
+                    writer.writerow(row)
+            f.close()
+            raw.close()
+        out_file.close()
+        out_raw.close()
@@ -1,8 +1,9 @@
 from .label import LabelReportItem
 from .subgraph import AccountTransferItem, UTXOTransferItem
-from .evm import BlockItem, TransactionItem, EventLogItem, TraceItem, ContractItem, Token721TransferItem, \
+from .evm import BlockItem, BlockReorgItem, TransactionItem, EventLogItem, TraceItem, ContractItem, Token721TransferItem, \
     Token20TransferItem, Token1155TransferItem, TokenApprovalItem, TokenApprovalAllItem, TokenPropertyItem, \
     NFTMetadataItem, TransactionReceiptItem, DCFGBlockItem, DCFGEdgeItem
 from .solana import SolanaBlockItem, SolanaTransactionItem
 from .sync import SyncItem
+from .batch import ItemBatch
 from .contract import SourceCodeItem, SignItem, ABIItem
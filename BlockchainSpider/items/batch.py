@@ -0,0 +1,120 @@
+from typing import Iterator, List
+
+from BlockchainSpider.items.defs import ContextualItem, LazyHexItem
+from BlockchainSpider.utils.web3 import hex_to_dec_column
+
+_MISSING = object()  # the placeholder of the fields not set
+
+
+class ItemBatch:
+    """
+    A columnar batch of items in the same class (i.e., struct of arrays),
+    which is much more compact than the dict-backed items.
+
+    The items are rebuilt lazily when iterating or indexing,
+    and the rows can be read directly without rebuilding, e.g., for writing csv.
+    Note that the context kwargs starting with `@` (e.g., `@transactions`) are dropped,
+    since they refer to the other items in flight.
+    The raw hex of `LazyHexItem` are kept, and decoded in bulk for each column on first read.
+    """
+    __slots__ = ('item_cls', 'columns', 'contexts', '_size', '_is_sparse', '_is_decoded')
+
+    def __init__(self, item_cls):
+        self.item_cls = item_cls
+        self.columns = dict()  # field -> list of values
+        self.contexts = dict()  # row index -> context kwargs, only for the rows with context
+        self._size = 0
+        self._is_sparse = False  # some fields are not set in some rows
+        self._is_decoded = True  # no raw hex in the columns
+
+    @property
+    def fields(self) -> List[str]:
+        return list(self.columns.keys())
+
+    def append(self, item):
+        size = self._size
+        values = item.items()
+        if isinstance(item, LazyHexItem):
+            values = item._values.items()
+            self._is_decoded = False
+        for key, value in values:
+            column = self.columns.get(key)
+            if column is None:
+                column = [_MISSING] * size
+                self.columns[key] = column
+                self._is_sparse = self._is_sparse or size > 0
+            column.append(value)
+        self._size += 1
+        if len(item) != len(self.columns):
+            self._is_sparse = True
+            for column in self.columns.values():
+                if len(column) < self._size:
+                    column.append(_MISSING)
+
+        # keep the context kwargs except the references of items in flight
+        if isinstance(item, ContextualItem) and item.get_context_kwargs():
+            context = {k: v for k, v in item.get_context_kwargs().items() if not k.startswith('@')}
+            if len(context) > 0:
+                self.contexts[size] = context
+
+    def get_column(self, field: str, default=None) -> list:
+        """
+        Get the values of the field, where the fields not set are the default value.
+
+        :param field:
+        :param default:
+        :return:
+        """
+        self._decode()
+        column = self.columns.get(field)
+        if column is None:
+            return [default] * self._size
+        if not self._is_sparse:
+            return column
+        return [default if value is _MISSING else value for value in column]
+
+    def rows(self, fields: List[str]) -> Iterator[tuple]:
+        """
+        Iterate the rows of the fields, where the fields not set are empty strings.
+
+        :param fields:
+        :return:
+        """
+        self._decode()
+        columns = [self.columns.get(field, [_MISSING] * self._size) for field in fields]
+        if not self._is_sparse and len(fields) == len(self.columns):
+            return zip(*columns)
+        return (
+            tuple('' if value is _MISSING else value for value in row)
+            for row in zip(*columns)
+        )
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, idx: int):
+        if idx < 0:
+            idx += self._size
+        if not 0 <= idx < self._size:
+            raise IndexError('item index out of range')
+        self._decode()
+        item = self.item_cls(**{
+            key: column[idx] for key, column in self.columns.items()
+            if column[idx] is not _MISSING
+        })
+        if idx in self.contexts:
+            item.set_context_kwargs(**self.contexts[idx])
+        return item
+
+    def __iter__(self):
+        for idx in range(self._size):
+            yield self[idx]
+
+    def _decode(self):
+        if self._is_decoded:
+            return
+        for field in getattr(self.item_cls, 'HEX_FIELDS', ()):
+            column = self.columns.get(field)
+            if column is not None:
+                self.columns[field] = hex_to_dec_column(column)
+        self._is_decoded = True
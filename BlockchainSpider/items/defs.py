@@ -2,6 +2,8 @@ from typing import Dict
 
 import scrapy
 
+from BlockchainSpider.utils.web3 import hex_to_dec
+
 
 class ContextualItem(scrapy.Item):
     def __init__(self, *args, **kwargs):
@@ -16,3 +18,19 @@ class ContextualItem(scrapy.Item):
 
     def get_context_kwargs(self) -> Dict:
         return self._cb_kwargs
+
+
+class LazyHexItem(ContextualItem):
+    """
+    The item whose integer fields in `HEX_FIELDS` can carry the raw hex strings (e.g., `0x1bc16d674ec80000`),
+    which are decoded by `hex_to_dec` on first access and memoized.
+    Therefore, the fields never read by the pipelines are not decoded.
+    """
+    HEX_FIELDS = frozenset()
+
+    def __getitem__(self, key):
+        value = self._values[key]
+        if (value is None or value.__class__ is str) and key in self.HEX_FIELDS:
+            value = hex_to_dec(value)
+            self._values[key] = value
+        return value
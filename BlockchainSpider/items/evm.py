@@ -1,15 +1,16 @@
 import scrapy
 
-from BlockchainSpider.items.defs import ContextualItem
+from BlockchainSpider.items.defs import ContextualItem, LazyHexItem
 
 
-class BlockItem(ContextualItem):
+class BlockItem(LazyHexItem):
     """
     The item for transmitting blocks.
     Note that this object attached with context args:
 
     **@transactions**: a :class:`list` object with items :class:`TransactionItem`
     """
+    HEX_FIELDS = frozenset(['difficulty', 'total_difficulty', 'size', 'gas_limit', 'gas_used', 'nonce'])
     block_hash = scrapy.Field()  # str
     block_number = scrapy.Field()  # int
     parent_hash = scrapy.Field()  # str
@@ -25,7 +26,18 @@ class BlockItem(ContextualItem):
     nonce = scrapy.Field()  # int
 
 
-class TransactionItem(ContextualItem):
+class BlockReorgItem(ContextualItem):
+    """
+    The item for retracting the reorged blocks,
+    i.e., the collected items with the `block_hash` should be discarded.
+    """
+    block_hash = scrapy.Field()  # str
+    block_number = scrapy.Field()  # int
+    new_block_hash = scrapy.Field()  # str
+
+
+class TransactionItem(LazyHexItem):
+    HEX_FIELDS = frozenset(['transaction_index', 'value', 'gas', 'gas_price', 'nonce'])
     transaction_hash = scrapy.Field()  # str
     transaction_index = scrapy.Field()  # int
     block_hash = scrapy.Field()  # str
@@ -40,13 +52,14 @@ class TransactionItem(ContextualItem):
     input = scrapy.Field()  # str
 
 
-class TransactionReceiptItem(ContextualItem):
+class TransactionReceiptItem(LazyHexItem):
     """
     The item for transmitting transaction receipts.
     Note that this object attached with context args:
 
     **@transaction**: an object, i.e., :class:`TransactionItem`
     """
+    HEX_FIELDS = frozenset(['transaction_index', 'transaction_type', 'gas_used', 'effective_gas_price'])
     transaction_hash = scrapy.Field()  # str
     transaction_index = scrapy.Field()  # int
     transaction_type = scrapy.Field()  # int
@@ -58,7 +71,8 @@ class TransactionReceiptItem(ContextualItem):
     is_error = scrapy.Field()  # bool
 
 
-class EventLogItem(ContextualItem):
+class EventLogItem(LazyHexItem):
+    HEX_FIELDS = frozenset(['log_index'])
     transaction_hash = scrapy.Field()  # str
     log_index = scrapy.Field()  # int
     block_number = scrapy.Field()  # str
@@ -69,7 +83,8 @@ class EventLogItem(ContextualItem):
     removed = scrapy.Field()  # bool
 
 
-class TraceItem(ContextualItem):
+class TraceItem(LazyHexItem):
+    HEX_FIELDS = frozenset(['value', 'gas', 'gas_used'])
     transaction_hash = scrapy.Field()  # str
     trace_type = scrapy.Field()  # str
     trace_id = scrapy.Field()  # str
@@ -97,7 +112,8 @@ class ContractItem(ContextualItem):
     code = scrapy.Field()  # str
 
 
-class Token20TransferItem(ContextualItem):
+class Token20TransferItem(LazyHexItem):
+    HEX_FIELDS = frozenset(['value'])
     transaction_hash = scrapy.Field()  # str
     log_index = scrapy.Field()  # int
     block_number = scrapy.Field()  # int
@@ -108,7 +124,8 @@ class Token20TransferItem(ContextualItem):
     value = scrapy.Field()  # int
 
 
-class Token721TransferItem(ContextualItem):
+class Token721TransferItem(LazyHexItem):
+    HEX_FIELDS = frozenset(['token_id'])
     transaction_hash = scrapy.Field()  # str
     log_index = scrapy.Field()  # str
     block_number = scrapy.Field()  # int
@@ -132,7 +149,8 @@ class Token1155TransferItem(ContextualItem):
     values = scrapy.Field()  # [int]
 
 
-class TokenApprovalItem(ContextualItem):
+class TokenApprovalItem(LazyHexItem):
+    HEX_FIELDS = frozenset(['value'])
     transaction_hash = scrapy.Field()  # str
     log_index = scrapy.Field()  # int
     block_number = scrapy.Field()  # str
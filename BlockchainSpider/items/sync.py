@@ -4,3 +4,4 @@ import scrapy
 class SyncItem(scrapy.Item):
     key = scrapy.Field()  # Any
     data = scrapy.Field()  # dict
+    failed = scrapy.Field()  # bool, the items of the key are incomplete if true
@@ -3,3 +3,8 @@ from .tor import TorMiddleware
 from .sync import SyncMiddleware
 from .proxy import HTTPProxyMiddleware
 from .retry import UnterminatedJSONRetryMiddleware
+from .batch import JSONRPCBatchMiddleware
+from .health import ProviderHealthMiddleware
+from .throttle import AdaptiveConcurrencyMiddleware
+from .hedge import HedgedRequestMiddleware
+from .order import SyncOrderMiddleware
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import logging
+
+import scrapy
+from scrapy.utils.defer import maybe_deferred_to_future
+
+from BlockchainSpider.middlewares.defs import LogMiddleware
+from BlockchainSpider.middlewares.health import get_response_outcome
+from BlockchainSpider.utils import fastjson
+from BlockchainSpider.utils.multicall import is_batch_unsupported
+
+
+class JSONRPCBatchMiddleware(LogMiddleware):
+    """
+    Pack the JSON-RPC requests marked with `meta['jsonrpc_batch']` into
+    one JSON-RPC array body for each provider, and split the array response
+    back to the responses of each request.
+
+    The batch size of each provider is loaded from `spider.provider_batch_size`,
+    note that the batch size is limited by `CONCURRENT_REQUESTS`, because each
+    waiting request holds a downloading slot until the batch is sent.
+    The throttled or failed batches are retried as batches, and the batch size of provider
+    is set to 1 only if the provider says the JSON-RPC batch is not supported.
+    """
+    BATCH_KEYWORD = 'jsonrpc_batch'
+    BATCHED_KEYWORD = '_jsonrpc_batched'
+    MEMBER_KEYWORD = '_jsonrpc_batch_member'
+    RETRY_KEYWORD = '_jsonrpc_batch_retry'
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.max_retries = 3
+        self.max_wait = 0.1
+        self.provider2pending = dict()  # provider -> [(request, future)]
+        self.provider2timer = dict()  # provider -> timer handle
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    async def process_request(self, request: scrapy.Request, spider):
+        if not request.meta.get(self.BATCH_KEYWORD) or request.meta.get(self.BATCHED_KEYWORD):
+            return None
+        batch_size = getattr(spider, 'provider_batch_size', dict()).get(request.url.rstrip('/'), 1)
+        if batch_size <= 1:
+            return None
+
+        # wait for the batch response
+        request.meta[self.MEMBER_KEYWORD] = True
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self.provider2pending.setdefault(request.url, list())
+        pending.append((request, future))
+        if len(pending) >= batch_size:
+            self._flush(request.url)
+        elif self.provider2timer.get(request.url) is None:
+            self.provider2timer[request.url] = loop.call_later(
+                self.max_wait, self._flush, request.url,
+            )
+        return await future
+
+    def _flush(self, provider: str):
+        timer = self.provider2timer.pop(provider, None)
+        if timer is not None:
+            timer.cancel()
+        members = self.provider2pending.pop(provider, None)
+        if not members:
+            return
+
+        # pack the member bodies, the index of member is used as id
+        body = list()
+        for i, (request, _) in enumerate(members):
+            tx_obj = json.loads(request.body)
+            tx_obj['id'] = i
+            body.append(tx_obj)
+        batch_request = scrapy.Request(
+            url=provider,
+            method='POST',
+            headers={'Content-Type': 'application/json'},
+            body=json.dumps(body),
+            meta={self.BATCHED_KEYWORD: True},
+            priority=max([request.priority for request, _ in members]),
+            dont_filter=True,
+        )
+        self.log(
+            message='Send JSON-RPC batch with {} requests to {}'.format(len(members), provider),
+            level=logging.DEBUG,
+        )
+        dfd = self.crawler.engine.download(batch_request)
+        asyncio.ensure_future(self._dispatch(maybe_deferred_to_future(dfd), members))
+
+    async def _dispatch(self, future, members: list):
+        try:
+            response = await future
+        except Exception as e:
+            for _, member_future in members:
+                if not member_future.done():
+                    member_future.set_exception(e)
+            return
+
+        # load the array response, fall back to single requests if not supported
+        try:
+            data = fastjson.loads(response.body)
+        except json.decoder.JSONDecodeError:
+            data = None
+        if not isinstance(data, list):
+            _, throttled = get_response_outcome(response)
+            unsupported = not throttled and is_batch_unsupported(data)
+            if unsupported:
+                self.log(
+                    message='JSON-RPC batch is not supported by {}, '
+                            'fall back to single requests.'.format(response.url),
+                    level=logging.WARNING,
+                )
+                provider_batch_size = getattr(self.crawler.spider, 'provider_batch_size', dict())
+                provider_batch_size[response.url.rstrip('/')] = 1
+
+            # re-queue the members as batches if throttled or failed transiently
+            for request, member_future in members:
+                if member_future.done():
+                    continue
+                if unsupported:
+                    member_future.set_result(request.replace(
+                        meta={**request.meta, self.BATCH_KEYWORD: False},
+                        dont_filter=True,
+                    ))
+                    continue
+                member_future.set_result(self._retry_member(request))
+            return
+
+        # split the response, and re-queue the failed members
+        idx2result = {
+            rlt['id']: rlt for rlt in data
+            if isinstance(rlt, dict) and isinstance(rlt.get('id'), int)
+        }
+        for i, (request, member_future) in enumerate(members):
+            if member_future.done():
+                continue
+            result = idx2result.get(i)
+            if result is None or result.get('error') is not None:
+                member_future.set_result(self._retry_member(request))
+                continue
+            result['id'] = json.loads(request.body).get('id')
+            member_future.set_result(scrapy.http.TextResponse(
+                url=request.url,
+                status=response.status,
+                headers={'Content-Type': 'application/json'},
+                body=json.dumps(result).encode(),
+                encoding='utf-8',
+                request=request,
+            ))
+
+    def _retry_member(self, request: scrapy.Request) -> scrapy.Request:
+        retries = request.meta.get(self.RETRY_KEYWORD, 0) + 1
+        self.log(
+            message='Retry failed member of JSON-RPC batch ({}/{}): {}'.format(
+                retries, self.max_retries, request.body,
+            ),
+            level=logging.WARNING,
+        )
+        return request.replace(
+            meta={
+                **request.meta,
+                self.RETRY_KEYWORD: retries,
+                self.BATCH_KEYWORD: retries < self.max_retries,
+            },
+            dont_filter=True,
+        )
@@ -15,3 +15,27 @@ class LogMiddleware:
         Python logger too.
         """
         self.logger.log(level, message, **kwargs)
+
+
+class ProviderMiddleware(LogMiddleware):
+    def __init__(self):
+        self.provider_router = None
+
+    def _init_by_spider(self, spider):
+        if self.provider_router is not None:
+            return
+        self.provider_router = spider.provider_router
+
+    async def get_provider(self, method: str, block_number: int = None) -> str:
+        """
+        Get the provider routed by the method and block number.
+
+        :param method: the json-rpc method
+        :param block_number: the queried block number, none if latest
+        :return:
+        """
+        return await self.provider_router.get(
+            method=method,
+            block_number=block_number,
+            middleware=self.__class__.__name__,
+        )
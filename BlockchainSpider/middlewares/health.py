@@ -0,0 +1,86 @@
+import json
+from typing import Tuple, List
+
+import scrapy
+from twisted.internet import defer
+
+from BlockchainSpider.middlewares.defs import LogMiddleware
+
+THROTTLE_HTTP_STATUS = {429}
+THROTTLE_RPC_ERROR_CODES = {-32005, -32029, -32090, 429}
+THROTTLE_RPC_ERROR_KEYWORDS = ['rate limit', 'too many requests', 'limit exceeded', 'exceeded the limit']
+
+
+def get_response_outcome(response: scrapy.http.Response) -> Tuple[bool, bool]:
+    """
+    Detect the response is failed or throttled by the provider.
+    Note that only the small body is parsed, because the
+    errors of JSON-RPC are always small.
+
+    :param response:
+    :return: a tuple of (error, throttled)
+    """
+    if response.status in THROTTLE_HTTP_STATUS:
+        return True, True
+    if response.status >= 400:
+        return True, False
+
+    # the provider may be limited by TPS if the JSON is unterminated
+    body = response.body.rstrip()
+    if len(body) == 0 or body[-1:] not in {b'}', b']'}:
+        return True, True
+    if len(body) > 4096 or b'"error"' not in body:
+        return False, False
+
+    # check the error of JSON-RPC
+    try:
+        data = json.loads(body)
+    except json.decoder.JSONDecodeError:
+        return True, True
+    data = data if isinstance(data, list) else [data]
+    for rlt in data:
+        error = rlt.get('error') if isinstance(rlt, dict) else None
+        if not isinstance(error, dict):
+            continue
+        message = str(error.get('message', '')).lower()
+        if error.get('code') in THROTTLE_RPC_ERROR_CODES or \
+                any([keyword in message for keyword in THROTTLE_RPC_ERROR_KEYWORDS]):
+            return True, True
+    return False, False
+
+
+def get_provider_buckets(spider) -> List:
+    if getattr(spider, 'provider_router', None) is not None:
+        return spider.provider_router.buckets
+    if getattr(spider, 'provider_bucket', None) is not None:
+        return [spider.provider_bucket]
+    return list()
+
+
+class ProviderHealthMiddleware(LogMiddleware):
+    """
+    Feed the latency, errors and throttling of each response
+    back to the provider buckets of the spider.
+    Note that the priority should be larger than `UnterminatedJSONRetryMiddleware`,
+    so that the unterminated JSON is observed before retrying.
+    """
+
+    def process_response(self, request: scrapy.Request, response: scrapy.http.Response, spider):
+        # skip the responses which are not downloaded, e.g., split from a batch
+        latency = request.meta.get('download_latency')
+        if latency is None:
+            return response
+
+        error, throttled = get_response_outcome(response)
+        for bucket in get_provider_buckets(spider):
+            bucket.feedback(request.url, latency=latency, error=error, throttled=throttled)
+        return response
+
+    def process_exception(self, request: scrapy.Request, exception, spider):
+        if request.meta.get('_jsonrpc_batch_member'):
+            return None
+        if request.meta.get('_hedge_parent') or isinstance(exception, defer.CancelledError):
+            return None
+        for bucket in get_provider_buckets(spider):
+            bucket.feedback(request.url, error=True)
+        return None
@@ -0,0 +1,150 @@
+import asyncio
+import collections
+import json
+import logging
+
+import scrapy
+from scrapy.utils.defer import maybe_deferred_to_future
+
+from BlockchainSpider.middlewares.defs import LogMiddleware
+from BlockchainSpider.middlewares.health import get_response_outcome
+
+
+class HedgedRequestMiddleware(LogMiddleware):
+    """
+    Hedge the idempotent JSON-RPC reads for reducing the tail latency.
+    If the first attempt is slower than the learned latency percentile
+    of the method, a duplicate is sent to a different provider routed for the method,
+    and the first successful response wins while the other one is cancelled.
+
+    Hedging is enabled by the spider attribute `hedge_percentile`, e.g., 0.95.
+    """
+    HEDGE_METHODS = {'eth_getBlockByNumber', 'eth_getBlockReceipts', 'debug_traceBlockByNumber', 'trace_block'}
+    HEDGED_KEYWORD = '_hedged'
+    PARENT_KEYWORD = '_hedge_parent'
+    METHOD_KEYWORD = '_hedge_method'
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.min_samples = 20
+        self.method2latencies = dict()  # method -> deque of latency
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    async def process_request(self, request: scrapy.Request, spider):
+        percentile = getattr(spider, 'hedge_percentile', None)
+        if percentile is None or request.meta.get(self.HEDGED_KEYWORD):
+            return None
+        method = self._get_method(request)
+        if method not in self.HEDGE_METHODS:
+            return None
+        request.meta[self.METHOD_KEYWORD] = method
+
+        # learning the latency if the samples are not enough
+        delay = self._get_latency_percentile(method, percentile)
+        router = getattr(spider, 'provider_router', None)
+        if delay is None or router is None:
+            return None
+
+        # send the first attempt, and hedge if it is too slow
+        request.meta[self.PARENT_KEYWORD] = True
+        first = self._download(request, request.url)
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if len(done) > 0:
+            return first.result().replace(request=request)
+
+        # the hedge is routed as the request, and skips the providers not supporting the method
+        provider = await router.get_hedge(method, self._get_block_number(request), request.url)
+        if provider is None:
+            return (await first).replace(request=request)
+        self.crawler.stats.inc_value('hedge/sent')
+        self.log(
+            message='Hedge the slow request of {} to {}'.format(method, provider),
+            level=logging.DEBUG,
+        )
+        second = self._download(request, provider)
+
+        # the first successful response wins, and the other is cancelled,
+        # note that the responses of JSON-RPC errors are not successful
+        pending = {first, second}
+        while len(pending) > 0:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            succeeded = [future for future in done if self._is_succeeded(future)]
+            if len(succeeded) == 0:
+                continue
+            future = first if first in succeeded else succeeded[0]
+            for loser in pending:
+                loser.cancel()
+            if future is second:
+                self.crawler.stats.inc_value('hedge/won')
+            return future.result().replace(request=request)
+
+        # all the attempts failed, the error response is preferred for retrying
+        responded = [future for future in (first, second) if future.exception() is None]
+        future = responded[0] if len(responded) > 0 else first
+        return future.result().replace(request=request)
+
+    def process_response(self, request: scrapy.Request, response: scrapy.http.Response, spider):
+        method = request.meta.get(self.METHOD_KEYWORD)
+        latency = request.meta.get('download_latency')
+        if method is not None and latency is not None:
+            latencies = self.method2latencies.get(method)
+            if latencies is None:
+                latencies = collections.deque(maxlen=256)
+                self.method2latencies[method] = latencies
+            latencies.append(latency)
+        return response
+
+    def _download(self, request: scrapy.Request, provider: str) -> asyncio.Future:
+        attempt = request.replace(
+            url=provider,
+            meta={**request.meta, self.HEDGED_KEYWORD: True, self.PARENT_KEYWORD: False},
+            dont_filter=True,
+        )
+        dfd = self.crawler.engine.download(attempt)
+        return asyncio.ensure_future(maybe_deferred_to_future(dfd))
+
+    def _is_succeeded(self, future: asyncio.Future) -> bool:
+        if future.exception() is not None:
+            return False
+        response = future.result()
+        error, _ = get_response_outcome(response)
+        if error:
+            return False
+
+        # check the other errors of JSON-RPC, e.g., the method is not found
+        body = response.body
+        if len(body) > 4096 or b'"error"' not in body:
+            return True
+        try:
+            data = json.loads(body)
+        except json.decoder.JSONDecodeError:
+            return False
+        return not isinstance(data, dict) or data.get('error') is None
+
+    def _get_block_number(self, request: scrapy.Request):
+        # the block is the first param of the hedged methods, and none if latest
+        params = json.loads(request.body).get('params')
+        block = params[0] if isinstance(params, list) and len(params) > 0 else None
+        if isinstance(block, str) and block.startswith('0x'):
+            return int(block, 16)
+        return block if isinstance(block, int) else None
+
+    def _get_method(self, request: scrapy.Request):
+        if request.method != 'POST' or not request.body:
+            return None
+        try:
+            tx_obj = json.loads(request.body)
+        except json.decoder.JSONDecodeError:
+            return None
+        return tx_obj.get('method') if isinstance(tx_obj, dict) else None
+
+    def _get_latency_percentile(self, method: str, percentile: float):
+        latencies = self.method2latencies.get(method)
+        if latencies is None or len(latencies) < self.min_samples:
+            return None
+        latencies = sorted(latencies)
+        idx = min(len(latencies) - 1, int(len(latencies) * percentile))
+        return latencies[idx]
@@ -0,0 +1,189 @@
+import asyncio
+import bisect
+import heapq
+import logging
+import time
+
+import scrapy
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider
+
+from BlockchainSpider import settings
+from BlockchainSpider.items.sync import SyncItem
+from BlockchainSpider.middlewares.defs import LogMiddleware
+from BlockchainSpider.signals import sync_item_released
+
+
+class SyncOrderMiddleware(LogMiddleware):
+    """
+    Emit the `SyncItem` in the order of sync keys (e.g., block numbers),
+    which should be placed after the `SyncMiddleware` (i.e., with a smaller order).
+
+    The `SyncItem` is buffered until the items with all smaller keys are emitted,
+    where the keys are taken from the discrete `blocks` of spider if given,
+    and the missing keys are skipped if the gap lasts over `SYNC_ORDER_GAP_TIMEOUT` seconds,
+    or the buffer is full. The occupancy and the stall time are exported to the stats
+    with the prefix `sync_order/`.
+    """
+    FLUSH_KEYWORD = '_sync_order_flush'
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.enabled = getattr(settings, 'SYNC_ORDER_ENABLED', False)
+        self.gap_timeout = getattr(settings, 'SYNC_ORDER_GAP_TIMEOUT', 60)
+        self.max_buffer = getattr(settings, 'SYNC_ORDER_MAX_BUFFER', 1024)
+
+        self.next_key = None
+        self._blocks = None  # the sorted discrete keys of spider, or none if continuous
+        self.key2item = dict()  # sync_key -> SyncItem
+        self._keys = list()  # the heap of buffered keys
+        self._bypassed_keys = set()  # the keys released without passing through, e.g., by errbacks
+        self._stall_time = None
+        self._timer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls(crawler)
+        if middleware.enabled:
+            crawler.signals.connect(middleware.sync_item_released, signal=sync_item_released)
+            crawler.signals.connect(middleware.spider_idle, signal=signals.spider_idle)
+        return middleware
+
+    async def process_spider_output(self, response: scrapy.http.Response, result, spider):
+        if not self.enabled or response.meta.get(self.FLUSH_KEYWORD):
+            async for item in result:
+                yield item
+            return
+
+        async for item in result:
+            if not isinstance(item, SyncItem) or not isinstance(item['key'], int):
+                yield item
+                continue
+            self._bypassed_keys.discard(item['key'])
+            for _item in self._push(item, spider):
+                yield _item
+
+        # skip the gap if timeout
+        for item in self._release(spider, force=self._is_timeout()):
+            yield item
+
+    def sync_item_released(self, item, spider):
+        # the sync item passing through is received right after the signal,
+        # otherwise, it is emitted by the error callbacks without passing through
+        if isinstance(item['key'], int):
+            self._bypassed_keys.add(item['key'])
+
+    def spider_idle(self, spider):
+        if len(self.key2item) == 0:
+            return
+        self._schedule_flush(drain=True)
+        raise DontCloseSpider
+
+    def _push(self, item: SyncItem, spider):
+        key = item['key']
+        if self.next_key is None:
+            blocks = getattr(spider, 'blocks', None)
+            if isinstance(blocks, list) and len(blocks) > 0:
+                self._blocks = sorted(set(blocks))
+            start_block = self._blocks[0] if self._blocks is not None else getattr(spider, 'start_block', None)
+            self.next_key = start_block if isinstance(start_block, int) and 0 <= start_block <= key else key
+
+        # emit the late items directly, e.g., the reorged blocks
+        if key < self.next_key:
+            yield item
+            return
+        if self.key2item.get(key) is None:
+            heapq.heappush(self._keys, key)
+        self.key2item[key] = item
+        yield from self._release(spider, force=len(self.key2item) > self.max_buffer)
+
+    def _release(self, spider, force: bool = False):
+        # skip the gap to the smallest buffered key if forced
+        if force and len(self._keys) > 0 and self._keys[0] > self.next_key:
+            self.log(
+                message='Skip the sync keys from {} to {}'.format(self.next_key, self._keys[0] - 1),
+                level=logging.WARNING,
+            )
+            self.crawler.stats.inc_value('sync_order/skipped', self._count_keys(self.next_key, self._keys[0]))
+            self.next_key = self._keys[0]
+
+        # release the contiguous run
+        released = False
+        checkpoint = getattr(spider, 'checkpoint', None)
+        while len(self._keys) > 0:
+            if self._keys[0] < self.next_key:
+                heapq.heappop(self._keys)
+                continue
+            if self._keys[0] == self.next_key:
+                heapq.heappop(self._keys)
+                yield self.key2item.pop(self.next_key)
+            elif not (
+                    self.next_key in self._bypassed_keys
+                    or (checkpoint is not None and self.next_key in checkpoint)
+            ):
+                break
+            self._bypassed_keys.discard(self.next_key)
+            self.next_key = self._get_next_key(self.next_key)
+            released = True
+        self._update_stall(released)
+
+    def _get_next_key(self, key: int) -> int:
+        if self._blocks is None:
+            return key + 1
+        idx = bisect.bisect_right(self._blocks, key)
+        return self._blocks[idx] if idx < len(self._blocks) else key + 1
+
+    def _count_keys(self, start: int, end: int) -> int:
+        # the number of expected keys in [start, end)
+        if self._blocks is None:
+            return end - start
+        return bisect.bisect_left(self._blocks, end) - bisect.bisect_left(self._blocks, start)
+
+    def _update_stall(self, released: bool):
+        now = time.monotonic()
+        if self._stall_time is not None and (released or len(self.key2item) == 0):
+            self.crawler.stats.inc_value('sync_order/stall_time', now - self._stall_time)
+            self._stall_time = None
+        if self._stall_time is None and len(self.key2item) > 0:
+            self._stall_time = now
+            self._schedule_timer()
+        self.crawler.stats.set_value('sync_order/buffered', len(self.key2item))
+        self.crawler.stats.max_value('sync_order/max_buffered', len(self.key2item))
+
+    def _is_timeout(self) -> bool:
+        return self._stall_time is not None and time.monotonic() - self._stall_time >= self.gap_timeout
+
+    def _schedule_timer(self):
+        if self._timer is not None:
+            return
+        self._timer = asyncio.get_running_loop().call_later(self.gap_timeout, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        if self._stall_time is None:
+            return
+        if not self._is_timeout():
+            self._schedule_timer()
+            return
+        self._schedule_flush()
+
+    def _schedule_flush(self, drain: bool = False):
+        # emit the buffered items through a local request,
+        # because the items can only be emitted in the spider output
+        self.crawler.engine.crawl(scrapy.Request(
+            url='data:application/json,{}',
+            callback=self._parse_flush,
+            meta={self.FLUSH_KEYWORD: True},
+            cb_kwargs={'drain': drain},
+            priority=2 ** 32,
+            dont_filter=True,
+        ))
+
+    def _parse_flush(self, response: scrapy.http.Response, drain: bool):
+        # skip the current gap if timeout, or release all items if the spider is idle
+        spider = self.crawler.spider
+        if not drain:
+            yield from self._release(spider, force=self._is_timeout())
+            return
+        while len(self.key2item) > 0:
+            yield from self._release(spider, force=True)
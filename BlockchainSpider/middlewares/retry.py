@@ -4,6 +4,7 @@ import logging
 from scrapy.utils.request import fingerprint
 
 from BlockchainSpider.middlewares.defs import LogMiddleware
+from BlockchainSpider.utils import fastjson
 
 
 class UnterminatedJSONRetryMiddleware(LogMiddleware):
@@ -14,8 +15,7 @@ class UnterminatedJSONRetryMiddleware(LogMiddleware):
     async def process_response(self, request, response, spider):
         req_finger = fingerprint(request)
         try:
-            data = response.text
-            json.loads(data)
+            fastjson.loads(response.body)
             if req_finger in self.request2cnt:
                 del self.request2cnt[req_finger]
             return response
@@ -1,166 +1,277 @@
 import asyncio
+import collections
 import logging
-from typing import Callable, Generator, AsyncGenerator, Union, List
+from typing import Generator, AsyncGenerator, Union, List
 
 import scrapy
-from scrapy.utils.request import fingerprint
+from scrapy import signals
 
+from BlockchainSpider import settings
+from BlockchainSpider.signals import sync_item_released
+from BlockchainSpider.items.batch import ItemBatch
 from BlockchainSpider.items.sync import SyncItem
 from BlockchainSpider.middlewares.defs import LogMiddleware
+from BlockchainSpider.utils.spill import SpillFile, estimate_item_size
+
+
+class _SyncState:
+    """
+    The reference counter of a sync key, which is shared by
+    the requests of the key through `request.meta`.
+    """
+    __slots__ = ('key', 'count', 'items', 'size', 'spill', 'failed')
+
+    def __init__(self, key):
+        self.key = key
+        self.count = 0  # the number of unreleased requests
+        self.items = dict()  # cls_name -> items
+        self.size = 0  # the estimated bytes of cached items
+        self.spill = None  # the spill file of items exceeding the memory budget
+        self.failed = False  # some data of the key is lost for good
 
 
 class SyncMiddleware(LogMiddleware):
     SYNC_KEYWORD = '$sync'
+    STATE_KEYWORD = '$sync_state'
+    ERRBACK_KEYWORD = '$sync_errback'
 
     def __init__(self):
-        self.request2key = dict()  # request -> sync_key
-        self.key2sem = dict()  # sync_key -> semaphore (int)
-        self.key2items = dict()  # sync_key -> items
-        self._lock = asyncio.Lock()
+        self.key2state = dict()  # sync_key -> state
+        self.crawler = None
+
+        # the memory budget (in bytes) of cached items for each sync key,
+        # the items are spilled to the local file if exceeded
+        self.memory_budget = getattr(settings, 'SYNC_MEMORY_BUDGET', None)
+        self.spill_dir = getattr(settings, 'SYNC_SPILL_DIR', None)
+
+        # the maximum number of in-flight sync keys,
+        # new keys from the untracked responses wait if exceeded
+        self.max_keys = getattr(settings, 'SYNC_MAX_KEYS', None)
+        self._key_waiters = collections.deque()
+
+        # cache the items of each class in a columnar batch, instead of a list of items
+        self.columnar = getattr(settings, 'SYNC_COLUMNAR', False)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls()
+        middleware.crawler = crawler
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_closed(self, spider):
+        for state in self.key2state.values():
+            if state.spill is not None:
+                state.spill.remove()
 
     async def process_spider_output(self, response: scrapy.http.Response, result, spider):
         # listen each request for tracing sync process
         key = response.cb_kwargs.get(self.SYNC_KEYWORD)
-        parent_fingerprint = fingerprint(response.request)
+        parent_state = response.request.meta.get(self.STATE_KEYWORD)
+        state = parent_state if parent_state is not None else self.key2state.get(key)
 
         # add acquiring for the key
         # to ensure that the sync process will not be released in advance
-        sem = self.key2sem.get(key)
-        if sem is not None:
-            sem.release()
+        if state is not None:
+            state.count += 1
 
         # process all items
         async for item in result:
             # add item to the sync cache
             if not isinstance(item, scrapy.Request):
-                if self.key2items.get(key) is None:
+                if state is None:
                     yield item
                     continue
-                cls_name = item.__class__.__name__
-                if not self.key2items[key].get(cls_name):
-                    self.key2items[key][cls_name] = list()
-                self.key2items[key][cls_name].append(item)
+                self._cache_item(state, item)
                 continue
 
+            # wait for the in-flight keys before starting a new task
+            if parent_state is None and self.max_keys is not None:
+                await self._wait_for_new_key(item.cb_kwargs.get(self.SYNC_KEYWORD))
+
             # handle new request
-            request = await self._handle_new_request(
+            yield self._handle_new_request(
                 request=item,
                 parent_key=key,
-                parent_fingerprint=parent_fingerprint,
+                parent_state=parent_state,
             )
-            yield request
-        if sem is not None:
-            await sem.acquire()
+        if state is not None:
+            state.count -= 1
 
         # release!
-        await self._lock.acquire()
-        yield await self._release_sync_item(parent_fingerprint)
-        self._lock.release()
-
-    def make_errback(self, old_errback) -> Callable:
-        async def new_errback(failure):
-            # reload context data and log out
-            parent_request = failure.request
-            parent_fingerprint = fingerprint(parent_request)
+        yield self._release_sync_item(response.request)
+
+    async def errback(self, failure):
+        # reload context data and log out
+        parent_request = failure.request
+        parent_state = parent_request.meta.get(self.STATE_KEYWORD)
+        self.log(
+            message='Get error when fetching {}'.format(parent_request.url),
+            level=logging.WARNING,
+        )
+
+        # wrap the old error callback
+        old_errback = parent_request.meta.get(self.ERRBACK_KEYWORD)
+        old_results = old_errback(failure) if old_errback else None
+        if isinstance(old_results, Generator):
+            old_results = [rlt for rlt in old_results]
+        if isinstance(old_results, AsyncGenerator):
+            _old_results = list()
+            async for rlt in old_results:
+                _old_results.append(rlt)
+            old_results = _old_results
+
+        # trace requests in the error callback
+        # note that the item in the error callback will be skipped
+        if isinstance(old_results, List):
+            parent_key = parent_state.key if parent_state is not None else None
+            for item in old_results:
+                if not isinstance(item, scrapy.Request):
+                    yield item
+                    continue
+                yield self._handle_new_request(
+                    request=item,
+                    parent_key=parent_key,
+                    parent_state=parent_state,
+                )
+
+        # generate sync item (when the response fails)
+        yield self._release_sync_item(parent_request)
+
+    @classmethod
+    def mark_failed(cls, request: scrapy.Request):
+        """
+        Mark the sync key of the request failed, i.e., the items of the key are incomplete,
+        so that the key is not committed to the checkpoint and re-fetched when resuming.
+
+        :param request: the request of the key, e.g., `response.request` in the callback
+        :return:
+        """
+        state = request.meta.get(cls.STATE_KEYWORD)
+        if state is not None:
+            state.failed = True
+
+    def _cache_item(self, state: _SyncState, item):
+        cls_name = item.__class__.__name__
+        if state.items.get(cls_name) is None:
+            state.items[cls_name] = self._new_items(item.__class__)
+        state.items[cls_name].append(item)
+        if self.memory_budget is None:
+            return
+
+        # spill the cached items if the budget is exceeded
+        state.size += estimate_item_size(item)
+        if state.size <= self.memory_budget:
+            return
+        if state.spill is None:
+            state.spill = SpillFile(dirname=self.spill_dir, prefix='sync_')
             self.log(
-                message='Get error when fetching {}'.format(parent_request.url),
-                level=logging.WARNING,
+                message="Spill the items of {} to {}".format(state.key, state.spill.filename),
+                level=logging.INFO,
             )
+            self._inc_stats('sync/spilled_keys')
+        for cls_name, items in state.items.items():
+            for _item in items:
+                state.spill.append(cls_name, _item)
+            self._inc_stats('sync/spilled_items', len(items))
+        state.items = dict()
+        state.size = 0
+
+    async def _wait_for_new_key(self, key):
+        while key is not None and key not in self.key2state and len(self.key2state) >= self.max_keys:
+            future = asyncio.get_running_loop().create_future()
+            self._key_waiters.append(future)
+            await future
 
-            # wrap the old error callback
-            old_results = old_errback(failure) if old_errback else None
-            if isinstance(old_results, Generator):
-                old_results = [rlt for rlt in old_results]
-            if isinstance(old_results, AsyncGenerator):
-                _old_results = list()
-                async for rlt in old_results:
-                    _old_results.append(rlt)
-                old_results = _old_results
-
-            # trace requests in the error callback
-            # note that the item in the error callback will be skipped
-            if isinstance(old_results, List):
-                parent_key = self.request2key.get(parent_fingerprint)
-                for item in old_results:
-                    if not isinstance(item, scrapy.Request):
-                        yield item
-                        continue
-                    request = await self._handle_new_request(
-                        request=item,
-                        parent_key=parent_key,
-                        parent_fingerprint=parent_fingerprint,
-                    )
-                    yield request
-
-            # generate sync item (when the response fails)
-            await self._lock.acquire()
-            yield await self._release_sync_item(parent_fingerprint)
-            self._lock.release()
-
-        return new_errback
-
-    async def _handle_new_request(
+    def _notify_key_waiter(self):
+        while len(self._key_waiters) > 0:
+            future = self._key_waiters.popleft()
+            if not future.done():
+                future.set_result(None)
+                return
+
+    def _inc_stats(self, key: str, count: int = 1):
+        if self.crawler is None:
+            return
+        self.crawler.stats.inc_value(key, count)
+
+    def _handle_new_request(
             self, request: scrapy.Request,
-            parent_key, parent_fingerprint,
+            parent_key, parent_state: Union[_SyncState, None],
     ) -> scrapy.Request:
         # handle error in the new request
         # and append sync key to the cb_kwargs
-        sync_key = request.cb_kwargs.get(self.SYNC_KEYWORD)
-        if sync_key is None:
-            sync_key = parent_key
-        cb_kwargs = dict()
+        own_key = request.cb_kwargs.get(self.SYNC_KEYWORD)
+        sync_key = own_key if own_key is not None else parent_key
         if sync_key is not None:
-            cb_kwargs[self.SYNC_KEYWORD] = sync_key
-        cb_kwargs.update(request.cb_kwargs)
-        errback_request = request.replace(
-            errback=self.make_errback(request.errback),
-            cb_kwargs=cb_kwargs,
-        )
+            request.cb_kwargs[self.SYNC_KEYWORD] = sync_key
+        if request.errback != self.errback:
+            request.meta[self.ERRBACK_KEYWORD] = request.errback
+            request.errback = self.errback
 
-        # trace requests with a new task
-        # note that we use the locked semaphore as the sync signal
-        # so the semaphore is released when creating new task
-        if request.cb_kwargs.get(self.SYNC_KEYWORD) is not None:
-            sync_key = request.cb_kwargs[self.SYNC_KEYWORD]
-            req_fingerprint = fingerprint(request)
-            await self._lock.acquire()
-            sem = self.key2sem.get(sync_key)
-            if sem is None:
-                self.key2sem[sync_key] = asyncio.Semaphore(value=0)
-                self.key2items[sync_key] = dict()
-            self.key2sem[sync_key].release()
-            self.request2key[req_fingerprint] = sync_key
-            self._lock.release()
-            return errback_request
-
-        # trace extra generated requests
-        await self._lock.acquire()
-        sync_key = self.request2key.get(parent_fingerprint)
-        if sync_key is None:
-            self._lock.release()
-            return errback_request
-        req_fingerprint = fingerprint(request)
-        self.request2key[req_fingerprint] = sync_key
-        self.key2sem[sync_key].release()
-        self._lock.release()
-        return errback_request
-
-    async def _release_sync_item(self, parent_fingerprint) -> Union[SyncItem, None]:
-        sync_key = self.request2key.get(parent_fingerprint)
-        if sync_key is None:
-            return
+        # trace requests with a new task,
+        # or trace extra generated requests of the parent task
+        state = parent_state
+        if own_key is not None:
+            state = self.key2state.get(own_key)
+            if state is None:
+                state = _SyncState(own_key)
+                self.key2state[own_key] = state
+        if state is None:
+            request.meta.pop(self.STATE_KEYWORD, None)
+            return request
+        state.count += 1
+        request.meta[self.STATE_KEYWORD] = state
+        return request
 
-        # update the semaphore
-        await self.key2sem[sync_key].acquire()
-        del self.request2key[parent_fingerprint]
-        if not self.key2sem[sync_key].locked():
+    def _release_sync_item(self, request: scrapy.Request) -> Union[SyncItem, None]:
+        # each request is released only once
+        state = request.meta.get(self.STATE_KEYWORD)
+        if state is None:
+            return
+        request.meta[self.STATE_KEYWORD] = None
+        state.count -= 1
+        if state.count > 0:
             return
 
         # clean up the cache if synced
         self.log(
-            message="Synchronized: {}".format(sync_key),
+            message="Synchronized: {}".format(state.key),
             level=logging.INFO,
         )
-        del self.key2sem[sync_key]
-        items = self.key2items.pop(sync_key)
-        return SyncItem(key=sync_key, data=items)
+        if self.key2state.get(state.key) is state:
+            del self.key2state[state.key]
+            self._notify_key_waiter()
+        item = SyncItem(key=state.key, data=self._load_items(state))
+        if state.failed:
+            item['failed'] = True
+            self._inc_stats('sync/failed_keys')
+        if self.crawler is not None:
+            self.crawler.signals.send_catch_log(
+                signal=sync_item_released,
+                item=item,
+                spider=self.crawler.spider,
+            )
+        return item
+
+    def _new_items(self, item_cls) -> Union[list, ItemBatch]:
+        return ItemBatch(item_cls) if self.columnar else list()
+
+    def _load_items(self, state: _SyncState) -> dict:
+        if state.spill is None:
+            return state.items
+
+        # stream the spilled items back in order,
+        # and then append the items cached in memory
+        items = dict()
+        for cls_name, item in state.spill:
+            if items.get(cls_name) is None:
+                items[cls_name] = self._new_items(item.__class__)
+            items[cls_name].append(item)
+        state.spill.remove()
+        for cls_name, _items in state.items.items():
+            for item in _items:
+                if items.get(cls_name) is None:
+                    items[cls_name] = self._new_items(item.__class__)
+                items[cls_name].append(item)
+        return items
@@ -0,0 +1,95 @@
+import hashlib
+import logging
+import time
+import urllib.parse
+
+import scrapy
+
+from BlockchainSpider.middlewares.defs import LogMiddleware
+from BlockchainSpider.middlewares.health import get_response_outcome, get_provider_buckets
+
+
+class AdaptiveConcurrencyMiddleware(LogMiddleware):
+    """
+    Control the concurrency of each provider in an AIMD way, i.e.,
+    the concurrency is decreased multiplicatively when the provider is throttled
+    (e.g., unterminated JSON, HTTP 429 or rate-limit errors of JSON-RPC),
+    and increased additively when the request is succeeded.
+
+    Each provider has an individual download slot,
+    and the live concurrency is exported to the stats with the prefix `aimd/`.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self.min_concurrency = crawler.settings.getint('AIMD_MIN_CONCURRENCY', 1)
+        self.max_concurrency = crawler.settings.getint(
+            'AIMD_MAX_CONCURRENCY', crawler.settings.getint('CONCURRENT_REQUESTS'),
+        )
+        self.start_concurrency = crawler.settings.getint('CONCURRENT_REQUESTS_PER_DOMAIN')
+        self.decrease_factor = crawler.settings.getfloat('AIMD_DECREASE_FACTOR', 0.5)
+        self.provider2limit = dict()  # provider -> concurrency
+        self.provider2decrease_time = dict()  # provider -> timestamp
+        self._providers = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_request(self, request: scrapy.Request, spider):
+        provider = self._get_provider(request, spider)
+        if provider is None:
+            return None
+        request.meta['download_slot'] = provider
+        if self.provider2limit.get(provider) is None:
+            self.provider2limit[provider] = float(min(self.start_concurrency, self.max_concurrency))
+            self._apply_limit(provider)
+        return None
+
+    def process_response(self, request: scrapy.Request, response: scrapy.http.Response, spider):
+        provider = request.meta.get('download_slot')
+        limit = self.provider2limit.get(provider)
+        if limit is None or request.meta.get('download_latency') is None:
+            return response
+
+        # multiplicative decrease, at most once per latency window
+        _, throttled = get_response_outcome(response)
+        if throttled:
+            now = time.time()
+            if now - self.provider2decrease_time.get(provider, 0) < request.meta['download_latency']:
+                return response
+            self.provider2decrease_time[provider] = now
+            self.provider2limit[provider] = max(self.min_concurrency, limit * self.decrease_factor)
+            self.log(
+                message='Decrease the concurrency of throttled provider to {:.1f}: {}'.format(
+                    self.provider2limit[provider], request.url,
+                ),
+                level=logging.INFO,
+            )
+
+        # additive increase, about one per round trip
+        else:
+            self.provider2limit[provider] = min(self.max_concurrency, limit + 1 / limit)
+        self._apply_limit(provider)
+        return response
+
+    def _get_provider(self, request: scrapy.Request, spider):
+        if self._providers is None:
+            self._providers = {
+                str(item).rstrip('/')
+                for bucket in get_provider_buckets(spider)
+                for item in bucket.items
+            }
+        provider = request.url.rstrip('/')
+        return provider if provider in self._providers else None
+
+    def _apply_limit(self, provider: str):
+        concurrency = int(self.provider2limit[provider])
+        slot = self.crawler.engine.downloader.slots.get(provider)
+        if slot is not None:
+            slot.concurrency = concurrency
+
+        # export to the stats without leaking the apikey in the url
+        url = urllib.parse.urlparse(provider)
+        name = '%s_%s' % (url.hostname, hashlib.sha1(provider.encode()).hexdigest()[:8])
+        self.crawler.stats.set_value('aimd/concurrency/%s' % name, concurrency)
@@ -2,5 +2,6 @@ from .contract import ContractMiddleware
 from .token import TokenTransferMiddleware, TokenPropertyMiddleware
 from .metadata import MetadataMiddleware
 from .receipt import TransactionReceiptMiddleware
+from .logs import EventLogRangeMiddleware
 from .trace import TraceMiddleware
 from .dcfg import DCFGMiddleware
@@ -4,22 +4,14 @@ import scrapy
 
 from BlockchainSpider.items import TransactionReceiptItem
 from BlockchainSpider.items.evm import ContractItem
-from BlockchainSpider.middlewares.defs import LogMiddleware
+from BlockchainSpider.middlewares.defs import ProviderMiddleware
+from BlockchainSpider.utils import fastjson
 from BlockchainSpider.utils.decorator import log_debug_tracing
 
 
-class ContractMiddleware(LogMiddleware):
+class ContractMiddleware(ProviderMiddleware):
     def __init__(self):
-        self.provider_bucket = None
-
-    def _init_by_spider(self, spider):
-        if self.provider_bucket is not None:
-            return
-        if getattr(spider, 'middleware_providers') and \
-                spider.middleware_providers.get(self.__class__.__name__):
-            self.provider_bucket = spider.middleware_providers[self.__class__.__name__]
-        else:
-            self.provider_bucket = spider.provider_bucket
+        super().__init__()
 
     async def process_spider_output(self, response, result, spider):
         self._init_by_spider(spider)
@@ -37,7 +29,7 @@ class ContractMiddleware(LogMiddleware):
 
     @log_debug_tracing
     async def parse_contract_item(self, response: scrapy.http.Response, **kwargs):
-        result = json.loads(response.text)
+        result = fastjson.loads(response.body)
         result = result.get('result')
         if result is None or result == '0x':
             return
@@ -54,7 +46,7 @@ class ContractMiddleware(LogMiddleware):
             priority: int, cb_kwargs: dict
     ) -> scrapy.Request:
         return scrapy.Request(
-            url=await self.provider_bucket.get(),
+            url=await self.get_provider('eth_getCode', int(block_tag, 16)),
             method='POST',
             headers={'Content-Type': 'application/json'},
             body=json.dumps({
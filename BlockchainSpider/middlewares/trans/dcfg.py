@@ -7,6 +7,7 @@ from pyevmasm import evmasm
 
 from BlockchainSpider.items import DCFGBlockItem, DCFGEdgeItem
 from BlockchainSpider.middlewares.trans import TraceMiddleware
+from BlockchainSpider.utils import fastjson
 from BlockchainSpider.utils.decorator import log_debug_tracing
 
 JS_TRACER = """{
@@ -149,7 +150,7 @@ class DCFGMiddleware(TraceMiddleware):
 
     @log_debug_tracing
     async def parse_debug_trace_block(self, response: scrapy.http.Response, **kwargs):
-        data = json.loads(response.text)
+        data = fastjson.loads(response.body)
         data = data.get('result')
         if data is None:
             self.log(
@@ -170,7 +171,7 @@ class DCFGMiddleware(TraceMiddleware):
 
     @log_debug_tracing
     async def parse_debug_transaction(self, response: scrapy.http.Response, **kwargs):
-        result = json.loads(response.text)
+        result = fastjson.loads(response.body)
         result = result.get('result')
         if result is None:
             self.log(
@@ -225,7 +226,7 @@ class DCFGMiddleware(TraceMiddleware):
             self, block_number: int, priority: int, cb_kwargs: dict
     ) -> scrapy.Request:
         return scrapy.Request(
-            url=await self.provider_bucket.get(),
+            url=await self.get_provider('debug_traceBlockByNumber', block_number),
             method='POST',
             headers={'Content-Type': 'application/json'},
             body=json.dumps({
@@ -243,7 +244,7 @@ class DCFGMiddleware(TraceMiddleware):
             self, txhash: str, priority: int, cb_kwargs: dict
     ) -> scrapy.Request:
         return scrapy.Request(
-            url=await self.provider_bucket.get(),
+            url=await self.get_provider('debug_traceTransaction', cb_kwargs.get('block_number')),
             method='POST',
             headers={'Content-Type': 'application/json'},
             body=json.dumps({
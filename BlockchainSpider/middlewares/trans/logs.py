@@ -0,0 +1,239 @@
+import asyncio
+import bisect
+import json
+import logging
+
+import scrapy
+from scrapy.utils.defer import maybe_deferred_to_future
+
+from BlockchainSpider import settings
+from BlockchainSpider.items import EventLogItem, BlockItem
+from BlockchainSpider.middlewares.defs import ProviderMiddleware
+from BlockchainSpider.middlewares.health import THROTTLE_HTTP_STATUS, THROTTLE_RPC_ERROR_KEYWORDS
+from BlockchainSpider.middlewares.sync import SyncMiddleware
+from BlockchainSpider.signals import sync_item_released
+from BlockchainSpider.utils import fastjson
+from BlockchainSpider.utils.decorator import log_debug_tracing
+from BlockchainSpider.utils.token import ERC20_TRANSFER_TOPIC, ERC1155_SINGLE_TRANSFER_TOPIC, \
+    ERC1155_BATCH_TRANSFER_TOPIC, TOKEN_APPROVE_TOPIC, TOKEN_APPROVE_ALL_TOPIC
+from BlockchainSpider.utils.web3 import hex_to_dec
+
+TOKEN_LOG_TOPICS = [
+    ERC20_TRANSFER_TOPIC,  # the same as the erc721 transfer topic
+    ERC1155_SINGLE_TRANSFER_TOPIC,
+    ERC1155_BATCH_TRANSFER_TOPIC,
+    TOKEN_APPROVE_TOPIC,
+    TOKEN_APPROVE_ALL_TOPIC,
+]
+
+
+class EventLogRangeMiddleware(ProviderMiddleware):
+    """
+    Fetch the token event logs by `eth_getLogs` over multi-block ranges,
+    which is an alternative to `TransactionReceiptMiddleware` for the token-only workloads.
+
+    The blocks nearby share one range query, and the logs are emitted as `EventLogItem`s
+    in the sync process of each block. The range is halved on the "too many results" errors
+    (rather than the rate limits or transport errors, which are retried), and doubled when the number of results is less than `EVENT_LOG_RANGE_TARGET_RESULTS`.
+    """
+    TOO_MANY_RESULTS_CODES = {-32005}
+    TOO_MANY_RESULTS_HINTS = [
+        'more than', 'too many results', 'too large', 'too wide', 'response size', 'block range', 'limited to',
+    ]
+    THROTTLE_HINTS = [*THROTTLE_RPC_ERROR_KEYWORDS, 'capacity', 'per second', 'request count']
+
+    def __init__(self):
+        super().__init__()
+        self.range_size = getattr(settings, 'EVENT_LOG_RANGE_SIZE', 100)
+        self.max_range_size = getattr(settings, 'EVENT_LOG_RANGE_MAX_SIZE', 2000)
+        self.target_results = getattr(settings, 'EVENT_LOG_RANGE_TARGET_RESULTS', 2000)
+        self.max_retries = getattr(settings, 'EVENT_LOG_RANGE_MAX_RETRIES', 3)
+        self._block2range = dict()  # block_number -> future of {block_number: [log]}
+        self._covered = list()  # sorted [start, end] of the blocks queried by ranges
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls()
+        crawler.signals.connect(middleware.sync_item_released, signal=sync_item_released)
+        return middleware
+
+    def sync_item_released(self, item, spider):
+        # release the range of the block never fetched, e.g., the block request failed
+        self._block2range.pop(item['key'], None)
+
+    async def process_spider_output(self, response, result, spider):
+        self._init_by_spider(spider)
+        async for item in result:
+            yield item
+            if not isinstance(item, BlockItem):
+                continue
+
+            # start the range query covering the block,
+            # and emit the logs in a local request of the block
+            block_number = item['block_number']
+            future = self._block2range.get(block_number)
+            if future is None:
+                future = self._start_range(block_number, spider)
+            yield scrapy.Request(
+                url='data:application/json,{}',
+                callback=self.parse_block_logs,
+                priority=response.request.priority,
+                cb_kwargs={
+                    '@block_number': block_number,
+                    '@timestamp': item['timestamp'],
+                    '@logs': future,
+                },
+                dont_filter=True,
+            )
+
+    @log_debug_tracing
+    async def parse_block_logs(self, response: scrapy.http.Response, **kwargs):
+        # the block is fetched by a new range query if it is re-fetched later, e.g., reorged
+        block_number, future = kwargs['@block_number'], kwargs['@logs']
+        if self._block2range.get(block_number) is future:
+            del self._block2range[block_number]
+        try:
+            block2logs = await future
+        except Exception as e:
+            self.log(
+                message='Failed to fetch the event logs of block #{}: {}'.format(block_number, e),
+                level=logging.ERROR,
+            )
+            SyncMiddleware.mark_failed(response.request)
+            return
+
+        for log in block2logs.get(block_number, list()):
+            yield EventLogItem(
+                transaction_hash=log.get('transactionHash', ''),
+                log_index=log.get('logIndex'),
+                block_number=block_number,
+                timestamp=kwargs['@timestamp'],
+                address=log.get('address', '').lower(),
+                topics=log.get('topics', list()),
+                data=log.get('data', ''),
+                removed=log.get('removed', False),
+            )
+
+    def _start_range(self, block_number: int, spider) -> asyncio.Future:
+        start_block, end_block = block_number, block_number
+        if getattr(spider, 'blocks', None) is None:
+            start_block, end_block = self._get_range(block_number, spider)
+        future = asyncio.ensure_future(self._fetch_logs(start_block, end_block, spider))
+        for blk in range(start_block, end_block + 1):
+            self._block2range[blk] = future
+        self._cover(start_block, end_block)
+        return future
+
+    def _cover(self, start_block: int, end_block: int):
+        # merge the range with the overlapped or adjacent intervals
+        idx = bisect.bisect_left(self._covered, [start_block, start_block])
+        if idx > 0 and self._covered[idx - 1][1] >= start_block - 1:
+            idx -= 1
+        while idx < len(self._covered) and self._covered[idx][0] <= end_block + 1:
+            start_block = min(start_block, self._covered[idx][0])
+            end_block = max(end_block, self._covered[idx][1])
+            del self._covered[idx]
+        self._covered.insert(idx, [start_block, end_block])
+
+    def _is_covered(self, block_number: int) -> bool:
+        idx = bisect.bisect_right(self._covered, [block_number, float('inf')]) - 1
+        return idx >= 0 and self._covered[idx][1] >= block_number
+
+    def _get_range(self, block_number: int, spider) -> tuple:
+        # the range is aligned by the range size, and limited by
+        # the known blocks, i.e., the end block or the confirmed chain head
+        upper = getattr(spider, 'end_block', None)
+        if upper is None and self.provider_router.head is not None:
+            upper = self.provider_router.head - getattr(spider, 'confirmations', 0)
+        upper = max(upper, block_number) if upper is not None else block_number
+        lower = max(block_number - block_number % self.range_size, getattr(spider, 'start_block', 0))
+        upper = min(upper, lower + self.range_size - 1)
+
+        # skip the blocks queried by other ranges and the completed blocks
+        checkpoint = getattr(spider, 'checkpoint', None)
+        is_available = lambda blk: not self._is_covered(blk) and (checkpoint is None or blk not in checkpoint)
+        start_block, end_block = block_number, block_number
+        while start_block - 1 >= lower and is_available(start_block - 1):
+            start_block -= 1
+        while end_block + 1 <= upper and is_available(end_block + 1):
+            end_block += 1
+        return start_block, end_block
+
+    async def _fetch_logs(self, start_block: int, end_block: int, spider, retries: int = 0) -> dict:
+        response, data, error = None, None, None
+        try:
+            response = await self._request_logs(start_block, end_block, spider)
+            data = fastjson.loads(response.body)
+        except Exception as e:
+            error = str(e)
+        result = data.get('result') if isinstance(data, dict) else None
+
+        # group the logs by blocks, and grow the range if the results are few
+        if isinstance(result, list):
+            if len(result) < self.target_results and end_block - start_block + 1 >= self.range_size:
+                self.range_size = min(self.range_size * 2, self.max_range_size)
+            block2logs = dict()
+            for log in result:
+                block2logs.setdefault(hex_to_dec(log.get('blockNumber')), list()).append(log)
+            return block2logs
+
+        # split the range into halves if too many results,
+        # where the transport errors are never split
+        if isinstance(data, dict):
+            error = data.get('error')
+        if response is not None and self._is_too_many_results(response, error) and end_block > start_block:
+            size = end_block - start_block + 1
+            self.range_size = max(min(self.range_size, size // 2), 1)
+            spider.crawler.stats.inc_value('event_log/range_splits')
+            self.log(
+                message='Split the range of eth_getLogs #{}~#{}: {}'.format(start_block, end_block, error),
+                level=logging.DEBUG,
+            )
+            middle = start_block + size // 2 - 1
+            left, right = await asyncio.gather(
+                self._fetch_logs(start_block, middle, spider),
+                self._fetch_logs(middle + 1, end_block, spider),
+            )
+            return {**left, **right}
+
+        # retry on the other errors
+        if retries >= self.max_retries:
+            raise RuntimeError('eth_getLogs #{}~#{} failed: {}'.format(start_block, end_block, error))
+        self.log(
+            message='Retry eth_getLogs #{}~#{} ({}/{}): {}'.format(
+                start_block, end_block, retries + 1, self.max_retries, error,
+            ),
+            level=logging.WARNING,
+        )
+        return await self._fetch_logs(start_block, end_block, spider, retries + 1)
+
+    async def _request_logs(self, start_block: int, end_block: int, spider):
+        request = scrapy.Request(
+            url=await self.get_provider('eth_getLogs', start_block),
+            method='POST',
+            headers={'Content-Type': 'application/json'},
+            body=json.dumps({
+                "jsonrpc": "2.0",
+                "method": "eth_getLogs",
+                "params": [{
+                    "fromBlock": hex(start_block),
+                    "toBlock": hex(end_block),
+                    "topics": [TOKEN_LOG_TOPICS],
+                }],
+                "id": 1,
+            }),
+            dont_filter=True,
+        )
+        spider.crawler.stats.inc_value('event_log/range_requests')
+        return await maybe_deferred_to_future(spider.crawler.engine.download(request))
+
+    def _is_too_many_results(self, response: scrapy.http.Response, error) -> bool:
+        # the rate limits share the code and hints, e.g., -32005 "limit exceeded"
+        if response.status in THROTTLE_HTTP_STATUS or not isinstance(error, dict):
+            return False
+        message = str(error.get('message', '')).lower()
+        if any([hint in message for hint in self.THROTTLE_HINTS]):
+            return False
+        if error.get('code') in self.TOO_MANY_RESULTS_CODES:
+            return True
+        return any([hint in message for hint in self.TOO_MANY_RESULTS_HINTS])
@@ -9,14 +9,15 @@ from scrapy import Request
 from BlockchainSpider import settings
 from BlockchainSpider.items import Token721TransferItem, \
     Token1155TransferItem, NFTMetadataItem
-from BlockchainSpider.middlewares.defs import LogMiddleware
+from BlockchainSpider.middlewares.defs import ProviderMiddleware
+from BlockchainSpider.utils import fastjson
 from BlockchainSpider.utils.decorator import log_debug_tracing
 from BlockchainSpider.utils.web3 import parse_bytes_data
 
 
-class MetadataMiddleware(LogMiddleware):
+class MetadataMiddleware(ProviderMiddleware):
     def __init__(self):
-        self.provider_bucket = None
+        super().__init__()
         self.timeout = getattr(settings, 'DOWNLOAD_TIMEOUT', 120)
         self.bloom4metadata = ScalableBloomFilter(
             initial_capacity=1024,
@@ -24,15 +25,6 @@ class MetadataMiddleware(LogMiddleware):
             mode=ScalableBloomFilter.SMALL_SET_GROWTH,
         )
 
-    def _init_by_spider(self, spider):
-        if self.provider_bucket is not None:
-            return
-        if getattr(spider, 'middleware_providers') and \
-                spider.middleware_providers.get(self.__class__.__name__):
-            self.provider_bucket = spider.middleware_providers[self.__class__.__name__]
-        else:
-            self.provider_bucket = spider.provider_bucket
-
     async def process_spider_output(self, response, result, spider):
         self._init_by_spider(spider)
 
@@ -76,7 +68,7 @@ class MetadataMiddleware(LogMiddleware):
     @log_debug_tracing
     def parse_metadata_uri(self, response: scrapy.http.Response, **kwargs):
         try:
-            data = json.loads(response.text)
+            data = fastjson.loads(response.body)
             result = parse_bytes_data(data.get('result'), ["string"])
         except:
             return
@@ -121,7 +113,7 @@ class MetadataMiddleware(LogMiddleware):
             priority: int, cb_kwargs: dict,
     ) -> Request:
         return Request(
-            url=await self.provider_bucket.get(),
+            url=await self.get_provider('eth_call'),
             method='POST',
             headers={'Content-Type': 'application/json'},
             body=json.dumps({
@@ -4,25 +4,22 @@ import logging
 import scrapy
 
 from BlockchainSpider.items import EventLogItem, TransactionReceiptItem, BlockItem, TransactionItem
-from BlockchainSpider.middlewares.defs import LogMiddleware
+from BlockchainSpider.middlewares.defs import ProviderMiddleware
+from BlockchainSpider.utils import fastjson
 from BlockchainSpider.utils.decorator import log_debug_tracing
 from BlockchainSpider.utils.web3 import hex_to_dec, web3_json_rpc
 
 
-class TransactionReceiptMiddleware(LogMiddleware):
+class TransactionReceiptMiddleware(ProviderMiddleware):
     def __init__(self):
-        self.provider_bucket = None
+        super().__init__()
         self.block_receipt_method = None
         self._is_checked = False
 
     async def _init_by_spider(self, spider):
-        if self.provider_bucket is not None:
+        if self.provider_router is not None:
             return
-        if getattr(spider, 'middleware_providers') and \
-                spider.middleware_providers.get(self.__class__.__name__):
-            self.provider_bucket = spider.middleware_providers[self.__class__.__name__]
-        else:
-            self.provider_bucket = spider.provider_bucket
+        super()._init_by_spider(spider)
 
         block_receipt_method = getattr(spider, 'block_receipt_method', '')
         if block_receipt_method == '':
@@ -30,6 +27,20 @@ class TransactionReceiptMiddleware(LogMiddleware):
             self.block_receipt_method = None
             return
 
+        # use the probed capabilities of providers if available,
+        # where the requests are routed to the providers supporting block receipts
+        await self.provider_router.probe_capabilities(methods=[block_receipt_method])
+        supported = self.provider_router.supports(block_receipt_method)
+        if supported is not None:
+            self._is_checked = True
+            self.block_receipt_method = block_receipt_method if supported else None
+            self.log(
+                message="Using `%s` for speeding up." % block_receipt_method if supported else
+                "`%s` is not available, using `eth_getTransactionReceipt` instead." % block_receipt_method,
+                level=logging.INFO,
+            )
+            return
+
         # test rpc interface
         rpc_rsp = await web3_json_rpc(
             tx_obj={
@@ -38,7 +49,7 @@ class TransactionReceiptMiddleware(LogMiddleware):
                 "params": ["0xf4240"],
                 "id": 1,
             },
-            provider=await self.provider_bucket.get(),
+            provider=await self.get_provider(block_receipt_method, 0xf4240),
             timeout=5,
         )
         self._is_checked = True
@@ -78,7 +89,7 @@ class TransactionReceiptMiddleware(LogMiddleware):
 
     @log_debug_tracing
     async def parse_eth_block_receipt(self, response: scrapy.http.Response, **kwargs):
-        result = json.loads(response.text)
+        result = fastjson.loads(response.body)
         result = result.get('result')
         txhash2transaction = {
             item['transaction_hash']: item
@@ -94,7 +105,7 @@ class TransactionReceiptMiddleware(LogMiddleware):
             for log in item['logs']:
                 yield EventLogItem(
                     transaction_hash=log.get('transactionHash', ''),
-                    log_index=hex_to_dec(log.get('logIndex')),
+                    log_index=log.get('logIndex'),
                     block_number=hex_to_dec(log.get('blockNumber')),
                     timestamp=transaction['timestamp'],
                     address=log.get('address', '').lower(),
@@ -104,12 +115,12 @@ class TransactionReceiptMiddleware(LogMiddleware):
                 )
             yield TransactionReceiptItem(
                 transaction_hash=txhash,
-                transaction_index=hex_to_dec(item.get('transactionIndex')),
-                transaction_type=hex_to_dec(item.get('type')),
+                transaction_index=item.get('transactionIndex'),
+                transaction_type=item.get('type'),
                 block_hash=item.get('blockHash', ''),
                 block_number=hex_to_dec(item.get('blockNumber')),
-                gas_used=hex_to_dec(item.get('gasUsed')),
-                effective_gas_price=hex_to_dec(item.get('effectiveGasPrice')),
+                gas_used=item.get('gasUsed'),
+                effective_gas_price=item.get('effectiveGasPrice'),
                 created_contract=item['contractAddress'] if item.get('contractAddress') else '',
                 is_error=item.get('status') != '0x1',
                 cb_kwargs={'@transaction': transaction}
@@ -117,7 +128,7 @@ class TransactionReceiptMiddleware(LogMiddleware):
 
     @log_debug_tracing
     async def parse_eth_get_transaction_receipt(self, response: scrapy.http.Response, **kwargs):
-        result = json.loads(response.text)
+        result = fastjson.loads(response.body)
         result = result.get('result')
         if result is None:
             self.log(
@@ -131,7 +142,7 @@ class TransactionReceiptMiddleware(LogMiddleware):
         for log in result['logs']:
             yield EventLogItem(
                 transaction_hash=log.get('transactionHash', ''),
-                log_index=hex_to_dec(log.get('logIndex')),
+                log_index=log.get('logIndex'),
                 block_number=hex_to_dec(log.get('blockNumber')),
                 timestamp=transaction['timestamp'],
                 address=log.get('address', '').lower(),
@@ -141,12 +152,12 @@ class TransactionReceiptMiddleware(LogMiddleware):
             )
         yield TransactionReceiptItem(
             transaction_hash=result.get('transactionHash', ''),
-            transaction_index=hex_to_dec(result.get('transactionIndex')),
-            transaction_type=hex_to_dec(result.get('type')),
+            transaction_index=result.get('transactionIndex'),
+            transaction_type=result.get('type'),
             block_hash=result.get('blockHash', ''),
             block_number=hex_to_dec(result.get('blockNumber')),
-            gas_used=hex_to_dec(result.get('gasUsed')),
-            effective_gas_price=hex_to_dec(result.get('effectiveGasPrice')),
+            gas_used=result.get('gasUsed'),
+            effective_gas_price=result.get('effectiveGasPrice'),
             created_contract=result['contractAddress'] if result.get('contractAddress') else '',
             is_error=result.get('status') != '0x1',
             cb_kwargs={'@transaction': transaction},
@@ -156,7 +167,7 @@ class TransactionReceiptMiddleware(LogMiddleware):
             self, block_number: int, priority: int, cb_kwargs: dict
     ) -> scrapy.Request:
         return scrapy.Request(
-            url=await self.provider_bucket.get(),
+            url=await self.get_provider(self.block_receipt_method, block_number),
             method='POST',
             headers={'Content-Type': 'application/json'},
             body=json.dumps({
@@ -176,7 +187,7 @@ class TransactionReceiptMiddleware(LogMiddleware):
             self, transaction_hash: int, priority: int, cb_kwargs: dict
     ) -> scrapy.Request:
         return scrapy.Request(
-            url=await self.provider_bucket.get(),
+            url=await self.get_provider('eth_getTransactionReceipt', cb_kwargs['@transaction']['block_number']),
             method='POST',
             headers={'Content-Type': 'application/json'},
             body=json.dumps({
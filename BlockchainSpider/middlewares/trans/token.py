@@ -1,41 +1,137 @@
 import json
+import logging
 import time
 import traceback
-from typing import Union, List
+from typing import Union, List, Tuple
 
 import scrapy
-from web3 import Web3
 
 from BlockchainSpider import settings
 from BlockchainSpider.items import EventLogItem, Token1155TransferItem, TokenApprovalAllItem, TokenPropertyItem
 from BlockchainSpider.items import Token721TransferItem, Token20TransferItem, TokenApprovalItem
-from BlockchainSpider.middlewares.defs import LogMiddleware
+from BlockchainSpider.middlewares.defs import ProviderMiddleware
+from BlockchainSpider.middlewares.health import get_response_outcome
+from BlockchainSpider.utils import fastjson
 from BlockchainSpider.utils.cache import LRUCache
 from BlockchainSpider.utils.decorator import log_debug_tracing
 from BlockchainSpider.utils.token import ERC20_TRANSFER_TOPIC, ERC721_TRANSFER_TOPIC, \
     ERC1155_SINGLE_TRANSFER_TOPIC, ERC1155_BATCH_TRANSFER_TOPIC, TOKEN_APPROVE_TOPIC, \
-    TOKEN_APPROVE_ALL_TOPIC
+    TOKEN_APPROVE_ALL_TOPIC, ERC165_IS_TOKEN721_DATA
+from BlockchainSpider.utils.multicall import get_tx_obj_aggregate3, get_tx_objs_batch, decode_aggregate3, \
+    parse_batch_results, get_function_selector, is_batch_unsupported
 from BlockchainSpider.utils.web3 import split_to_words, word_to_address, hex_to_dec, parse_bytes_data
 
 
-class TokenTransferMiddleware(LogMiddleware):
+TOKEN_PROPERTY_PROBES = [
+    {'property_key': 'name', 'func': 'name()', 'return_type': ["string", ]},
+    {'property_key': 'token_symbol', 'func': 'symbol()', 'return_type': ["string", ]},
+    {'property_key': 'token_symbol', 'func': 'symbol()', 'return_type': ["bytes32", ]},
+    {'property_key': 'token_symbol', 'func': 'SYMBOL()', 'return_type': ["string", ]},
+    {'property_key': 'token_symbol', 'func': 'SYMBOL()', 'return_type': ["bytes32", ]},
+    {'property_key': 'decimals', 'func': 'decimals()', 'return_type': ["uint8", ]},
+    {'property_key': 'decimals', 'func': 'DECIMALS()', 'return_type': ["uint8", ]},
+    {'property_key': 'total_supply', 'func': 'totalSupply()', 'return_type': ["uint256", ]},
+]
+
+
+class EthCallAggregationMiddleware(ProviderMiddleware):
+    """
+    Aggregate the `eth_call` probes into a few Multicall3 `aggregate3` calls,
+    and fall back to the JSON-RPC batch if Multicall3 is not deployed,
+    or the single calls if the JSON-RPC batch is not supported.
+    """
+    CALL_MODE_MULTICALL = 'multicall'
+    CALL_MODE_BATCH = 'batch'
+    CALL_MODE_SINGLE = 'single'
+
     def __init__(self):
-        self.provider_bucket = None
-        self._cache_is_token721 = LRUCache(getattr(settings, 'MIDDLE_CACHE_SIZE', 2 ** 20))
+        super().__init__()
+        self.max_calls = getattr(settings, 'MULTICALL_MAX_CALLS', 128)
+        self.max_retries = 3
+        self.call_mode = self.CALL_MODE_MULTICALL \
+            if getattr(settings, 'MULTICALL_ENABLED', True) else self.CALL_MODE_BATCH
+
+    async def get_request_eth_calls(
+            self, calls: List[Tuple[str, str]], call_mode: str, priority: int,
+            callback, errback, cb_kwargs: dict, retries: int = 0,
+    ) -> scrapy.Request:
+        tx_obj = get_tx_obj_aggregate3(calls) \
+            if call_mode == self.CALL_MODE_MULTICALL \
+            else get_tx_objs_batch(calls)
+        return scrapy.Request(
+            url=await self.get_provider('eth_call'),
+            method='POST',
+            headers={'Content-Type': 'application/json'},
+            body=json.dumps(tx_obj),
+            priority=priority,
+            callback=callback,
+            errback=errback,
+            cb_kwargs={'calls': calls, 'call_mode': call_mode, 'retries': retries, **cb_kwargs},
+            dont_filter=True,
+        )
 
-    def _init_by_spider(self, spider):
-        if self.provider_bucket is not None:
-            return
-        if getattr(spider, 'middleware_providers') and \
-                spider.middleware_providers.get(self.__class__.__name__):
-            self.provider_bucket = spider.middleware_providers[self.__class__.__name__]
+    def parse_eth_calls(self, response: scrapy.http.Response, **kwargs) -> Union[List[Tuple[bool, str]], None]:
+        """
+        Parse the results of aggregated calls, and return none if failed,
+        where the call is retried in the mode from `get_retry_call_mode`.
+        The global call mode is degraded only if the response definitively
+        says the mode is not available, rather than throttled or failed.
+
+        :param response:
+        :param kwargs:
+        :return: the list of (success, return data in hex)
+        """
+        try:
+            data = fastjson.loads(response.body)
+        except ValueError:
+            data = None
+        calls, call_mode = kwargs['calls'], kwargs['call_mode']
+        if call_mode == self.CALL_MODE_MULTICALL:
+            result = data.get('result') if isinstance(data, dict) else None
+            results = decode_aggregate3(result)
+            if results is not None and len(results) == len(calls):
+                return results
+            unavailable = result == '0x'  # multicall3 is not deployed
         else:
-            self.provider_bucket = spider.provider_bucket
+            results = parse_batch_results(data, len(calls))
+            if results is not None:
+                return results
+            unavailable = is_batch_unsupported(data)  # batch is not supported
+
+        # degrade the call mode
+        next_mode = self.get_next_call_mode(call_mode)
+        _, throttled = get_response_outcome(response)
+        if unavailable and not throttled and self.call_mode == call_mode:
+            self.log(
+                message='`{}` of eth_call is not available, using `{}` instead.'.format(call_mode, next_mode),
+                level=logging.INFO,
+            )
+            self.call_mode = next_mode
+        return None
+
+    def get_retry_call_mode(self, call_mode: str, retries: int) -> Tuple[str, int]:
+        # retry the transient failures (e.g., rate limits) in the same mode,
+        # and use the next mode if degraded or retried too many times
+        if self.call_mode != call_mode or retries >= self.max_retries:
+            return self.get_next_call_mode(call_mode), 0
+        return call_mode, retries + 1
+
+    def get_next_call_mode(self, call_mode: str) -> str:
+        if call_mode == self.CALL_MODE_MULTICALL:
+            return self.CALL_MODE_BATCH
+        return self.CALL_MODE_SINGLE
+
+
+class TokenTransferMiddleware(EthCallAggregationMiddleware):
+    def __init__(self):
+        super().__init__()
+        self._cache_is_token721 = LRUCache(getattr(settings, 'MIDDLE_CACHE_SIZE', 2 ** 20))
 
     async def process_spider_output(self, response, result, spider):
         self._init_by_spider(spider)
 
         # filter and process the result flow
+        address2logs = dict()  # contract address -> [EventLogItem]
         async for item in result:
             yield item
             if not isinstance(item, EventLogItem):
@@ -56,11 +152,7 @@ class TokenTransferMiddleware(LogMiddleware):
                         if cached_is_token721 is True \
                         else self.parse_token20_transfer_item(log=log)
                     continue
-                yield await self.get_request_is_token721(
-                    contract_address=log['address'],
-                    priority=response.request.priority,
-                    cb_kwargs={'log': log},
-                )
+                address2logs.setdefault(log['address'], list()).append(log)
                 continue
 
             # extract the erc1155 token transfers
@@ -79,6 +171,14 @@ class TokenTransferMiddleware(LogMiddleware):
                 yield self.parse_token_approve_all_item(log=log)
                 continue
 
+        # detect erc721 for the new contracts in aggregation
+        async for request in self.get_requests_is_token721(
+                address2logs=address2logs,
+                call_mode=self.call_mode,
+                priority=response.request.priority,
+        ):
+            yield request
+
     def parse_token721_transfer_item(self, log: EventLogItem) -> Union[Token721TransferItem, None]:
         # load log topics
         topics = log.get('topics')
@@ -104,7 +204,7 @@ class TokenTransferMiddleware(LogMiddleware):
             contract_address=log['address'],
             address_from=word_to_address(topics_with_data[1]),
             address_to=word_to_address(topics_with_data[2]),
-            token_id=hex_to_dec(topics_with_data[3]),
+            token_id=topics_with_data[3],
         )
 
     def parse_token20_transfer_item(self, log: EventLogItem) -> Union[Token20TransferItem, None]:
@@ -132,7 +232,7 @@ class TokenTransferMiddleware(LogMiddleware):
             contract_address=log['address'],
             address_from=word_to_address(topics_with_data[1]),
             address_to=word_to_address(topics_with_data[2]),
-            value=hex_to_dec(topics_with_data[3]),
+            value=topics_with_data[3],
         )
 
     def parse_token1155_transfer_item(self, log: EventLogItem) -> Union[Token1155TransferItem, None]:
@@ -205,7 +305,7 @@ class TokenTransferMiddleware(LogMiddleware):
             contract_address=log['address'],
             address_from=word_to_address(topics_with_data[1]),
             address_to=word_to_address(topics_with_data[2]),
-            value=hex_to_dec(topics_with_data[3]),
+            value=topics_with_data[3],
         )
 
     def parse_token_approve_all_item(self, log):
@@ -239,7 +339,7 @@ class TokenTransferMiddleware(LogMiddleware):
     def parse_is_token721(self, response: scrapy.http.Response, **kwargs):
         is_token721 = False
         try:
-            data = json.loads(response.text)
+            data = fastjson.loads(response.body)
             if data.get('result') is not None:
                 result = parse_bytes_data(data['result'], ['bool', ])
                 if result is not None and len(result) > 0 and result[0] is True:
@@ -264,13 +364,77 @@ class TokenTransferMiddleware(LogMiddleware):
         log = kwargs['log']
         yield self.parse_token20_transfer_item(log=log)
 
+    @log_debug_tracing
+    async def parse_is_token721s(self, response: scrapy.http.Response, **kwargs):
+        address2logs = kwargs['address2logs']
+        results = self.parse_eth_calls(response, **kwargs)
+        if results is None:
+            call_mode, retries = self.get_retry_call_mode(kwargs['call_mode'], kwargs['retries'])
+            async for request in self.get_requests_is_token721(
+                    address2logs=address2logs,
+                    call_mode=call_mode,
+                    priority=response.request.priority,
+                    retries=retries,
+            ):
+                yield request
+            return
+
+        # set the cache and process the waiting items
+        for (address, logs), (success, data) in zip(address2logs.items(), results):
+            result = parse_bytes_data(data, ['bool', ]) if success else None
+            is_token721 = result is not None and len(result) > 0 and result[0] is True
+            self._cache_is_token721.set(address, is_token721)
+            for log in logs:
+                yield self.parse_token721_transfer_item(log=log) \
+                    if is_token721 is True \
+                    else self.parse_token20_transfer_item(log=log)
+
+    @log_debug_tracing
+    def errback_parse_is_token721s(self, failure):
+        kwargs = failure.request.cb_kwargs
+
+        # process waiting items
+        for logs in kwargs['address2logs'].values():
+            for log in logs:
+                yield self.parse_token20_transfer_item(log=log)
+
+    async def get_requests_is_token721(self, address2logs: dict, call_mode: str, priority: int, retries: int = 0):
+        # fall back to the single calls for each log
+        if call_mode == self.CALL_MODE_SINGLE:
+            for logs in address2logs.values():
+                for log in logs:
+                    yield await self.get_request_is_token721(
+                        contract_address=log['address'],
+                        priority=priority,
+                        cb_kwargs={'log': log},
+                    )
+            return
+
+        # aggregate the erc165 calls of contracts
+        addresses = list(address2logs.keys())
+        for i in range(0, len(addresses), self.max_calls):
+            yield await self.get_request_eth_calls(
+                calls=[(address, ERC165_IS_TOKEN721_DATA) for address in addresses[i:i + self.max_calls]],
+                call_mode=call_mode,
+                priority=priority,
+                callback=self.parse_is_token721s,
+                errback=self.errback_parse_is_token721s,
+                retries=retries,
+                cb_kwargs={
+                    'address2logs': {
+                        address: address2logs[address]
+                        for address in addresses[i:i + self.max_calls]
+                    },
+                },
+            )
+
     async def get_request_is_token721(
             self, contract_address: str, priority: int, cb_kwargs: dict
     ) -> Union[scrapy.Request, None]:
         # detect ERC721, return if contract is ERC721
         # see https://ethereum.stackexchange.com/questions/44880/erc-165-query-on-erc-721-implementation
         return scrapy.Request(
-            url=await self.provider_bucket.get(),
+            url=await self.get_provider('eth_call'),
             method='POST',
             headers={'Content-Type': 'application/json'},
             body=json.dumps({
@@ -278,7 +442,7 @@ class TokenTransferMiddleware(LogMiddleware):
                 "method": "eth_call",
                 "params": [{
                     'to': contract_address,
-                    "data": "0x01ffc9a780ac58cd00000000000000000000000000000000000000000000000000000000",
+                    "data": ERC165_IS_TOKEN721_DATA,
                 }, 'latest'
                 ],
                 "id": int(time.time() * 1000000),  # ensure not be filtered with the same fingerprint
@@ -290,25 +454,17 @@ class TokenTransferMiddleware(LogMiddleware):
         )
 
 
-class TokenPropertyMiddleware(LogMiddleware):
+class TokenPropertyMiddleware(EthCallAggregationMiddleware):
     def __init__(self):
-        self.provider_bucket = None
+        super().__init__()
         self._cache_property = LRUCache(getattr(settings, 'MIDDLE_CACHE_SIZE', 2 ** 20))
         self._waiting_property_items = dict()  # contract -> [Item]
 
-    def _init_by_spider(self, spider):
-        if self.provider_bucket is not None:
-            return
-        if getattr(spider, 'middleware_providers') and \
-                spider.middleware_providers.get(self.__class__.__name__):
-            self.provider_bucket = spider.middleware_providers[self.__class__.__name__]
-        else:
-            self.provider_bucket = spider.provider_bucket
-
     async def process_spider_output(self, response, result, spider):
         self._init_by_spider(spider)
 
         # filter and process the result flow
+        contract_addresses = list()
         async for item in result:
             yield item
             if not any([
@@ -340,32 +496,108 @@ class TokenPropertyMiddleware(LogMiddleware):
                 waiting_items.append(item)
                 continue
             self._waiting_property_items[contract_address] = [item]
+            contract_addresses.append(contract_address)
 
-            # generate requests for fetching property
-            request_kwargs = [
-                {'property_key': 'name', 'func': 'name()', 'return_type': ["string", ]},
-                {'property_key': 'token_symbol', 'func': 'symbol()', 'return_type': ["string", ]},
-                {'property_key': 'token_symbol', 'func': 'symbol()', 'return_type': ["bytes32", ]},
-                {'property_key': 'token_symbol', 'func': 'SYMBOL()', 'return_type': ["string", ]},
-                {'property_key': 'token_symbol', 'func': 'SYMBOL()', 'return_type': ["bytes32", ]},
-                {'property_key': 'decimals', 'func': 'decimals()', 'return_type': ["uint8", ]},
-                {'property_key': 'decimals', 'func': 'DECIMALS()', 'return_type': ["uint8", ]},
-                {'property_key': 'total_supply', 'func': 'totalSupply()', 'return_type': ["uint256", ]},
-            ]
-            token_property = {'semaphore': -len(request_kwargs)}
-            for kwargs in request_kwargs:
-                yield await self.get_request_token_property(
-                    contract_address=contract_address,
+        # fetch the properties of new contracts in aggregation
+        async for request in self.get_requests_token_properties(
+                contract_addresses=contract_addresses,
+                call_mode=self.call_mode,
+                priority=response.request.priority,
+        ):
+            yield request
+
+    @log_debug_tracing
+    async def parse_token_properties(self, response: scrapy.http.Response, **kwargs):
+        contract_addresses = kwargs['contract_addresses']
+        results = self.parse_eth_calls(response, **kwargs)
+        if results is None:
+            call_mode, retries = self.get_retry_call_mode(kwargs['call_mode'], kwargs['retries'])
+            async for request in self.get_requests_token_properties(
+                    contract_addresses=contract_addresses,
+                    call_mode=call_mode,
                     priority=response.request.priority,
-                    cb_kwargs={'token_property': token_property},
-                    **kwargs
-                )
+                    retries=retries,
+            ):
+                yield request
+            return
+
+        # merge the results of each contract
+        n = len(TOKEN_PROPERTY_PROBES)
+        for i, contract_address in enumerate(contract_addresses):
+            token_property = dict()
+            for probe, (success, data) in zip(TOKEN_PROPERTY_PROBES, results[i * n:(i + 1) * n]):
+                result = parse_bytes_data(data, probe['return_type']) if success else None
+                if result is None:
+                    continue
+                result = result[0] if not isinstance(result[0], bytes) else result[0].decode()
+                result = result.replace('\0', '') if isinstance(result, str) else result
+                property_value = token_property.get(probe['property_key'])
+                if property_value is None or result > property_value:
+                    token_property[probe['property_key']] = result
+            for item in self._release_token_property(contract_address, token_property):
+                yield item
+
+    @log_debug_tracing
+    def errback_parse_token_properties(self, failure):
+        kwargs = failure.request.cb_kwargs
+        for contract_address in kwargs['contract_addresses']:
+            for item in self._release_token_property(contract_address, dict()):
+                yield item
+
+    def _release_token_property(self, contract_address: str, token_property: dict):
+        # save to cache
+        self._cache_property.set(contract_address, token_property)
+
+        # release the waiting items
+        items = self._waiting_property_items.pop(contract_address, list())
+        for item in items:
+            yield TokenPropertyItem(
+                contract_address=contract_address,
+                name=token_property.get('name', ''),
+                token_symbol=token_property.get('token_symbol', ''),
+                decimals=token_property.get('decimals', -1),
+                total_supply=token_property.get('total_supply', -1),
+                cb_kwargs={'@token_action': item},
+            )
+
+    async def get_requests_token_properties(
+            self, contract_addresses: List[str], call_mode: str, priority: int, retries: int = 0,
+    ):
+        # fall back to the single calls for each property
+        if call_mode == self.CALL_MODE_SINGLE:
+            for contract_address in contract_addresses:
+                token_property = {'semaphore': -len(TOKEN_PROPERTY_PROBES)}
+                for kwargs in TOKEN_PROPERTY_PROBES:
+                    yield await self.get_request_token_property(
+                        contract_address=contract_address,
+                        priority=priority,
+                        cb_kwargs={'token_property': token_property},
+                        **kwargs
+                    )
+            return
+
+        # aggregate the property calls, and the calls of a contract are not split
+        step = max(self.max_calls // len(TOKEN_PROPERTY_PROBES), 1)
+        for i in range(0, len(contract_addresses), step):
+            yield await self.get_request_eth_calls(
+                calls=[
+                    (contract_address, get_function_selector(probe['func']))
+                    for contract_address in contract_addresses[i:i + step]
+                    for probe in TOKEN_PROPERTY_PROBES
+                ],
+                call_mode=call_mode,
+                priority=priority,
+                callback=self.parse_token_properties,
+                errback=self.errback_parse_token_properties,
+                retries=retries,
+                cb_kwargs={'contract_addresses': contract_addresses[i:i + step]},
+            )
 
     @log_debug_tracing
     async def parse_token_property(self, response: scrapy.http.Response, **kwargs):
         return_type = kwargs['return_type']
         try:
-            result = json.loads(response.text)
+            result = fastjson.loads(response.body)
             data = result.get('result')
             result = parse_bytes_data(data, return_type)
             if result is not None:
@@ -431,14 +663,9 @@ class TokenPropertyMiddleware(LogMiddleware):
             self, contract_address: str, priority: int,
             property_key: str, func: str, return_type: List, cb_kwargs: dict,
     ) -> Union[scrapy.Request, None]:
-        # data formatting with compatibility detection
-        data = Web3.keccak(text=func).hex()
-        data = data[2:2 + 8] if data.startswith('0x') else data[:8]
-        data = '0x' + data
-
         # generate request
         return scrapy.Request(
-            url=await self.provider_bucket.get(),
+            url=await self.get_provider('eth_call'),
             method='POST',
             headers={'Content-Type': 'application/json'},
             body=json.dumps({
@@ -447,7 +674,7 @@ class TokenPropertyMiddleware(LogMiddleware):
                 "params": [
                     {
                         'to': contract_address,
-                        "data": data
+                        "data": get_function_selector(func)
                     },
                     'latest'
                 ],
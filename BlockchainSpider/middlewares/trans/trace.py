@@ -5,30 +5,57 @@ from typing import Iterator
 import scrapy
 
 from BlockchainSpider.items import BlockItem, TraceItem, TransactionItem
-from BlockchainSpider.middlewares.defs import LogMiddleware
+from BlockchainSpider.middlewares.defs import ProviderMiddleware
 from BlockchainSpider.spiders.trans.evm.trans import EVMTransactionSpider
+from BlockchainSpider.utils import fastjson
 from BlockchainSpider.utils.decorator import log_debug_tracing
-from BlockchainSpider.utils.web3 import hex_to_dec
 
 
-class TraceMiddleware(LogMiddleware):
+class TraceMiddleware(ProviderMiddleware):
+    """
+    Collect the call traces by the `debug` backend (i.e., `debug_traceBlockByNumber` with `callTracer`),
+    or the `parity` backend (i.e., `trace_block`), which is faster on Erigon, Nethermind and Reth.
+    The backend is chosen by the spider argument `trace_backend`, and the `parity` backend
+    is preferred in the `auto` mode if supported by the probed providers.
+    """
+    BACKEND_AUTO = 'auto'
+    BACKEND_DEBUG = 'debug'
+    BACKEND_PARITY = 'parity'
+
     def __init__(self):
-        self.provider_bucket = None
+        super().__init__()
+        self.trace_backend = None
 
-    def _init_by_spider(self, spider):
-        if self.provider_bucket is not None:
+    async def _init_trace_backend(self, spider):
+        if self.trace_backend is not None:
             return
-        if getattr(spider, 'middleware_providers') and \
-                spider.middleware_providers.get(self.__class__.__name__):
-            self.provider_bucket = spider.middleware_providers[self.__class__.__name__]
-        else:
-            self.provider_bucket = spider.provider_bucket
+        trace_backend = getattr(spider, 'trace_backend', self.BACKEND_AUTO)
+        if trace_backend == self.BACKEND_AUTO:
+            await self.provider_router.probe_capabilities(methods=['trace_block', 'debug_traceBlockByNumber'])
+            supported = self.provider_router.supports('trace_block')
+            trace_backend = self.BACKEND_PARITY if supported else self.BACKEND_DEBUG
+            self.log(
+                message="Using the `%s` backend for tracing." % trace_backend,
+                level=logging.INFO,
+            )
+        self.trace_backend = trace_backend
 
     async def process_spider_output(self, response, result, spider):
         self._init_by_spider(spider)
+        await self._init_trace_backend(spider)
         async for item in result:
             yield item
             if isinstance(item, BlockItem):
+                if self.trace_backend == self.BACKEND_PARITY:
+                    yield await self.get_request_trace_block(
+                        block_number=item['block_number'],
+                        priority=response.request.priority,
+                        cb_kwargs={
+                            'block_number': item['block_number'],
+                            'timestamp': item['timestamp'],
+                        }
+                    )
+                    continue
                 context_kwargs = item.get_context_kwargs()
                 transaction_hashes = [
                     trans['transaction_hash']
@@ -48,6 +75,16 @@ class TraceMiddleware(LogMiddleware):
             if isinstance(spider, EVMTransactionSpider) and isinstance(item, TransactionItem):
                 if item.get('gas', 0) <= 21000:
                     continue
+                if self.trace_backend == self.BACKEND_PARITY:
+                    yield await self.get_request_trace_transaction(
+                        txhash=item['transaction_hash'],
+                        priority=response.request.priority,
+                        cb_kwargs={
+                            'block_number': item['block_number'],
+                            'timestamp': item['timestamp'],
+                        }
+                    )
+                    continue
                 yield await self.get_request_debug_transaction(
                     txhash=item['transaction_hash'],
                     priority=response.request.priority,
@@ -61,7 +98,7 @@ class TraceMiddleware(LogMiddleware):
 
     @log_debug_tracing
     async def parse_debug_trace_block(self, response: scrapy.http.Response, **kwargs):
-        data = json.loads(response.text)
+        data = fastjson.loads(response.body)
         data = data.get('result')
         if data is None:
             self.log(
@@ -86,16 +123,16 @@ class TraceMiddleware(LogMiddleware):
                     timestamp=kwargs['timestamp'],
                     address_from=item.get('from', ''),
                     address_to=item.get('to', ''),
-                    value=hex_to_dec(item.get('value')),
-                    gas=hex_to_dec(item.get('gas')),
-                    gas_used=hex_to_dec(item.get('gasUsed')),
+                    value=item.get('value'),
+                    gas=item.get('gas'),
+                    gas_used=item.get('gasUsed'),
                     input=item.get('input', ''),
                     output=item.get('output', ''),
                 )
 
     @log_debug_tracing
     def parse_debug_transaction(self, response: scrapy.http.Response, **kwargs):
-        result = json.loads(response.text)
+        result = fastjson.loads(response.body)
         result = result.get('result')
         if result is None:
             self.log(
@@ -117,18 +154,119 @@ class TraceMiddleware(LogMiddleware):
                 timestamp=kwargs['timestamp'],
                 address_from=item.get('from', ''),
                 address_to=item.get('to', ''),
-                value=hex_to_dec(item.get('value')),
-                gas=hex_to_dec(item.get('gas')),
-                gas_used=hex_to_dec(item.get('gasUsed')),
+                value=item.get('value'),
+                gas=item.get('gas'),
+                gas_used=item.get('gasUsed'),
                 input=item.get('input', ''),
                 output=item.get('output', ''),
             )
 
+    @log_debug_tracing
+    def parse_trace_block(self, response: scrapy.http.Response, **kwargs):
+        result = fastjson.loads(response.body)
+        result = result.get('result')
+        if result is None:
+            self.log(
+                message='On parse_trace_block, `result` is None, '
+                        'please check if your providers are fully available at trace_block.',
+                level=logging.WARNING,
+            )
+            return
+        yield from self._parse_parity_traces(result, kwargs['block_number'], kwargs['timestamp'])
+
+    @log_debug_tracing
+    def parse_trace_transaction(self, response: scrapy.http.Response, **kwargs):
+        result = fastjson.loads(response.body)
+        result = result.get('result')
+        if result is None:
+            self.log(
+                message='On parse_trace_transaction, `result` is None, '
+                        'please check if your providers are fully available at trace_transaction.',
+                level=logging.WARNING,
+            )
+            return
+        yield from self._parse_parity_traces(result, kwargs['block_number'], kwargs['timestamp'])
+
+    def _parse_parity_traces(self, traces: list, block_number: int, timestamp: int) -> Iterator[TraceItem]:
+        # the flat traces are in the same order as the call tree,
+        # and the trace id is the depth and the index in the parent calls (skip the first call)
+        for trace in traces:
+            trace_address = trace.get('traceAddress', list())
+            if trace.get('transactionHash') is None or len(trace_address) == 0:
+                continue
+            action = trace.get('action', dict())
+            result = trace.get('result') if trace.get('result') else dict()
+            trace_type = trace.get('type', '')
+            if trace_type == 'call':
+                trace_type = action.get('callType', trace_type)
+                address_from, address_to = action.get('from', ''), action.get('to', '')
+                value, call_input, output = action.get('value'), action.get('input', ''), result.get('output', '')
+            elif trace_type == 'create':
+                trace_type = action.get('creationMethod', trace_type)
+                address_from, address_to = action.get('from', ''), result.get('address', '')
+                value, call_input, output = action.get('value'), action.get('init', ''), result.get('code', '')
+            elif trace_type == 'suicide':
+                trace_type = 'selfdestruct'
+                address_from, address_to = action.get('address', ''), action.get('refundAddress', '')
+                value, call_input, output = action.get('balance'), '', ''
+            else:
+                continue
+            yield TraceItem(
+                transaction_hash=trace['transactionHash'],
+                trace_type=trace_type.upper(),
+                trace_id='%d_%d' % (len(trace_address), trace_address[-1]),
+                block_number=block_number,
+                timestamp=timestamp,
+                address_from=address_from,
+                address_to=address_to,
+                value=value,
+                gas=action.get('gas'),
+                gas_used=result.get('gasUsed'),
+                input=call_input,
+                output=output,
+            )
+
+    async def get_request_trace_block(
+            self, block_number: int, priority: int, cb_kwargs: dict
+    ) -> scrapy.Request:
+        return scrapy.Request(
+            url=await self.get_provider('trace_block', block_number),
+            method='POST',
+            headers={'Content-Type': 'application/json'},
+            body=json.dumps({
+                "jsonrpc": "2.0",
+                "method": "trace_block",
+                "params": [hex(block_number)],
+                "id": 1
+            }),
+            priority=priority,
+            callback=self.parse_trace_block,
+            cb_kwargs=cb_kwargs if cb_kwargs else dict(),
+        )
+
+    async def get_request_trace_transaction(
+            self, txhash: str, priority: int, cb_kwargs: dict
+    ) -> scrapy.Request:
+        return scrapy.Request(
+            url=await self.get_provider('trace_transaction', cb_kwargs.get('block_number')),
+            method='POST',
+            headers={'Content-Type': 'application/json'},
+            body=json.dumps({
+                "jsonrpc": "2.0",
+                "method": "trace_transaction",
+                "params": [txhash],
+                "id": 1
+            }),
+            priority=priority,
+            callback=self.parse_trace_transaction,
+            cb_kwargs=cb_kwargs if cb_kwargs else dict(),
+        )
+
     async def get_request_debug_trace_block(
             self, block_number: int, priority: int, cb_kwargs: dict
     ) -> scrapy.Request:
         return scrapy.Request(
-            url=await self.provider_bucket.get(),
+            url=await self.get_provider('debug_traceBlockByNumber', block_number),
             method='POST',
             headers={'Content-Type': 'application/json'},
             body=json.dumps({
@@ -146,7 +284,7 @@ class TraceMiddleware(LogMiddleware):
             self, txhash: str, priority: int, cb_kwargs: dict
     ) -> scrapy.Request:
         return scrapy.Request(
-            url=await self.provider_bucket.get(),
+            url=await self.get_provider('debug_traceTransaction', cb_kwargs.get('block_number')),
             method='POST',
             headers={'Content-Type': 'application/json'},
             body=json.dumps({
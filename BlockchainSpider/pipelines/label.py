@@ -2,23 +2,36 @@ import json
 import os
 
 from BlockchainSpider.items.label import LabelReportItem
+from BlockchainSpider.pipelines.writer import BackgroundWriter
 
 
 class LabelReportPipeline:
     def __init__(self):
         self.file = None
         self.out_dir = './data'
+        self.background_writer = None
 
     def open_spider(self, spider):
         if getattr(spider, 'out_dir'):
             self.out_dir = spider.out_dir
         if not os.path.exists(self.out_dir):
             os.makedirs(self.out_dir)
+        self.background_writer = BackgroundWriter.from_spider(self.__class__.__name__, spider)
 
     def process_item(self, item, spider):
         if not isinstance(item, LabelReportItem):
             return item
+        if self.background_writer is None:
+            self.write_item(item)
+            return item
+
+        # write in the background, and wait if the writer is busy
+        deferred = self.background_writer.submit(self.write_item, item)
+        if deferred is None:
+            return item
+        return deferred.addCallback(lambda _: item)
 
+    def write_item(self, item):
         # init file from filename
         if self.file is None:
             fn = os.path.join(self.out_dir, LabelReportItem.__name__)
@@ -27,8 +40,9 @@ class LabelReportPipeline:
         # write item
         json.dump({**item}, self.file)
         self.file.write('\n')
-        return item
 
     def close_spider(self, spider):
+        if self.background_writer is not None:
+            self.background_writer.close()
         if self.file is not None:
             self.file.close()
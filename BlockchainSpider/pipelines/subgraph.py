@@ -1,9 +1,10 @@
 import csv
 import os
 
-from BlockchainSpider.items import AccountTransferItem
+from BlockchainSpider.items import AccountTransferItem, SyncItem
 from BlockchainSpider.items.subgraph import RankItem, UTXOTransferItem
 from BlockchainSpider.pipelines.sync import unpacked_sync_item
+from BlockchainSpider.pipelines.writer import BackgroundWriter
 
 
 class TransferDeduplicatePipeline:
@@ -37,6 +38,7 @@ class AccountTransfer2csvPipeline:
         self.fields = list(AccountTransferItem.fields.keys())
         if 'id' in self.fields:
             self.fields.remove('id')
+        self.background_writer = None
 
     def open_spider(self, spider):
         self.out_dir = spider.__dict__.get('out', self.out_dir)
@@ -57,27 +59,46 @@ class AccountTransfer2csvPipeline:
         has_old_file = os.path.exists(path)
         self.file = open(path, self.file_mode, encoding='utf-8', newline='\n')
         self.writer = csv.writer(self.file)
+        self.background_writer = BackgroundWriter.from_spider(self.__class__.__name__, spider)
         if self.file_mode == 'a' and has_old_file:
             return
         self.writer.writerow(self.fields)
 
-    @unpacked_sync_item
     def process_item(self, item, spider):
-        if self.out_dir is None or not isinstance(item, self.item_type):
+        if self.out_dir is None:
             return item
-        row_data = list()
-        for field in self.fields:
-            value = item.get(field)
-            if value is not None:
-                row_data.append(value)
+        items = [_item for _items in item['data'].values() for _item in _items] \
+            if isinstance(item, SyncItem) else [item]
+        if self.background_writer is None:
+            self.write_items(items)
+            return item
+
+        # write in the background, and wait if the writer is busy
+        deferred = self.background_writer.submit(self.write_items, items)
+        if deferred is None:
+            return item
+        return deferred.addCallback(lambda _: item)
+
+    def write_items(self, items: list):
+        rows = list()
+        for item in items:
+            if not isinstance(item, self.item_type):
                 continue
-            kwargs = item.get_context_kwargs()
-            value = kwargs.get(field, '')
-            row_data.append(value)
-        self.writer.writerow(row_data)
-        return item
+            row_data = list()
+            for field in self.fields:
+                value = item.get(field)
+                if value is not None:
+                    row_data.append(value)
+                    continue
+                kwargs = item.get_context_kwargs()
+                value = kwargs.get(field, '')
+                row_data.append(value)
+            rows.append(row_data)
+        self.writer.writerows(rows)
 
     def close_spider(self, spider):
+        if self.background_writer is not None:
+            self.background_writer.close()
         self.file.close()
 
 
@@ -7,7 +7,7 @@ def unpacked_sync_item(func):
             return func(self, item, spider)
 
         # process and filter out the sync data
-        sync_key, sync_data = item['key'], item['data']
+        sync_key, sync_data, sync_failed = item['key'], item['data'], item.get('failed')
         pipline_data = dict()
         for key in sync_data.keys():
             reserved_items = list()
@@ -16,6 +16,8 @@ def unpacked_sync_item(func):
                 if rlt is not None:
                     reserved_items.append(rlt)
             pipline_data[key] = reserved_items
+        if sync_failed:
+            return SyncItem(key=sync_key, data=pipline_data, failed=sync_failed)
         return SyncItem(key=sync_key, data=pipline_data)
 
     return wrapper
@@ -1,16 +1,49 @@
+import collections
 import csv
+import glob
+import gzip
 import io
 import os
 
 from pybloom import ScalableBloomFilter
 
-from BlockchainSpider.items.evm import BlockItem, TransactionItem, EventLogItem, TraceItem, ContractItem, \
-    Token721TransferItem, Token20TransferItem, Token1155TransferItem, TokenApprovalItem, TokenApprovalAllItem, \
-    TokenPropertyItem, NFTMetadataItem, TransactionReceiptItem, DCFGBlockItem, DCFGEdgeItem
+from BlockchainSpider import settings
+from BlockchainSpider.items import SyncItem, ItemBatch
+from BlockchainSpider.items.evm import BlockItem, BlockReorgItem, TransactionItem, EventLogItem, TraceItem, \
+    ContractItem, Token721TransferItem, Token20TransferItem, Token1155TransferItem, TokenApprovalItem, \
+    TokenApprovalAllItem, TokenPropertyItem, NFTMetadataItem, TransactionReceiptItem, DCFGBlockItem, DCFGEdgeItem
 from BlockchainSpider.items.solana import SolanaBlockItem, SolanaTransactionItem, SolanaInstructionItem, \
     SolanaLogItem, SolanaBalanceChangesItem, SPLTokenActionItem, ValidateVotingItem, SPLMemoItem
 from BlockchainSpider.items.tron import TronTransactionItem
 from BlockchainSpider.pipelines.sync import unpacked_sync_item
+from BlockchainSpider.pipelines.writer import BackgroundWriter
+
+COMPRESSION_EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+COMPRESSION_DEFAULT_LEVELS = {'gzip': 1, 'zstd': 3}  # the fast levels, which compress csv well enough
+
+
+def open_csv(filename: str, mode: str = 'w', compression: str = None, level: int = None):
+    """
+    Open a csv file in text mode, which is compressed in streaming if specified.
+
+    :param filename:
+    :param mode: `w` for writing, or `r` for reading
+    :param compression: none, `gzip` or `zstd`
+    :param level: the compression level, the default level of the compression if none
+    :return: the text file, and the underlying raw file for the written size
+    """
+    raw = open(filename, mode + 'b')
+    level = level if level is not None else COMPRESSION_DEFAULT_LEVELS.get(compression)
+    if compression == 'gzip':
+        stream = gzip.GzipFile(fileobj=raw, mode=mode + 'b', compresslevel=level)
+    elif compression == 'zstd':
+        import zstandard
+        stream = zstandard.ZstdCompressor(level=level).stream_writer(raw) \
+            if mode == 'w' else zstandard.ZstdDecompressor().stream_reader(raw)
+    else:
+        stream = raw
+    file = io.TextIOWrapper(stream, encoding='utf-8', newline='\n')
+    return file, raw
 
 
 class EVMTrans2csvPipeline:
@@ -20,7 +53,7 @@ class EVMTrans2csvPipeline:
         self.filename2headers = dict()
         self.accepted_item_cls = {
             cls.__name__: True for cls in [
-                BlockItem, TransactionItem, TransactionReceiptItem,
+                BlockItem, BlockReorgItem, TransactionItem, TransactionReceiptItem,
                 EventLogItem, TraceItem, ContractItem,
                 Token721TransferItem, Token20TransferItem, Token1155TransferItem,
                 TokenApprovalItem, TokenApprovalAllItem,
@@ -39,14 +72,87 @@ class EVMTrans2csvPipeline:
             ) for cls_name in self.deduplicate_item_cls.keys()
         }
         self.out_dir = None
+        self.checkpoint = None
+
+        # write the files in chunks if compressed or rotated,
+        # where the chunks are rolled over at the boundaries of sync items,
+        # and the items are routed to the chunk of their block range if rotated by blocks
+        self.compression = getattr(settings, 'CSV_COMPRESSION', None)
+        self.compression_level = getattr(settings, 'CSV_COMPRESSION_LEVEL', None)
+        self.rotate_size = getattr(settings, 'CSV_ROTATE_SIZE', None)
+        self.rotate_blocks = getattr(settings, 'CSV_ROTATE_BLOCKS', None)
+        self.max_open_chunks = getattr(settings, 'CSV_MAX_OPEN_CHUNKS', 4)
+        assert self.compression in COMPRESSION_EXTENSIONS, \
+            'CSV_COMPRESSION must be one of: {}'.format(list(COMPRESSION_EXTENSIONS.keys()))
+        self.is_chunked = any([v is not None for v in [self.compression, self.rotate_size, self.rotate_blocks]])
+        self.filename2raw = dict()
+        self._chunks = collections.OrderedDict()  # the index of block range -> chunk, in the recently used order
+        self._chunk = 0  # the index of chunk being written
+        self.background_writer = None
 
     def open_spider(self, spider):
         self.out_dir = getattr(spider, 'out_dir')
         if not os.path.exists(self.out_dir):
             os.makedirs(self.out_dir)
 
-    @unpacked_sync_item
+        # resume the output files from the checkpoint
+        self.checkpoint = getattr(spider, 'checkpoint', None)
+        if self.checkpoint is not None and self.is_chunked:
+            self._resume_chunks()
+        elif self.checkpoint is not None:
+            self._resume_files()
+        self.background_writer = BackgroundWriter.from_spider(self.__class__.__name__, spider)
+
     def process_item(self, item, spider):
+        if self.background_writer is None:
+            return self._process_item(item, spider)
+
+        # write in the background, and wait if the writer is busy
+        deferred = self.background_writer.submit(self._process_item, item, spider)
+        if deferred is None:
+            return item
+        return deferred.addCallback(lambda _: item)
+
+    def _process_item(self, item, spider):
+        # route the block to the chunk of its block range
+        if self.is_chunked and self.rotate_blocks and isinstance(item, SyncItem) and \
+                isinstance(item['key'], int) and item['key'] >= 0:
+            self._chunk = item['key'] // self.rotate_blocks
+        chunk = self._get_chunk(self._chunk, spider) if self.is_chunked else None
+
+        # the incomplete block is dropped if resumable, since it is re-fetched when resuming
+        dropped = isinstance(item, SyncItem) and item.get('failed', False) and self.checkpoint is not None
+        if dropped:
+            rlt = item
+        elif isinstance(item, SyncItem):
+            rlt = self.write_batches(item, spider)
+        else:
+            rlt = self.write_item(item, spider)
+
+        # the blocks of a chunk are completed when the chunk is rolled over,
+        # i.e., all blocks of the range are written, the size exceeds, or too many chunks are open
+        if self.is_chunked:
+            if isinstance(item, SyncItem):
+                self._add_chunk_key(chunk, item['key'], dropped)
+            if chunk['remaining'] is not None and len(chunk['remaining']) == 0:
+                self._rotate(self._chunk)
+            elif self.rotate_size and any([
+                self.filename2raw[fn].tell() >= self.rotate_size for fn in chunk['filenames']
+            ]):
+                self._rotate(self._chunk)
+            while len(self._chunks) > self.max_open_chunks:
+                self._rotate(next(iter(self._chunks.keys())))
+            return rlt
+
+        # mark the block completed after the items are written
+        if isinstance(item, SyncItem) and self.checkpoint is not None and not dropped:
+            self.checkpoint.add(item['key'])
+            if self.checkpoint.is_due:
+                self._save_checkpoint()
+        return rlt
+
+    @unpacked_sync_item
+    def write_item(self, item, spider):
         if self.out_dir is None:
             return item
 
@@ -63,32 +169,202 @@ class EVMTrans2csvPipeline:
                 return item
             bloom.add(item[field])
 
-        # init output file
+        # save to file cache
+        fn = self._get_filename(cls_name, item.keys())
+        self.filename2writer[fn].writerow([
+            item[k] for k in self.filename2headers[fn]
+        ])
+        return item
+
+    def write_batches(self, item: SyncItem, spider):
+        """
+        Write the items of the sync item by `writerows` for each class,
+        where the columnar batches are written by rows directly, i.e., without rebuilding the items.
+        """
+        if self.out_dir is None:
+            return item
+        for cls_name, items in item['data'].items():
+            if self.accepted_item_cls.get(cls_name) is None or len(items) == 0:
+                continue
+            if self.deduplicate_item_cls.get(cls_name):
+                for _item in items:
+                    self.write_item(_item, spider)
+                continue
+            if isinstance(items, ItemBatch):
+                fn = self._get_filename(cls_name, items.fields)
+                self.filename2writer[fn].writerows(items.rows(self.filename2headers[fn]))
+                continue
+            fn = self._get_filename(cls_name, items[0].keys())
+            headers = self.filename2headers[fn]
+            self.filename2writer[fn].writerows([[_item[k] for k in headers] for _item in items])
+        return item
+
+    def _get_filename(self, cls_name: str, fields) -> str:
+        # init output file, which is renamed by the block range when the chunk is rolled over
         fn = os.path.join(self.out_dir, '%s.csv' % cls_name)
+        if self.is_chunked:
+            fn = '%s%s%s.tmp' % (
+                fn, COMPRESSION_EXTENSIONS[self.compression],
+                '.%d' % self._chunk if self.rotate_blocks else '',
+            )
         if not self.filename2file.get(fn):
-            file = open(fn, 'w', encoding='utf-8', newline='\n', buffering=io.DEFAULT_BUFFER_SIZE)
+            if self.is_chunked:
+                file, self.filename2raw[fn] = open_csv(fn, 'w', self.compression, self.compression_level)
+                self._get_chunk(self._chunk)['filenames'].append(fn)
+            else:
+                file = open(fn, 'w', encoding='utf-8', newline='\n', buffering=io.DEFAULT_BUFFER_SIZE)
             self.filename2file[fn] = file
 
             # init headers
-            headers = sorted(item.keys())
+            headers = sorted(fields)
             self.filename2headers[fn] = headers
 
             # init writer
             writer = csv.writer(file)
             writer.writerow(headers)
             self.filename2writer[fn] = writer
-
-        # save to file cache
-        self.filename2writer[fn].writerow([
-            item[k] for k in self.filename2headers[fn]
-        ])
-        return item
+        return fn
 
     def close_spider(self, spider):
+        if self.background_writer is not None:
+            self.background_writer.close()
+        if self.is_chunked:
+            self._rotate()
+            return
+        if self.checkpoint is not None:
+            self._save_checkpoint()
         for file in self.filename2file.values():
             file.flush()
             file.close()
 
+    def _resume_files(self):
+        # the files (or the data after the committed offsets) not in the checkpoint
+        # are written by the unfinished blocks, which are truncated
+        for cls_name in self.accepted_item_cls.keys():
+            basename = '%s.csv' % cls_name
+            fn = os.path.join(self.out_dir, basename)
+            committed = self.checkpoint.files.get(basename)
+            if not os.path.exists(fn):
+                continue
+            if committed is None:
+                os.remove(fn)
+                continue
+            os.truncate(fn, committed['offset'])
+
+            # rebuild the bloom filter of the committed items
+            if self.deduplicate_item_cls.get(cls_name):
+                bloom = self._cls4bloom[cls_name]
+                field = self.deduplicate_item_cls[cls_name]
+                with open(fn, 'r', encoding='utf-8', newline='\n') as f:
+                    for row in csv.DictReader(f):
+                        bloom.add(row[field])
+
+            # append to the committed file
+            file = open(fn, 'a', encoding='utf-8', newline='\n', buffering=io.DEFAULT_BUFFER_SIZE)
+            self.filename2file[fn] = file
+            self.filename2headers[fn] = committed['headers']
+            self.filename2writer[fn] = csv.writer(file)
+
+    def _rotate(self, index: int = None):
+        """
+        Finish the chunk (or all chunks if none), i.e., close the files and rename them by the block range,
+        and commit the blocks of the chunk to the checkpoint.
+        """
+        indexes = [index] if index is not None else list(self._chunks.keys())
+        for index in indexes:
+            chunk = self._chunks.pop(index, None)
+            if chunk is None:
+                continue
+            block_range = '%d-%d' % tuple(chunk['range']) if chunk['range'] is not None else 'unknown'
+            ext = '.csv%s' % COMPRESSION_EXTENSIONS[self.compression]
+            for fn in chunk['filenames']:
+                self.filename2file.pop(fn).close()
+                self.filename2raw.pop(fn).close()
+                self.filename2writer.pop(fn)
+                self.filename2headers.pop(fn)
+
+                # keep the chunks of the previous runs, e.g., the same range crawled again
+                prefix = os.path.join(os.path.dirname(fn), os.path.basename(fn).split('.')[0])
+                dst, idx = '%s.%s%s' % (prefix, block_range, ext), 0
+                while os.path.exists(dst):
+                    idx += 1
+                    dst = '%s.%s.%d%s' % (prefix, block_range, idx, ext)
+                os.replace(fn, dst)
+
+            if self.checkpoint is not None:
+                for key in chunk['keys']:
+                    self.checkpoint.add(key)
+        if self.checkpoint is not None and len(indexes) > 0:
+            self.checkpoint.save(dict())
+
+    def _get_chunk(self, index: int, spider=None) -> dict:
+        chunk = self._chunks.get(index)
+        if chunk is not None:
+            self._chunks.move_to_end(index)
+            return chunk
+
+        # the blocks of the range to be written, which are unknown if not rotated by blocks
+        remaining = None
+        if self.rotate_blocks and spider is not None:
+            start_block, end_block = index * self.rotate_blocks, (index + 1) * self.rotate_blocks - 1
+            blocks = getattr(spider, 'blocks', None)
+            if blocks is not None:
+                remaining = {blk for blk in blocks if start_block <= blk <= end_block}
+            else:
+                spider_start_block = getattr(spider, 'start_block', -1)
+                spider_end_block = getattr(spider, 'end_block', None)
+                start_block = max(start_block, spider_start_block)
+                end_block = min(end_block, spider_end_block) if spider_end_block is not None else end_block
+                remaining = set(range(start_block, end_block + 1))
+            if self.checkpoint is not None:
+                remaining = {blk for blk in remaining if blk not in self.checkpoint}
+        chunk = {'keys': list(), 'range': None, 'filenames': list(), 'remaining': remaining}
+        self._chunks[index] = chunk
+        return chunk
+
+    @staticmethod
+    def _add_chunk_key(chunk: dict, key, dropped: bool = False):
+        # the dropped block is not committed, but the chunk does not wait for it
+        if not dropped:
+            chunk['keys'].append(key)
+        if not isinstance(key, int):
+            return
+        if chunk['remaining'] is not None:
+            chunk['remaining'].discard(key)
+        if dropped:
+            return
+        if chunk['range'] is None:
+            chunk['range'] = [key, key]
+        chunk['range'] = [min(chunk['range'][0], key), max(chunk['range'][1], key)]
+
+    def _resume_chunks(self):
+        # the unfinished chunks are written by the uncommitted blocks, which are removed
+        ext = '.csv%s' % COMPRESSION_EXTENSIONS[self.compression]
+        for cls_name in self.accepted_item_cls.keys():
+            for fn in glob.glob(os.path.join(glob.escape(self.out_dir), '%s%s*.tmp' % (cls_name, ext))):
+                os.remove(fn)
+
+            # rebuild the bloom filter of the committed items
+            if self.deduplicate_item_cls.get(cls_name):
+                bloom = self._cls4bloom[cls_name]
+                field = self.deduplicate_item_cls[cls_name]
+                for chunk_fn in glob.glob(os.path.join(glob.escape(self.out_dir), '%s.*%s' % (cls_name, ext))):
+                    file, raw = open_csv(chunk_fn, 'r', self.compression)
+                    with file, raw:
+                        for row in csv.DictReader(file):
+                            bloom.add(row[field])
+
+    def _save_checkpoint(self):
+        files = dict()
+        for fn, file in self.filename2file.items():
+            file.flush()
+            os.fsync(file.fileno())
+            files[os.path.basename(fn)] = {
+                'offset': os.fstat(file.fileno()).st_size,
+                'headers': self.filename2headers[fn],
+            }
+        self.checkpoint.save(files)
+
 
 class SolanaTrans2csvPipeline(EVMTrans2csvPipeline):
     def __init__(self):
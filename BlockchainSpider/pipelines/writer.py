@@ -0,0 +1,166 @@
+import collections
+import logging
+import queue
+import threading
+import time
+from typing import Union
+
+from twisted.internet import defer
+from twisted.python import failure
+
+from BlockchainSpider import settings
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWriter:
+    """
+    Run the writing tasks of pipelines (e.g., formatting and writing rows) in a dedicated thread,
+    so that the disk stalls do not stall the reactor.
+
+    The tasks are executed in the submission order through a bounded queue.
+    If the queue is full, the submission returns a deferred fired once the task is queued,
+    which is returned by `process_item` to apply backpressure to the crawl.
+    The queue depth and write latency are exported in the crawler stats with the prefix `writer/`.
+    If a task fails, the later tasks are dropped, the waiting submissions fail,
+    and the spider is closed with the reason `writer_failed`.
+    Note that the submitted items are written later, which should not be modified by the later pipelines.
+    """
+    _CLOSE = object()  # the sentinel to stop the thread
+
+    def __init__(self, name: str, stats=None, queue_size: int = None, crawler=None):
+        self.name = name
+        self.stats = stats
+        self.crawler = crawler
+        self.queue_size = queue_size if queue_size is not None \
+            else getattr(settings, 'PIPELINE_WRITER_QUEUE_SIZE', 256)
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._pending = collections.deque()  # (task, deferred) waiting for the queue, in the reactor thread
+        self._thread = None
+        self._failure = None  # the first failure of tasks, set by the writer thread
+
+        # the counters updated by the writer thread only
+        self._written = 0
+        self._write_time = 0
+        self._max_write_latency = 0
+
+    @classmethod
+    def from_spider(cls, name: str, spider) -> Union['BackgroundWriter', None]:
+        """
+        Start a writer for the pipeline if `PIPELINE_WRITER_THREAD` is enabled.
+
+        :param name: the name of pipeline, e.g., the class name
+        :param spider:
+        :return: none if disabled
+        """
+        if not getattr(settings, 'PIPELINE_WRITER_THREAD', False):
+            return None
+        crawler = getattr(spider, 'crawler', None)
+        writer = cls(name=name, stats=crawler.stats if crawler is not None else None, crawler=crawler)
+        writer.start()
+        return writer
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args) -> Union[defer.Deferred, None]:
+        """
+        Submit a task to the writer thread.
+
+        :param func:
+        :param args:
+        :return: none if queued, otherwise a deferred fired once queued, or failed if the writer failed
+        """
+        if self._failure is not None:
+            return defer.fail(self._failure)
+        task = (func, args)
+        if len(self._pending) == 0:
+            try:
+                self._queue.put_nowait(task)
+                self._update_depth()
+                return None
+            except queue.Full:
+                pass
+
+        # wait for the queue, where the tasks submitted later are queued later
+        deferred = defer.Deferred()
+        self._pending.append((task, deferred))
+        self._inc_stats('writer/stalls')
+        return deferred
+
+    def close(self):
+        """
+        Wait for all the submitted tasks written, and stop the writer thread.
+
+        :return:
+        """
+        if self._thread is None:
+            return
+        while len(self._pending) > 0:
+            task, deferred = self._pending.popleft()
+            if self._failure is not None:
+                deferred.errback(self._failure)
+                continue
+            self._queue.put(task)
+            deferred.callback(None)
+        self._queue.put(self._CLOSE)
+        self._thread.join()
+        self._thread = None
+        self._on_written()
+
+    def _run(self):
+        from twisted.internet import reactor
+        while True:
+            task = self._queue.get()
+            if task is self._CLOSE:
+                return
+            # drop the tasks after a failure, which are lost anyway
+            if self._failure is not None:
+                continue
+            func, args = task
+            start_time = time.monotonic()
+            try:
+                func(*args)
+            except Exception:
+                self._failure = failure.Failure()
+                reactor.callFromThread(self._on_failed)
+            latency = time.monotonic() - start_time
+            self._written += 1
+            self._write_time += latency
+            self._max_write_latency = max(self._max_write_latency, latency)
+            reactor.callFromThread(self._on_written)
+
+    def _on_written(self):
+        # refill the queue with the pending tasks, which are failed instead if the writer failed
+        while self._failure is None and len(self._pending) > 0 and not self._queue.full():
+            task, deferred = self._pending.popleft()
+            self._queue.put_nowait(task)
+            deferred.callback(None)
+        self._update_depth()
+        if self.stats is not None:
+            self.stats.set_value('writer/tasks', self._written)
+            self.stats.set_value('writer/write_time', self._write_time)
+            self.stats.set_value('writer/max_write_latency', self._max_write_latency)
+
+    def _on_failed(self):
+        logger.error('Failed to write in {}:\n{}'.format(self.name, self._failure.getTraceback()))
+        self._inc_stats('writer/failures')
+
+        # fail the submissions waiting for the queue, and stop the crawl
+        while len(self._pending) > 0:
+            _, deferred = self._pending.popleft()
+            deferred.errback(self._failure)
+        if self.crawler is not None and self.crawler.engine is not None and self.crawler.spider is not None:
+            self.crawler.engine.close_spider(self.crawler.spider, reason='writer_failed')
+
+    def _update_depth(self):
+        if self.stats is None:
+            return
+        depth = self._queue.qsize() + len(self._pending)
+        self.stats.set_value('writer/queue_depth', depth)
+        self.stats.max_value('writer/max_queue_depth', depth)
+
+    def _inc_stats(self, key: str, count=1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
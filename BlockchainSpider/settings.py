@@ -12,6 +12,7 @@ BOT_NAME = 'BlockchainSpider'
 
 SPIDER_MODULES = ['BlockchainSpider.spiders']
 NEWSPIDER_MODULE = 'BlockchainSpider.spiders'
+COMMANDS_MODULE = 'BlockchainSpider.commands'
 
 # Crawl responsibly by identifying yourself (and your website) on the user-agent
 # USER_AGENT = 'BlockchainSpider (+http://www.yourdomain.com)'
@@ -103,3 +104,60 @@ LOG_LEVEL = 'INFO'
 
 # The response size (in bytes) that downloader will start to warn.
 DOWNLOAD_WARNSIZE = 33554432 * 2
+
+# The json backend for parsing responses, e.g., 'orjson', 'simdjson' or 'json'.
+# The fastest one installed is used by default.
+# JSON_BACKEND = 'orjson'
+
+# The memory budget (in bytes) of the cached items for each sync key,
+# the items exceeding the budget are spilled to local files in `SYNC_SPILL_DIR`.
+# SYNC_MEMORY_BUDGET = 64 * 1024 * 1024
+# SYNC_SPILL_DIR = './spill'
+
+# The maximum number of in-flight sync keys (e.g., blocks),
+# and the new blocks are scheduled until some keys are synchronized.
+# SYNC_MAX_KEYS = 1024
+
+# Cache the items of each block in columnar batches (i.e., one object for each item class),
+# which reduces the memory and allocations of the busy blocks.
+# SYNC_COLUMNAR = True
+
+# Emit the synchronized blocks in the order of block numbers,
+# where a missing block is skipped if the gap lasts over `SYNC_ORDER_GAP_TIMEOUT` seconds,
+# or the reorder buffer is full.
+# SYNC_ORDER_ENABLED = True
+# SYNC_ORDER_GAP_TIMEOUT = 60
+# SYNC_ORDER_MAX_BUFFER = 1024
+
+# The block range of `eth_getLogs` in `EventLogRangeMiddleware`,
+# which is halved on the "too many results" errors, and doubled if the results are few.
+# EVENT_LOG_RANGE_SIZE = 100
+# EVENT_LOG_RANGE_MAX_SIZE = 2000
+# EVENT_LOG_RANGE_TARGET_RESULTS = 2000
+# EVENT_LOG_RANGE_MAX_RETRIES = 3
+
+# The local cache of the probed provider capabilities (e.g., block receipts, tracing and JSON-RPC batch),
+# which expires after `PROVIDER_CAPABILITY_TTL` seconds, and the cache is disabled if None.
+# PROVIDER_CAPABILITY_CACHE = './capabilities.json'
+# PROVIDER_CAPABILITY_TTL = 86400
+
+# The parquet pipeline in `plugins/parquet`, which writes a row group every `PARQUET_ROW_GROUP_BLOCKS` blocks,
+# and partitions the files by `PARQUET_PARTITION_BLOCKS` blocks.
+# PARQUET_ROW_GROUP_BLOCKS = 100
+# PARQUET_PARTITION_BLOCKS = 100000
+# PARQUET_MAX_OPEN_PARTITIONS = 8
+# PARQUET_COMPRESSION = 'zstd'
+
+# Write the csv files in chunks compressed by `gzip` or `zstd` (requires `pip install zstandard`),
+# which are rolled over by the compressed size in bytes or the block range,
+# and named by the block range, e.g., `TransactionItem.19000000-19000999.csv.gz`.
+# CSV_COMPRESSION = 'gzip'
+# CSV_COMPRESSION_LEVEL = 1
+# CSV_ROTATE_SIZE = 256 * 1024 * 1024
+# CSV_ROTATE_BLOCKS = 1000
+# CSV_MAX_OPEN_CHUNKS = 4
+
+# Write the outputs of the csv pipelines in a background thread through a bounded queue,
+# and the crawl waits if the queue is full.
+# PIPELINE_WRITER_THREAD = True
+# PIPELINE_WRITER_QUEUE_SIZE = 256
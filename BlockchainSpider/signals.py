@@ -0,0 +1,7 @@
+"""
+The custom signals of BlockchainSpider, which are sent by `crawler.signals`.
+"""
+
+# sent when the items of a sync key are synchronized,
+# args: item (SyncItem), spider
+sync_item_released = object()
@@ -1,26 +1,43 @@
+import asyncio
+import collections
 import json
 import logging
+import os
 import time
 
 import scrapy
+from scrapy.utils.defer import deferred_from_coro
 
-from BlockchainSpider import settings
-from BlockchainSpider.items import BlockItem, TransactionItem
-from BlockchainSpider.middlewares import SyncMiddleware
+from BlockchainSpider import settings, signals
+from BlockchainSpider.items import BlockItem, BlockReorgItem, TransactionItem
+from BlockchainSpider.middlewares import SyncMiddleware, JSONRPCBatchMiddleware
+from BlockchainSpider.utils import fastjson
 from BlockchainSpider.utils.bucket import AsyncItemBucket
+from BlockchainSpider.utils.capability import ProviderCapabilities, DEFAULT_CAPABILITY_CACHE
+from BlockchainSpider.utils.checkpoint import BlockCheckpoint
 from BlockchainSpider.utils.decorator import log_debug_tracing
-from BlockchainSpider.utils.web3 import hex_to_dec
+from BlockchainSpider.utils.route import ProviderRouter, ProviderRoute
+from BlockchainSpider.utils.window import AdaptiveWindow
+from BlockchainSpider.utils.web3 import hex_to_dec, close_web3_clients, get_web3_client_stats, web3_json_rpc, \
+    web3_subscribe
 
 
 class EVMBlockTransactionSpider(scrapy.Spider):
     name = 'trans.block.evm'
+    REORG_RING_SIZE = 256
+    PROBE_CAPABILITIES = True  # probe the EVM JSON-RPC capabilities of providers
     custom_settings = {
         'SPIDER_MIDDLEWARES': {
             'BlockchainSpider.middlewares.SyncMiddleware': 535,
+            'BlockchainSpider.middlewares.SyncOrderMiddleware': 530,
             **getattr(settings, 'SPIDER_MIDDLEWARES', dict())
         },
         'DOWNLOADER_MIDDLEWARES': {
             'BlockchainSpider.middlewares.UnterminatedJSONRetryMiddleware': 100,
+            'BlockchainSpider.middlewares.HedgedRequestMiddleware': 115,
+            'BlockchainSpider.middlewares.ProviderHealthMiddleware': 120,
+            'BlockchainSpider.middlewares.AdaptiveConcurrencyMiddleware': 130,
+            'BlockchainSpider.middlewares.JSONRPCBatchMiddleware': 110,
             **getattr(settings, 'DOWNLOADER_MIDDLEWARES', dict())
         },
         'ITEM_PIPELINES': {
@@ -33,6 +50,7 @@ class EVMBlockTransactionSpider(scrapy.Spider):
     def from_crawler(cls, crawler, *args, **kwargs):
         spider = super().from_crawler(crawler, *args, **kwargs)
         available_middlewares = {
+            'BlockchainSpider.middlewares.trans.EventLogRangeMiddleware': 543,
             'BlockchainSpider.middlewares.trans.TransactionReceiptMiddleware': 542,
             'BlockchainSpider.middlewares.trans.TokenTransferMiddleware': 541,
             'BlockchainSpider.middlewares.trans.TokenPropertyMiddleware': 540,
@@ -52,6 +70,7 @@ class EVMBlockTransactionSpider(scrapy.Spider):
                 value=spider_middlewares,
                 priority=spider.settings.attributes['SPIDER_MIDDLEWARES'].priority,
             )
+        crawler.signals.connect(spider.on_sync_item_released, signal=signals.sync_item_released)
         return spider
 
     def __init__(self, **kwargs):
@@ -66,47 +85,108 @@ class EVMBlockTransactionSpider(scrapy.Spider):
             int(blk) for blk in kwargs['blocks'].split(',')
         ] if kwargs.get('blocks') else None
 
+        # skip the completed blocks in the checkpoint when resuming,
+        # the checkpoint is saved in the output dir every interval seconds
+        self.checkpoint = BlockCheckpoint(
+            filename=os.path.join(self.out_dir, 'checkpoint.json'),
+            interval=float(kwargs['checkpoint']),
+        ) if kwargs.get('checkpoint') else None
+        if self.checkpoint is not None and self.start_block == -1 and len(self.checkpoint.intervals) > 0:
+            self.start_block = self.checkpoint.intervals[0][0]
+            self._block_cursor = self.start_block
+
+        # the sliding window of blocks in flight, which is adapted to the completion rate
+        self.block_window = AdaptiveWindow(
+            size=int(kwargs['window']),
+            max_size=int(kwargs.get('window_max', int(kwargs['window']) * 8)),
+        ) if kwargs.get('window') else None
+        self._window_blocks = set()
+
+        # the confirmation depth and the recent block hashes for detecting reorgs in the tail mode
+        self.confirmations = int(kwargs.get('confirmations', '0'))
+        self._recent_blocks = collections.OrderedDict()  # block_number -> (block_hash, parent_hash)
+
+        # subscribe the new heads by websocket in the tail mode
+        self.ws_provider = kwargs.get('ws_provider')
+        self.ws_timeout = int(kwargs.get('ws_timeout', '30'))
+        self._ws_connected = False
+        self._ws_task = None
+        self._new_heads = asyncio.Queue()
+
         # block receipt method
         self.block_receipt_method = kwargs.get('block_receipt_method', 'eth_getBlockReceipts')
 
-        # provider settings
+        # provider settings, the qps of each provider is limited by `CONCURRENT_REQUESTS` by default
         assert kwargs.get('providers') is not None, "please input providers separated by commas!"
+        qps = float(kwargs['qps']) if kwargs.get('qps') else None
         self.provider_bucket = AsyncItemBucket(
             items=kwargs.get('providers').split(','),
-            qps=getattr(settings, 'CONCURRENT_REQUESTS', 5),
+            qps=qps if qps is not None else getattr(settings, 'CONCURRENT_REQUESTS', 5),
         )
 
-        # provider settings for specific data
-        self.middleware_providers = {
-            'TransactionReceiptMiddleware': AsyncItemBucket(
-                items=kwargs['providers4receipt'].split(','),
-                qps=getattr(settings, 'CONCURRENT_REQUESTS', 2),
-            ) if kwargs.get('providers4receipt') else None,
-            'TraceMiddleware': AsyncItemBucket(
-                items=kwargs['providers4trace'].split(','),
-                qps=getattr(settings, 'CONCURRENT_REQUESTS', 2),
-            ) if kwargs.get('providers4trace') else None,
-            'TokenTransferMiddleware': AsyncItemBucket(
-                items=kwargs['providers4token_transfer'].split(','),
-                qps=getattr(settings, 'CONCURRENT_REQUESTS', 2),
-            ) if kwargs.get('providers4token_transfer') else None,
-            'TokenPropertyMiddleware': AsyncItemBucket(
-                items=kwargs['providers4token_property'].split(','),
-                qps=getattr(settings, 'CONCURRENT_REQUESTS', 2),
-            ) if kwargs.get('providers4token_property') else None,
-            'MetadataMiddleware': AsyncItemBucket(
-                items=kwargs['providers4metadata'].split(','),
-                qps=getattr(settings, 'CONCURRENT_REQUESTS', 2),
-            ) if kwargs.get('providers4metadata') else None,
-            'ContractMiddleware': AsyncItemBucket(
-                items=kwargs['providers4contract'].split(','),
-                qps=getattr(settings, 'CONCURRENT_REQUESTS', 2),
-            ) if kwargs.get('providers4contract') else None,
-            'DCFGMiddleware': AsyncItemBucket(
-                items=kwargs['providers4dcfg'].split(','),
-                qps=getattr(settings, 'CONCURRENT_REQUESTS', 2),
-            ) if kwargs.get('providers4dcfg') else None,
+        # json-rpc batch size for each provider
+        batch_sizes = [int(size) for size in kwargs.get('batch_size', '1').split(',')]
+        if len(batch_sizes) == 1:
+            batch_sizes = batch_sizes * len(self.provider_bucket.items)
+        assert len(batch_sizes) == len(self.provider_bucket.items), \
+            "please input one batch size, or one batch size for each provider!"
+        self.provider_batch_size = {
+            provider.rstrip('/'): size for provider, size in zip(self.provider_bucket.items, batch_sizes)
         }
+        self._batch_provider = None
+        self._batch_remaining = 0
+
+        # the backend of call traces, i.e., `auto`, `debug` (debug_trace*) or `parity` (trace_*)
+        self.trace_backend = kwargs.get('trace_backend', 'auto')
+        assert self.trace_backend in {'auto', 'debug', 'parity'}, \
+            "please input `auto`, `debug` or `parity` for the trace backend!"
+
+        # hedge the slow requests exceeding the latency percentile, e.g., 0.95
+        self.hedge_percentile = float(kwargs['hedge']) if kwargs.get('hedge') else None
+
+        # provider routing by methods, middlewares and block ages
+        self.provider_router = ProviderRouter.from_config(
+            config=kwargs.get('routes', dict()),
+            default=self.provider_bucket,
+            qps=qps if qps is not None else getattr(settings, 'CONCURRENT_REQUESTS', 2),
+            shards=int(kwargs.get('shards', 1)),
+        )
+        for middleware, arg in [
+            ('TransactionReceiptMiddleware', 'providers4receipt'),
+            ('EventLogRangeMiddleware', 'providers4event_log'),
+            ('TraceMiddleware', 'providers4trace'),
+            ('TokenTransferMiddleware', 'providers4token_transfer'),
+            ('TokenPropertyMiddleware', 'providers4token_property'),
+            ('MetadataMiddleware', 'providers4metadata'),
+            ('ContractMiddleware', 'providers4contract'),
+            ('DCFGMiddleware', 'providers4dcfg'),
+        ]:
+            if not kwargs.get(arg):
+                continue
+            self.provider_router.add_pool(name=arg, bucket=AsyncItemBucket(
+                items=kwargs[arg].split(','),
+                qps=qps if qps is not None else getattr(settings, 'CONCURRENT_REQUESTS', 2),
+            ))
+            self.provider_router.add_route(ProviderRoute(pools=arg, middlewares=[middleware]), first=True)
+
+        # the capabilities of providers, e.g., block receipts, tracing and JSON-RPC batch,
+        # which are probed lazily by the middlewares needing them and cached locally
+        self.provider_router.capabilities = ProviderCapabilities(
+            filename=getattr(settings, 'PROVIDER_CAPABILITY_CACHE', DEFAULT_CAPABILITY_CACHE),
+            ttl=getattr(settings, 'PROVIDER_CAPABILITY_TTL', 86400),
+        ) if self.PROBE_CAPABILITIES else None
+        self.provider_batch_size.update(self.provider_router.pool2batch_size)
+
+    def closed(self, reason: str):
+        for key, value in get_web3_client_stats().items():
+            self.crawler.stats.set_value('web3_client/%s' % key, value)
+        for key, value in self.provider_router.get_stats().items():
+            self.crawler.stats.set_value('route/%s' % key, value)
+        if self.block_window is not None:
+            self.crawler.stats.set_value('window/size', int(self.block_window.size))
+        if self._ws_task is not None:
+            self._ws_task.cancel()
+        return deferred_from_coro(close_web3_clients())
 
     def start_requests(self):
         request = self.get_request_web3_client_version()
@@ -115,7 +195,7 @@ class EVMBlockTransactionSpider(scrapy.Spider):
 
     async def _start_requests(self, response: scrapy.http.Response, **kwargs):
         try:
-            result = json.loads(response.text)
+            result = fastjson.loads(response.body)
             result = result.get('result')
             self.log(
                 message="Detected client version: {}, {} is starting.".format(
@@ -126,9 +206,36 @@ class EVMBlockTransactionSpider(scrapy.Spider):
         except:
             pass
 
+        # fetch the chain head for routing by block ages
+        if self.provider_router.requires_head:
+            block_number = await web3_json_rpc(
+                tx_obj={"jsonrpc": "2.0", "method": "eth_blockNumber", "params": [], "id": 1},
+                provider=self.provider_bucket.items[0],
+                timeout=10,
+            )
+            if block_number is not None:
+                self.provider_router.update_head(int(block_number, 16))
+
+        # probe the batch capability of providers if batching, and limit the batch sizes
+        capabilities = self.provider_router.capabilities
+        if capabilities is not None and any([size > 1 for size in self.provider_batch_size.values()]):
+            await self.provider_router.probe_capabilities(batch=True)
+            for provider, batch_size in self.provider_batch_size.items():
+                max_batch_size = capabilities.get_max_batch_size(provider)
+                if max_batch_size is None or batch_size <= max_batch_size:
+                    continue
+                self.log(
+                    message='The batch size of {} is limited to {}.'.format(provider, max_batch_size),
+                    level=logging.INFO,
+                )
+                self.provider_batch_size[provider] = max_batch_size
+
         # generate the requests for discrete blocks
         if self.blocks is not None:
             for i, blk in enumerate(self.blocks):
+                if self._is_completed(blk):
+                    continue
+                await self._acquire_block_window(blk)
                 yield await self.get_request_eth_block_by_number(
                     block_number=blk,
                     priority=2 ** 32 - i,
@@ -138,44 +245,49 @@ class EVMBlockTransactionSpider(scrapy.Spider):
 
         # generate the requests for continuous blocks
         if self.end_block is None:
+            if self.ws_provider is not None and self._ws_task is None:
+                self._ws_task = asyncio.ensure_future(self._subscribe_new_heads())
             yield await self.get_request_eth_block_number()
             return
         end_block = self.end_block + 1
         for blk in range(self.start_block, end_block):
+            if self._is_completed(blk):
+                continue
+            await self._acquire_block_window(blk)
             yield await self.get_request_eth_block_by_number(
                 block_number=blk,
                 priority=2 ** 32 - blk,
                 cb_kwargs={'$sync': blk},
             )
 
+    def _is_completed(self, block_number: int) -> bool:
+        return self.checkpoint is not None and block_number in self.checkpoint
+
+    async def _acquire_block_window(self, block_number: int):
+        if self.block_window is None or block_number in self._window_blocks:
+            return
+        await self.block_window.acquire()
+        self._window_blocks.add(block_number)
+
+    def _release_block_window(self, block_number: int):
+        # admit the next block when a block in the window is finished
+        if self.block_window is None or block_number not in self._window_blocks:
+            return
+        self._window_blocks.remove(block_number)
+        self.block_window.release()
+
+    def on_sync_item_released(self, item, spider):
+        self._release_block_window(item['key'])
+
     @log_debug_tracing
     async def parse_eth_block_number(self, response: scrapy.http.Response, **kwargs):
-        result = json.loads(response.text)
+        result = fastjson.loads(response.body)
         result = result.get('result')
 
         # generate more requests
         if result is not None:
-            block = int(result, 16)
-
-            # patch for querying the latest block
-            if self.start_block == -1 and self._block_cursor == -1:
-                self.start_block = block
-                self._block_cursor = block
-
-            # query more blocks
-            end_block = block + 1
-            start_block, self._block_cursor = self._block_cursor, end_block
-            if end_block - start_block > 0:
-                self.log(
-                    message='Try to fetch the new block to: #%d' % end_block,
-                    level=logging.INFO,
-                )
-            for blk in range(start_block, end_block):
-                yield await self.get_request_eth_block_by_number(
-                    block_number=blk,
-                    priority=2 ** 32 - blk,
-                    cb_kwargs={'$sync': blk},
-                )
+            async for request in self._get_requests_to_block(int(result, 16)):
+                yield request
         else:
             self.log(
                 message="Result field is None on eth_getBlockNumber" +
@@ -183,11 +295,89 @@ class EVMBlockTransactionSpider(scrapy.Spider):
                 level=logging.ERROR
             )
 
-        # next query of block number
+        # next query of block number, or wait for the new heads if subscribed
         if self.end_block is not None:
             return
+        if self._ws_connected:
+            yield self.get_request_new_heads()
+            return
         yield await self.get_request_eth_block_number()
 
+    async def _get_requests_to_block(self, block: int):
+        self.provider_router.update_head(block)
+        block = block - self.confirmations
+
+        # patch for querying the latest block
+        if self.start_block == -1 and self._block_cursor == -1:
+            self.start_block = block
+            self._block_cursor = block
+
+        # query more blocks, the gap since the last cursor is filled
+        end_block = block + 1
+        start_block, self._block_cursor = self._block_cursor, max(self._block_cursor, end_block)
+        if end_block - start_block > 0:
+            self.log(
+                message='Try to fetch the new block to: #%d' % end_block,
+                level=logging.INFO,
+            )
+        for blk in range(start_block, end_block):
+            if self._is_completed(blk):
+                continue
+            yield await self.get_request_eth_block_by_number(
+                block_number=blk,
+                priority=2 ** 32 - blk,
+                cb_kwargs={'$sync': blk},
+            )
+
+    @log_debug_tracing
+    async def parse_new_heads(self, response: scrapy.http.Response, **kwargs):
+        # wait for the new heads, and poll the block number on timeout
+        try:
+            head = await asyncio.wait_for(self._new_heads.get(), timeout=self.ws_timeout)
+        except asyncio.TimeoutError:
+            head = None
+        heads = [head]
+        while not self._new_heads.empty():
+            heads.append(self._new_heads.get_nowait())
+        heads = [head for head in heads if head is not None]
+        if len(heads) > 0:
+            self.crawler.stats.inc_value('new_heads/received', len(heads))
+            async for request in self._get_requests_to_block(max(heads)):
+                yield request
+
+        # fall back to polling if disconnected
+        if self._ws_connected and head is not None:
+            yield self.get_request_new_heads()
+            return
+        yield await self.get_request_eth_block_number()
+
+    async def _subscribe_new_heads(self):
+        retry_delay = 1
+        while True:
+            try:
+                async for head in web3_subscribe(provider=self.ws_provider, params=['newHeads']):
+                    if not self._ws_connected:
+                        self.log(
+                            message='Subscribed the new heads from: %s' % self.ws_provider,
+                            level=logging.INFO,
+                        )
+                    self._ws_connected = True
+                    retry_delay = 1
+                    self._new_heads.put_nowait(int(head['number'], 16))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log(
+                    message='Failed to subscribe the new heads: %s' % e,
+                    level=logging.WARNING,
+                )
+
+            # fall back to polling, and reconnect later
+            self._ws_connected = False
+            self._new_heads.put_nowait(None)
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, 60)
+
     @log_debug_tracing
     async def errback_parse_eth_block_number(self, failure):
         self.log(
@@ -198,25 +388,34 @@ class EVMBlockTransactionSpider(scrapy.Spider):
 
     @log_debug_tracing
     async def parse_eth_get_block_by_number(self, response: scrapy.http.Response, **kwargs):
-        result = json.loads(response.text)
+        result = fastjson.loads(response.body)
         result = result.get('result')
 
+        # verify the parent hashes of recent blocks in the tail mode
+        if self.end_block is None:
+            async for item in self._check_reorg(
+                    block_number=hex_to_dec(result.get('number')),
+                    block_hash=result.get('hash', ''),
+                    parent_hash=result.get('parentHash', ''),
+            ):
+                yield item
+
         # fetch receipt for each transaction if block receipt api unavailable
         timestamp = hex_to_dec(result.get('timestamp'))
         transactions = list()
         for item in result.get('transactions', list()):
             item = TransactionItem(
                 transaction_hash=item.get('hash', ''),
-                transaction_index=hex_to_dec(item.get('transactionIndex')),
+                transaction_index=item.get('transactionIndex'),
                 block_hash=item.get('blockHash', ''),
                 block_number=hex_to_dec(item.get('blockNumber')),
                 timestamp=timestamp,
                 address_from=item['from'] if item.get('from') else '',
                 address_to=item['to'] if item.get('to') else '',
-                value=hex_to_dec(item.get('value')),
-                gas=hex_to_dec(item.get('gas')),
-                gas_price=hex_to_dec(item.get('gasPrice')),
-                nonce=hex_to_dec(item.get('nonce')),
+                value=item.get('value'),
+                gas=item.get('gas'),
+                gas_price=item.get('gasPrice'),
+                nonce=item.get('nonce'),
                 input=item.get('input', ''),
             )
             transactions.append(item)
@@ -227,19 +426,55 @@ class EVMBlockTransactionSpider(scrapy.Spider):
             block_hash=result.get('hash', ''),
             block_number=hex_to_dec(result.get('number')),
             parent_hash=result.get('parentHash', ''),
-            difficulty=hex_to_dec(result.get('difficulty')),
-            total_difficulty=hex_to_dec(result.get('totalDifficulty')),
-            size=hex_to_dec(result.get('size')),
-            gas_limit=hex_to_dec(result.get('gasLimit')),
-            gas_used=hex_to_dec(result.get('gasUsed')),
+            difficulty=result.get('difficulty'),
+            total_difficulty=result.get('totalDifficulty'),
+            size=result.get('size'),
+            gas_limit=result.get('gasLimit'),
+            gas_used=result.get('gasUsed'),
             miner=result.get('miner', ''),
             receipts_root=result.get('receiptsRoot', ''),
             timestamp=hex_to_dec(result.get('timestamp')),
             logs_bloom=result.get('logsBloom', ''),
-            nonce=hex_to_dec(result.get('nonce')),
+            nonce=result.get('nonce'),
             cb_kwargs={'@transactions': transactions}
         )
 
+    async def _check_reorg(self, block_number: int, block_hash: str, parent_hash: str):
+        # the block fetched earlier is stale if the hashes are discontinuous
+        stale_blocks = list()
+        parent = self._recent_blocks.get(block_number - 1)
+        if parent is not None and parent[0] != parent_hash:
+            stale_blocks.append((block_number - 1, parent_hash))
+        child = self._recent_blocks.get(block_number + 1)
+        if child is not None and child[1] != block_hash:
+            stale_blocks.append((block_number + 1, ''))
+        old = self._recent_blocks.get(block_number)
+        if old is not None and old[0] != block_hash:
+            yield BlockReorgItem(block_hash=old[0], block_number=block_number, new_block_hash=block_hash)
+        self._recent_blocks[block_number] = (block_hash, parent_hash)
+        while len(self._recent_blocks) > self.REORG_RING_SIZE:
+            self._recent_blocks.popitem(last=False)
+
+        # retract the stale blocks and re-fetch them
+        for stale_block_number, new_block_hash in stale_blocks:
+            stale_block_hash, _ = self._recent_blocks.pop(stale_block_number)
+            self.log(
+                message='Reorg detected at block #{}: {}'.format(stale_block_number, stale_block_hash),
+                level=logging.WARNING,
+            )
+            self.crawler.stats.inc_value('reorg/blocks')
+            yield BlockReorgItem(
+                block_hash=stale_block_hash,
+                block_number=stale_block_number,
+                new_block_hash=new_block_hash,
+            )
+            request = await self.get_request_eth_block_by_number(
+                block_number=stale_block_number,
+                priority=2 ** 32 - stale_block_number,
+                cb_kwargs={SyncMiddleware.SYNC_KEYWORD: stale_block_number},
+            )
+            yield request.replace(dont_filter=True)
+
     def get_request_web3_client_version(self):
         return scrapy.Request(
             url=self.provider_bucket.items[0],
@@ -255,7 +490,7 @@ class EVMBlockTransactionSpider(scrapy.Spider):
 
     async def get_request_eth_block_number(self) -> scrapy.Request:
         return scrapy.Request(
-            url=await self.provider_bucket.get(),
+            url=await self.provider_router.get('eth_blockNumber'),
             method='POST',
             headers={'Content-Type': 'application/json'},
             body=json.dumps({
@@ -270,11 +505,21 @@ class EVMBlockTransactionSpider(scrapy.Spider):
             dont_filter=True,
         )
 
+    def get_request_new_heads(self) -> scrapy.Request:
+        # a local request for waiting the heads pushed by the subscription
+        return scrapy.Request(
+            url='data:application/json,{}',
+            callback=self.parse_new_heads,
+            errback=self.errback_parse_eth_block_number,
+            priority=0,
+            dont_filter=True,
+        )
+
     async def get_request_eth_block_by_number(
             self, block_number: int, priority: int, cb_kwargs: dict
     ) -> scrapy.Request:
         return scrapy.Request(
-            url=await self.provider_bucket.get(),
+            url=await self._get_batch_provider(block_number),
             method='POST',
             headers={'Content-Type': 'application/json'},
             body=json.dumps({
@@ -289,4 +534,15 @@ class EVMBlockTransactionSpider(scrapy.Spider):
             callback=self.parse_eth_get_block_by_number,
             priority=priority,
             cb_kwargs=cb_kwargs,
+            meta={JSONRPCBatchMiddleware.BATCH_KEYWORD: True},
         )
+
+    async def _get_batch_provider(self, block_number: int) -> str:
+        # the requests in the same batch share one provider,
+        # so that the provider is rationed once for each batch
+        bucket = self.provider_router.route('eth_getBlockByNumber', block_number)
+        if self._batch_remaining <= 0 or self._batch_provider not in bucket:
+            self._batch_provider = await bucket.get()
+            self._batch_remaining = self.provider_batch_size.get(self._batch_provider.rstrip('/'), 1)
+        self._batch_remaining -= 1
+        return self._batch_provider
@@ -4,13 +4,17 @@ import re
 import time
 
 import scrapy
+from scrapy.utils.defer import deferred_from_coro
 
 from BlockchainSpider import settings
 from BlockchainSpider.items import TransactionItem
 from BlockchainSpider.middlewares import SyncMiddleware
+from BlockchainSpider.utils import fastjson
 from BlockchainSpider.utils.bucket import AsyncItemBucket
+from BlockchainSpider.utils.capability import ProviderCapabilities, DEFAULT_CAPABILITY_CACHE
 from BlockchainSpider.utils.decorator import log_debug_tracing
-from BlockchainSpider.utils.web3 import hex_to_dec
+from BlockchainSpider.utils.route import ProviderRouter, ProviderRoute
+from BlockchainSpider.utils.web3 import hex_to_dec, close_web3_clients, get_web3_client_stats, web3_json_rpc
 
 
 class EVMTransactionSpider(scrapy.Spider):
@@ -22,6 +26,9 @@ class EVMTransactionSpider(scrapy.Spider):
         },
         'DOWNLOADER_MIDDLEWARES': {
             'BlockchainSpider.middlewares.UnterminatedJSONRetryMiddleware': 100,
+            'BlockchainSpider.middlewares.HedgedRequestMiddleware': 115,
+            'BlockchainSpider.middlewares.ProviderHealthMiddleware': 120,
+            'BlockchainSpider.middlewares.AdaptiveConcurrencyMiddleware': 130,
             **getattr(settings, 'DOWNLOADER_MIDDLEWARES', dict())
         },
         'ITEM_PIPELINES': {
@@ -72,37 +79,50 @@ class EVMTransactionSpider(scrapy.Spider):
             qps=getattr(settings, 'CONCURRENT_REQUESTS', 2),
         )
 
-        # provider settings for specific data
-        self.middleware_providers = {
-            'TransactionReceiptMiddleware': AsyncItemBucket(
-                items=kwargs['providers4receipt'].split(','),
-                qps=getattr(settings, 'CONCURRENT_REQUESTS', 2),
-            ) if kwargs.get('providers4receipt') else None,
-            'TraceMiddleware': AsyncItemBucket(
-                items=kwargs['providers4trace'].split(','),
-                qps=getattr(settings, 'CONCURRENT_REQUESTS', 2),
-            ) if kwargs.get('providers4trace') else None,
-            'TokenTransferMiddleware': AsyncItemBucket(
-                items=kwargs['providers4token_transfer'].split(','),
-                qps=getattr(settings, 'CONCURRENT_REQUESTS', 2),
-            ) if kwargs.get('providers4token_transfer') else None,
-            'TokenPropertyMiddleware': AsyncItemBucket(
-                items=kwargs['providers4token_property'].split(','),
-                qps=getattr(settings, 'CONCURRENT_REQUESTS', 2),
-            ) if kwargs.get('providers4token_property') else None,
-            'MetadataMiddleware': AsyncItemBucket(
-                items=kwargs['providers4metadata'].split(','),
-                qps=getattr(settings, 'CONCURRENT_REQUESTS', 2),
-            ) if kwargs.get('providers4metadata') else None,
-            'ContractMiddleware': AsyncItemBucket(
-                items=kwargs['providers4contract'].split(','),
-                qps=getattr(settings, 'CONCURRENT_REQUESTS', 2),
-            ) if kwargs.get('providers4contract') else None,
-            'DCFGMiddleware': AsyncItemBucket(
-                items=kwargs['providers4dcfg'].split(','),
+        # the backend of call traces, i.e., `auto`, `debug` (debug_trace*) or `parity` (trace_*)
+        self.trace_backend = kwargs.get('trace_backend', 'auto')
+        assert self.trace_backend in {'auto', 'debug', 'parity'}, \
+            "please input `auto`, `debug` or `parity` for the trace backend!"
+
+        # hedge the slow requests exceeding the latency percentile, e.g., 0.95
+        self.hedge_percentile = float(kwargs['hedge']) if kwargs.get('hedge') else None
+
+        # provider routing by methods, middlewares and block ages
+        self.provider_router = ProviderRouter.from_config(
+            config=kwargs.get('routes', dict()),
+            default=self.provider_bucket,
+            qps=getattr(settings, 'CONCURRENT_REQUESTS', 2),
+        )
+        for middleware, arg in [
+            ('TransactionReceiptMiddleware', 'providers4receipt'),
+            ('TraceMiddleware', 'providers4trace'),
+            ('TokenTransferMiddleware', 'providers4token_transfer'),
+            ('TokenPropertyMiddleware', 'providers4token_property'),
+            ('MetadataMiddleware', 'providers4metadata'),
+            ('ContractMiddleware', 'providers4contract'),
+            ('DCFGMiddleware', 'providers4dcfg'),
+        ]:
+            if not kwargs.get(arg):
+                continue
+            self.provider_router.add_pool(name=arg, bucket=AsyncItemBucket(
+                items=kwargs[arg].split(','),
                 qps=getattr(settings, 'CONCURRENT_REQUESTS', 2),
-            ) if kwargs.get('providers4dcfg') else None,
-        }
+            ))
+            self.provider_router.add_route(ProviderRoute(pools=arg, middlewares=[middleware]), first=True)
+
+        # the capabilities of providers, e.g., block receipts, tracing and JSON-RPC batch,
+        # which are probed lazily by the middlewares needing them and cached locally
+        self.provider_router.capabilities = ProviderCapabilities(
+            filename=getattr(settings, 'PROVIDER_CAPABILITY_CACHE', DEFAULT_CAPABILITY_CACHE),
+            ttl=getattr(settings, 'PROVIDER_CAPABILITY_TTL', 86400),
+        )
+
+    def closed(self, reason: str):
+        for key, value in get_web3_client_stats().items():
+            self.crawler.stats.set_value('web3_client/%s' % key, value)
+        for key, value in self.provider_router.get_stats().items():
+            self.crawler.stats.set_value('route/%s' % key, value)
+        return deferred_from_coro(close_web3_clients())
 
     def start_requests(self):
         request = self.get_request_web3_client_version()
@@ -111,16 +131,27 @@ class EVMTransactionSpider(scrapy.Spider):
 
     @log_debug_tracing
     async def _start_requests(self, response: scrapy.http.Response, **kwargs):
-        result = json.loads(response.text)
+        result = fastjson.loads(response.body)
         result = result.get('result')
 
-        # start requests
         self.log(
             message="Detected client version: {}, {} is starting.".format(
                 result, getattr(settings, 'BOT_NAME'),
             ),
             level=logging.INFO,
         )
+
+        # fetch the chain head for routing by block ages
+        if self.provider_router.requires_head:
+            block_number = await web3_json_rpc(
+                tx_obj={"jsonrpc": "2.0", "method": "eth_blockNumber", "params": [], "id": 1},
+                provider=self.provider_bucket.items[0],
+                timeout=10,
+            )
+            if block_number is not None:
+                self.provider_router.update_head(int(block_number, 16))
+
+        # start requests
         for i, txhash in enumerate(self.txhashs):
             yield await self.get_request_eth_transaction(
                 txhash=txhash,
@@ -133,22 +164,22 @@ class EVMTransactionSpider(scrapy.Spider):
 
     @log_debug_tracing
     async def parse_transaction(self, response: scrapy.http.Response, **kwargs):
-        result = json.loads(response.text)
+        result = fastjson.loads(response.body)
         result = result.get('result')
 
         # parse external transaction
         yield TransactionItem(
             transaction_hash=result.get('hash', ''),
-            transaction_index=hex_to_dec(result.get('transactionIndex')),
+            transaction_index=result.get('transactionIndex'),
             block_hash=result.get('blockHash', ''),
             block_number=hex_to_dec(result.get('blockNumber')),
             timestamp=hex_to_dec(result.get('timestamp')),
             address_from=result['from'] if result.get('from') else '',
             address_to=result['to'] if result.get('to') else '',
-            value=hex_to_dec(result.get('value')),
-            gas=hex_to_dec(result.get('gas')),
-            gas_price=hex_to_dec(result.get('gasPrice')),
-            nonce=hex_to_dec(result.get('nonce')),
+            value=result.get('value'),
+            gas=result.get('gas'),
+            gas_price=result.get('gasPrice'),
+            nonce=result.get('nonce'),
             input=result.get('input', ''),
         )
 
@@ -169,7 +200,7 @@ class EVMTransactionSpider(scrapy.Spider):
             self, txhash: str, priority: int, cb_kwargs: dict = None
     ) -> scrapy.Request:
         return scrapy.Request(
-            url=await self.provider_bucket.get(),
+            url=await self.provider_router.get('eth_getTransactionByHash'),
             method='POST',
             headers={'Content-Type': 'application/json'},
             body=json.dumps({
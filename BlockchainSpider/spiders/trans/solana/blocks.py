@@ -14,10 +14,12 @@ from BlockchainSpider.items import SolanaBlockItem, SolanaTransactionItem, SyncI
 from BlockchainSpider.items.solana import SolanaLogItem, SolanaInstructionItem, SolanaBalanceChangesItem, \
     SPLTokenActionItem, ValidateVotingItem, SystemItem, SPLMemoItem
 from BlockchainSpider.spiders.trans.evm import EVMBlockTransactionSpider
+from BlockchainSpider.utils import fastjson
 
 
 class SolanaBlockTransactionSpider(EVMBlockTransactionSpider):
     name = 'trans.block.solana'
+    PROBE_CAPABILITIES = False  # the probed methods are EVM only
     custom_settings = {
         'ITEM_PIPELINES': {
             'BlockchainSpider.pipelines.SolanaTrans2csvPipeline': 299,
@@ -51,7 +53,7 @@ class SolanaBlockTransactionSpider(EVMBlockTransactionSpider):
         return spider
 
     async def parse_eth_block_number(self, response: scrapy.http.Response, **kwargs):
-        result = json.loads(response.text)
+        result = fastjson.loads(response.body, exact_int=True)
         result = result.get('result')
 
         # generate more requests
@@ -72,6 +74,8 @@ class SolanaBlockTransactionSpider(EVMBlockTransactionSpider):
                     level=logging.INFO,
                 )
             for blk in range(start_block, end_block):
+                if self._is_completed(blk):
+                    continue
                 yield await self.get_request_eth_block_by_number(
                     block_number=blk,
                     priority=2 ** 32 - blk,
@@ -92,10 +96,11 @@ class SolanaBlockTransactionSpider(EVMBlockTransactionSpider):
     async def parse_eth_get_block_by_number(self, response: scrapy.http.Response, **kwargs):
         func = functools.partial(
             SolanaBlockTransactionSpider._packing_items,
-            response.text, kwargs,
+            response.body, kwargs,
         )
         loop = asyncio.get_running_loop()
         item = await loop.run_in_executor(self.executor, func)
+        self._release_block_window(kwargs['$sync'])
         if item is not None:
             self.log(
                 message="Synchronized: {}".format(kwargs['$sync']),
@@ -160,13 +165,22 @@ class SolanaBlockTransactionSpider(EVMBlockTransactionSpider):
                 ]
             }),
             callback=self.parse_eth_get_block_by_number,
+            errback=self.errback_eth_get_block_by_number,
             priority=priority,
             cb_kwargs=cb_kwargs,
         )
 
+    def errback_eth_get_block_by_number(self, failure):
+        request = failure.request
+        self.log(
+            message="Failed to fetch block: {}".format(request.cb_kwargs.get('$sync')),
+            level=logging.ERROR,
+        )
+        self._release_block_window(request.cb_kwargs.get('$sync'))
+
     @staticmethod
-    def _packing_items(response_body: str, kwargs: dict) -> Union[SyncItem, None]:
-        data = json.loads(response_body)
+    def _packing_items(response_body: bytes, kwargs: dict) -> Union[SyncItem, None]:
+        data = fastjson.loads(response_body, exact_int=True)
         result = data.get('result')
         if result is None:
             return None
@@ -404,3 +418,4 @@ class SolanaBlockTransactionSpider(EVMBlockTransactionSpider):
     @staticmethod
     def close(spider: Spider, reason: str):
         spider.executor.shutdown(wait=True)
+        return Spider.close(spider, reason)
@@ -9,6 +9,7 @@ from BlockchainSpider.items.solana import SPLMemoItem, ValidateVotingItem, Syste
     SPLTokenActionItem, SolanaTransactionItem, SolanaBalanceChangesItem, SolanaLogItem
 from BlockchainSpider.middlewares import SyncMiddleware
 from BlockchainSpider.spiders.trans.solana import SolanaBlockTransactionSpider
+from BlockchainSpider.utils import fastjson
 from BlockchainSpider.utils.bucket import AsyncItemBucket
 from BlockchainSpider.utils.decorator import log_debug_tracing
 
@@ -48,7 +49,7 @@ class SolanaTransactionSpider(scrapy.Spider):
     @log_debug_tracing
     async def _start_requests(self, response: scrapy.http.Response, **kwargs):
         try:
-            result = json.loads(response.text)
+            result = fastjson.loads(response.body, exact_int=True)
             result = result.get('result')
             self.log(
                 message="Detected client version: {}, {} is starting.".format(
@@ -71,7 +72,7 @@ class SolanaTransactionSpider(scrapy.Spider):
 
     @log_debug_tracing
     async def parse_transaction(self, response: scrapy.http.Response, **kwargs):
-        result = json.loads(response.text)
+        result = fastjson.loads(response.body, exact_int=True)
         item = result.get('result')
 
         block_time = item.get('blockTime', -1)
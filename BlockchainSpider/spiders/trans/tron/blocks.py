@@ -9,12 +9,14 @@ from BlockchainSpider.items import EventLogItem
 from BlockchainSpider.items.tron import TronTransactionItem
 from BlockchainSpider.middlewares import SyncMiddleware
 from BlockchainSpider.spiders.trans.evm import EVMBlockTransactionSpider
+from BlockchainSpider.utils import fastjson
 from BlockchainSpider.utils.decorator import log_debug_tracing
 from BlockchainSpider.utils.web3 import hex_to_dec
 
 
 class TronBlockTransactionSpider(EVMBlockTransactionSpider):
     name = 'trans.block.tron'
+    PROBE_CAPABILITIES = False  # the probed methods are EVM only
     custom_settings = {
         'ITEM_PIPELINES': {
             'BlockchainSpider.pipelines.TronTrans2csvPipeline': 299,
@@ -23,6 +25,7 @@ class TronBlockTransactionSpider(EVMBlockTransactionSpider):
         'SPIDER_MIDDLEWARES': {
             'BlockchainSpider.middlewares.trans.TokenTransferMiddleware': 542,
             'BlockchainSpider.middlewares.SyncMiddleware': 535,
+            'BlockchainSpider.middlewares.SyncOrderMiddleware': 530,
             **getattr(settings, 'SPIDER_MIDDLEWARES', dict())
         },
     }
@@ -49,7 +52,7 @@ class TronBlockTransactionSpider(EVMBlockTransactionSpider):
 
     @log_debug_tracing
     async def parse_eth_get_block_by_number(self, response: scrapy.http.Response, **kwargs):
-        result = json.loads(response.text)
+        result = fastjson.loads(response.body, exact_int=True)
         block_hash = result.get('blockID', '')
         block_number = kwargs.get(SyncMiddleware.SYNC_KEYWORD)
         if block_hash is None:
@@ -120,7 +123,7 @@ class TronBlockTransactionSpider(EVMBlockTransactionSpider):
 
     @log_debug_tracing
     async def parse_eth_get_logs(self, response: scrapy.http.Response, **kwargs):
-        result = json.loads(response.text)
+        result = fastjson.loads(response.body, exact_int=True)
         logs = result.get('result')
         for log in logs:
             yield EventLogItem(
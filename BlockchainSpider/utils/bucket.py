@@ -1,40 +1,207 @@
 import asyncio
+import collections
 import json
-import sys
+import random
 import time
-
-from twisted.internet.defer import DeferredLock
+from typing import List, Union
 
 from BlockchainSpider import settings
 
 
-class APIKeyBucket:
-    def __init__(self, apikeys: [str], kps: int):
-        self.apikeys = apikeys
-        self.kps = kps
-
-        self._last_get_time = 0
-        self._get_interval = 1 / (len(self.apikeys) * kps)
-        self._lock = DeferredLock()
+class TokenBucket:
+    """
+    An asynchronous token bucket, which never blocks the event loop.
+    The tokens are refilled at `rate` per second up to `capacity`,
+    i.e., the burst size, and the waiters are served in FIFO order.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+
+        self._tokens = self.capacity
+        self._last_refill_time = time.monotonic()
+        self._waiters = collections.deque()
+        self._timer = None
+
+    def delay(self) -> float:
+        """
+        The seconds to wait if a new token is acquired now.
+
+        :return:
+        """
+        self._refill()
+        lacks = len(self._waiters) + 1 - self._tokens
+        return max(0.0, lacks / self.rate)
+
+    async def acquire(self):
+        self._refill()
+        if len(self._waiters) == 0 and self._tokens >= 1:
+            self._tokens -= 1
+            return
+
+        # wait for the refilled token in order
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        self._schedule()
+        await future
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity,
+            self._tokens + (now - self._last_refill_time) * self.rate,
+        )
+        self._last_refill_time = now
+
+    def _schedule(self):
+        if self._timer is not None or len(self._waiters) == 0:
+            return
+        self._timer = asyncio.get_running_loop().call_later(
+            max(0.0, (1 - self._tokens) / self.rate),
+            self._wakeup,
+        )
+
+    def _wakeup(self):
+        self._timer = None
+        self._refill()
+        while len(self._waiters) > 0 and self._tokens >= 1:
+            future = self._waiters.popleft()
+            if future.done():  # the waiter is cancelled
+                continue
+            self._tokens -= 1
+            future.set_result(None)
+        self._schedule()
+
+
+class ItemHealth:
+    """
+    The health of an item (e.g., a provider), which tracks the EWMA of
+    latency, error rate and throttle rate, and works as a circuit breaker.
+    The circuit is opened after `max_failures` consecutive failures,
+    and a probe is allowed after the cooldown.
+    """
+
+    def __init__(
+            self, alpha: float = 0.2, max_failures: int = 5,
+            cooldown: float = 10, max_cooldown: float = 300,
+    ):
+        self.alpha = alpha
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self.latency = None
+        self.error_rate = 0.0
+        self.throttle_rate = 0.0
+        self.failures = 0
+        self._open_until = 0
+        self._open_cooldown = cooldown
+        self._probing = False
+
+    def is_available(self) -> bool:
+        if self.failures < self.max_failures:
+            return True
+        return not self._probing and time.monotonic() >= self._open_until
+
+    def on_selected(self):
+        if self.failures >= self.max_failures:
+            self._probing = True
+
+    def weight(self, default_latency: float, delay: float = 0) -> float:
+        latency = self.latency if self.latency is not None else default_latency
+        health = (1 - self.error_rate) * (1 - self.throttle_rate)
+        return max(health, 1e-3) / max(latency + delay, 1e-3)
+
+    def update(self, latency: float = None, error: bool = False, throttled: bool = False):
+        if latency is not None:
+            self.latency = latency if self.latency is None \
+                else self.alpha * latency + (1 - self.alpha) * self.latency
+        self.error_rate = self.alpha * error + (1 - self.alpha) * self.error_rate
+        self.throttle_rate = self.alpha * throttled + (1 - self.alpha) * self.throttle_rate
+
+        # update the circuit breaker
+        self._probing = False
+        if not error and not throttled:
+            self.failures = 0
+            self._open_cooldown = self.cooldown
+            return
+        self.failures += 1
+        if self.failures < self.max_failures:
+            return
+        self._open_until = time.monotonic() + self._open_cooldown
+        self._open_cooldown = min(self._open_cooldown * 2, self.max_cooldown)
 
-    def get(self) -> str:
-        # get lock
-        self._lock.acquire()
 
-        # get apikey
-        now = time.time()
-        duration = now - self._last_get_time
-        if duration < self._get_interval:
-            time.sleep(self._get_interval - duration)
-        self._last_get_time = time.time()
-        key = self.get_apikey()
-
-        # release lock and return key
-        self._lock.release()
-        return key
+class AsyncItemBucket:
+    def __init__(self, items: list, qps: Union[float, List[float]], burst: int = 1):
+        self.items = items
+        self.qps = qps
 
-    def get_apikey(self) -> str:
-        raise NotImplementedError()
+        # one token bucket and health for each item
+        rates = qps if isinstance(qps, list) else [qps for _ in range(len(self.items))]
+        self._buckets = [TokenBucket(rate=rate, capacity=burst) for rate in rates]
+        self._healths = [ItemHealth() for _ in range(len(self.items))]
+        self._item2idx = {str(item).rstrip('/'): i for i, item in enumerate(self.items)}
+
+    async def get(self, excludes: list = None):
+        # skip the excluded items and the items that the circuit is open,
+        # note that the circuits are ignored if all circuits are open
+        indices = list(range(len(self.items)))
+        if excludes:
+            excludes = {str(item).rstrip('/') for item in excludes}
+            indices = [i for i in indices if str(self.items[i]).rstrip('/') not in excludes] or indices
+        available_indices = [i for i in indices if self._healths[i].is_available()]
+        indices = available_indices if len(available_indices) > 0 else indices
+
+        # choose an item weighted by the health and the waiting time
+        latencies = [h.latency for h in self._healths if h.latency is not None]
+        default_latency = sum(latencies) / len(latencies) if len(latencies) > 0 else 1.0
+        weights = [
+            self._healths[i].weight(default_latency, self._buckets[i].delay())
+            for i in indices
+        ]
+        idx = random.choices(indices, weights=weights)[0]
+        self._healths[idx].on_selected()
+
+        # wait for the token and return
+        await self._buckets[idx].acquire()
+        return self.items[idx]
+
+    def delay(self) -> float:
+        """
+        The seconds to wait for the earliest token of the available items.
+
+        :return:
+        """
+        indices = [i for i in range(len(self.items)) if self._healths[i].is_available()]
+        indices = indices if len(indices) > 0 else list(range(len(self.items)))
+        return min([self._buckets[i].delay() for i in indices])
+
+    def __contains__(self, item) -> bool:
+        return str(item).rstrip('/') in self._item2idx
+
+    def feedback(self, item, latency: float = None, error: bool = False, throttled: bool = False):
+        """
+        Feed the outcome of a request back to the bucket.
+
+        :param item:
+        :param latency: the latency in seconds, none if unknown
+        :param error: the request is failed or not
+        :param throttled: the item is throttled (e.g., HTTP 429) or not
+        :return:
+        """
+        idx = self._item2idx.get(str(item).rstrip('/'))
+        if idx is None:
+            return
+        self._healths[idx].update(latency, error, throttled)
+
+
+class APIKeyBucket(AsyncItemBucket):
+    def __init__(self, apikeys: [str], kps: int, burst: int = 1):
+        super().__init__(apikeys, kps, burst)
+        self.apikeys = apikeys
+        self.kps = kps
 
 
 class StaticAPIKeyBucket(APIKeyBucket):
@@ -46,13 +213,6 @@ class StaticAPIKeyBucket(APIKeyBucket):
         assert len(apikeys) > 0
         super().__init__(apikeys, kps)
 
-        self._index = 0
-
-    def get_apikey(self) -> str:
-        key = self.apikeys[self._index]
-        self._index = (self._index + 1) % len(self.apikeys)
-        return key
-
 
 class JsonAPIKeyBucket(APIKeyBucket):
     def __init__(self, net: str, kps: int = 5):
@@ -68,45 +228,11 @@ class JsonAPIKeyBucket(APIKeyBucket):
         assert len(apikeys) > 0
         super().__init__(apikeys, kps)
 
-        self._index = 0
-
-    def get_apikey(self) -> str:
-        key = self.apikeys[self._index]
-        self._index = (self._index + 1) % len(self.apikeys)
-        return key
 
-
-class ProvidersBucket:
-    def __init__(self, providers: [str], qps: int):
+class ProvidersBucket(AsyncItemBucket):
+    def __init__(self, providers: [str], qps: int, burst: int = 1):
+        super().__init__(providers, qps, burst)
         self.providers = providers
-        self.qps = qps
-
-        self._last_get_time = [0 for _ in range(len(self.providers))]
-        self._get_interval = 1 / (len(self.providers) * qps)
-        self._lock = DeferredLock()
-
-    def get(self) -> str:
-        # get lock
-        self._lock.acquire()
-
-        # choose a provider
-        idx, last_get_time = 0, sys.maxsize
-        for _idx, _last_get_time in enumerate(self._last_get_time):
-            if _last_get_time < last_get_time:
-                last_get_time = _last_get_time
-                idx = _idx
-
-        # get provider
-        now = time.time()
-        duration = now - last_get_time
-        if duration < self._get_interval:
-            time.sleep(self._get_interval - duration)
-        self._last_get_time[idx] = time.time()
-        provider = self.providers[idx]
-
-        # release lock and return provider
-        self._lock.release()
-        return provider
 
 
 class StaticProvidersBucket(ProvidersBucket):
@@ -117,36 +243,3 @@ class StaticProvidersBucket(ProvidersBucket):
         providers = providers.get(net, list())
         assert len(providers) > 0
         super().__init__(providers, kps)
-
-
-class AsyncItemBucket:
-    def __init__(self, items: list, qps: int):
-        self.items = items
-        self.qps = qps
-
-        self._last_get_time = [0 for _ in range(len(self.items))]
-        self._get_interval = 1 / (len(self.items) * qps)
-        self._lock = asyncio.Lock()
-
-    async def get(self):
-        # get the lock
-        await self._lock.acquire()
-
-        # choose a provider
-        idx, last_get_time = 0, sys.maxsize
-        for _idx, _last_get_time in enumerate(self._last_get_time):
-            if _last_get_time < last_get_time:
-                last_get_time = _last_get_time
-                idx = _idx
-
-        # get item
-        now = time.time()
-        duration = now - last_get_time
-        if duration < self._get_interval:
-            await asyncio.sleep(self._get_interval - duration)
-        self._last_get_time[idx] = time.time()
-        item = self.items[idx]
-
-        # release lock and return
-        self._lock.release()
-        return item
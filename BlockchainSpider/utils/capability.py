@@ -0,0 +1,252 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Union, List
+
+from BlockchainSpider.utils.web3 import web3_json_rpc
+
+DEFAULT_CAPABILITY_CACHE = os.path.join(tempfile.gettempdir(), 'BlockchainSpider', 'capabilities.json')
+
+
+class ProviderCapabilities:
+    """
+    The capabilities of providers, i.e., the supported JSON-RPC methods and the JSON-RPC batch,
+    which are probed lazily when needed and cached in a local file until expired.
+
+    Only the definitive results are cached, e.g., the "method not found" errors,
+    while the transient failures (e.g., timeouts and rate limits) are left unknown
+    and probed again next time.
+    The providers are saved as the hashes of urls in the cache file, since the urls may contain API keys.
+    An example of the cache file:
+    {
+        "<sha1 of provider>": {
+            "time": 1700000000,
+            "methods": {"eth_getBlockReceipts": true, "debug_traceBlockByNumber": false, "trace_block": true},
+            "max_batch_size": 100,
+            "batch_limited": true
+        }
+    }
+    """
+    PROBE_METHODS = {
+        'eth_getBlockReceipts': lambda block: [block],
+        'debug_traceBlockByNumber': lambda block: [block, {"tracer": "callTracer"}],
+        'trace_block': lambda block: [block],
+    }
+    PROBE_BLOCK = '0x1'  # a cheap block near the genesis
+    BATCH_PROBE_SIZES = [2, 10, 50, 100]
+
+    # the methods in the same namespace share the capability of the probed one
+    METHOD_ALIASES = {
+        'debug_traceTransaction': 'debug_traceBlockByNumber',
+        'trace_transaction': 'trace_block',
+    }
+
+    # the errors of JSON-RPC for the unsupported methods, and the transient ones
+    UNSUPPORTED_CODES = {-32601}
+    UNSUPPORTED_HINTS = [
+        'method not found', 'does not exist', 'not supported', 'unsupported', 'not available', 'not enabled',
+    ]
+    TRANSIENT_CODES = {-32005, -32029, -32090, -32603, 429}
+    TRANSIENT_HINTS = [
+        'rate limit', 'too many requests', 'limit exceeded', 'exceeded the limit', 'capacity',
+        'timeout', 'timed out', 'temporarily', 'try again', 'internal error',
+    ]
+
+    def __init__(self, filename: str = None, ttl: float = 86400, timeout: int = 30):
+        self.filename = filename
+        self.ttl = ttl
+        self.timeout = timeout
+        self.provider2capability = dict()  # the hash of provider -> capability
+        self._probe_futures = dict()  # (provider, method or `batch`) -> future of probing
+        self._provider2hash = dict()
+        self.load()
+
+    def load(self):
+        if self.filename is None or not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        # the expired capabilities are probed again
+        now = time.time()
+        self.provider2capability = {
+            key: capability for key, capability in data.items()
+            if now - capability.get('time', 0) <= self.ttl
+        }
+
+    def save(self):
+        # the cache may be saved by multiple processes, e.g., the shard workers,
+        # so that each process writes its own temp file, and the failures are only logged
+        if self.filename is None:
+            return
+        tmp_filename = None
+        try:
+            dirname = os.path.dirname(os.path.abspath(self.filename))
+            os.makedirs(dirname, exist_ok=True)
+            fd, tmp_filename = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.provider2capability, f)
+            os.replace(tmp_filename, self.filename)
+        except OSError as e:
+            logging.getLogger(__name__).warning(
+                'Failed to save the provider capabilities to %s: %s' % (self.filename, e)
+            )
+            if tmp_filename is not None and os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    def get(self, provider: str) -> Union[dict, None]:
+        return self.provider2capability.get(self._hash(provider))
+
+    def supports(self, provider: str, method: str) -> Union[bool, None]:
+        """
+        Check if the provider supports the method.
+
+        :param provider:
+        :param method:
+        :return: none if unknown, e.g., not probed
+        """
+        capability = self.get(provider)
+        if capability is None:
+            return None
+        return capability['methods'].get(self.METHOD_ALIASES.get(method, method))
+
+    def get_max_batch_size(self, provider: str) -> Union[int, None]:
+        """
+        Get the maximum JSON-RPC batch size of the provider.
+
+        :param provider:
+        :return: none if unknown or not limited in the probed sizes
+        """
+        capability = self.get(provider)
+        if capability is None or capability.get('max_batch_size') is None:
+            return None
+        if capability['max_batch_size'] <= 1 or capability['batch_limited']:
+            return capability['max_batch_size']
+        return None
+
+    async def probe_all(self, providers: List[str], methods: List[str] = None, batch: bool = False):
+        """
+        Probe the methods and the batch size of providers concurrently,
+        where the known capabilities are skipped.
+
+        :param providers:
+        :param methods: the probed methods, where the methods not in `PROBE_METHODS` are skipped
+        :param batch: probe the maximum batch size or not
+        :return:
+        """
+        methods = [
+            method for method in (methods if methods is not None else list())
+            if method in self.PROBE_METHODS
+        ]
+        futures = list()
+        for provider in providers:
+            capability = self.get(provider)
+            keys = [
+                method for method in methods
+                if capability is None or method not in capability['methods']
+            ]
+            if batch and (capability is None or capability.get('max_batch_size') is None):
+                keys.append('batch')
+            for key in keys:
+                future = self._probe_futures.get((provider, key))
+                if future is None:
+                    coro = self.probe_batch(provider) if key == 'batch' else self.probe_method(provider, key)
+                    future = asyncio.ensure_future(coro)
+                    self._probe_futures[(provider, key)] = future
+                futures.append(future)
+        if len(futures) == 0:
+            return
+        await asyncio.gather(*futures)
+        for provider in providers:
+            for key in ['batch', *methods]:
+                self._probe_futures.pop((provider, key), None)
+        self.save()
+
+    async def probe_method(self, provider: str, method: str):
+        params = self.PROBE_METHODS[method](self.PROBE_BLOCK)
+        data = await web3_json_rpc(
+            tx_obj={"jsonrpc": "2.0", "method": method, "params": params, "id": 1},
+            provider=provider,
+            timeout=self.timeout,
+            raw=True,
+        )
+        if not isinstance(data, dict):
+            return
+        error = data.get('error')
+        if error is None and 'result' in data:
+            self._get_or_create(provider)['methods'][method] = True
+            return
+        if not isinstance(error, dict) or self._is_transient(error):
+            return
+
+        # the other errors are served by the method, e.g., the state of block is pruned
+        message = str(error.get('message', '')).lower()
+        supported = error.get('code') not in self.UNSUPPORTED_CODES and \
+            not any([hint in message for hint in self.UNSUPPORTED_HINTS])
+        self._get_or_create(provider)['methods'][method] = supported
+
+    async def probe_batch(self, provider: str):
+        # find the maximum batch size in the probed sizes
+        max_batch_size, batch_limited = 1, False
+        for size in self.BATCH_PROBE_SIZES:
+            data = await web3_json_rpc(
+                tx_obj=[
+                    {"jsonrpc": "2.0", "method": "eth_blockNumber", "params": [], "id": i}
+                    for i in range(size)
+                ],
+                provider=provider,
+                timeout=self.timeout,
+                raw=True,
+            )
+            if isinstance(data, list) and len(data) == size and \
+                    all([isinstance(rlt, dict) and rlt.get('result') is not None for rlt in data]):
+                max_batch_size = size
+                continue
+
+            # the batch is limited only by the definitive errors,
+            # and left unknown if the provider is unavailable or throttled
+            if data is None:
+                return
+            members = data if isinstance(data, list) else [data]
+            errors = [
+                rlt.get('error') for rlt in members
+                if isinstance(rlt, dict) and rlt.get('error') is not None
+            ]
+            if isinstance(data, dict) and len(errors) == 0:
+                return
+            if any([not isinstance(error, dict) or self._is_transient(error) for error in errors]):
+                return
+            batch_limited = True
+            break
+
+        capability = self._get_or_create(provider)
+        capability['max_batch_size'] = max_batch_size
+        capability['batch_limited'] = batch_limited
+
+    def _is_transient(self, error: dict) -> bool:
+        if error.get('code') in self.TRANSIENT_CODES:
+            return True
+        message = str(error.get('message', '')).lower()
+        return any([hint in message for hint in self.TRANSIENT_HINTS])
+
+    def _get_or_create(self, provider: str) -> dict:
+        key = self._hash(provider)
+        capability = self.provider2capability.get(key)
+        if capability is None:
+            capability = {'time': time.time(), 'methods': dict()}
+            self.provider2capability[key] = capability
+        return capability
+
+    def _hash(self, provider: str) -> str:
+        key = self._provider2hash.get(provider)
+        if key is None:
+            key = hashlib.sha1(str(provider).rstrip('/').encode()).hexdigest()
+            self._provider2hash[provider] = key
+        return key
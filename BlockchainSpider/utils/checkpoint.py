@@ -0,0 +1,87 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+
+class BlockCheckpoint:
+    """
+    A crash-safe checkpoint of block crawls, which records the completed blocks
+    as run-length intervals, e.g., `[[0, 999], [1002, 1005]]`,
+    and the committed offsets of output files.
+
+    The checkpoint file is replaced atomically, i.e., it is either the old or the new one.
+    The output data behind the committed offsets belongs to the unfinished blocks,
+    which should be truncated and re-fetched when resuming.
+    The checkpoint is thread-safe, since the pipelines may update it in a writer thread.
+    """
+
+    def __init__(self, filename: str, interval: float = 10):
+        self.filename = filename
+        self.interval = interval
+        self.intervals = list()  # sorted [start, end] of completed blocks
+        self.files = dict()  # basename -> {'offset': int, 'headers': list}
+        self._last_save_time = time.monotonic()
+        self._lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, 'r') as f:
+            data = json.load(f)
+        self.intervals = [list(interval) for interval in data.get('completed', list())]
+        self.files = data.get('files', dict())
+
+    def __contains__(self, block_number) -> bool:
+        if not isinstance(block_number, int):
+            return False
+        with self._lock:
+            idx = bisect.bisect_right(self.intervals, [block_number, float('inf')]) - 1
+            return idx >= 0 and self.intervals[idx][1] >= block_number
+
+    def add(self, block_number):
+        if not isinstance(block_number, int):
+            return
+        with self._lock:
+            if block_number in self:
+                return
+
+            # merge the block with the adjacent intervals
+            idx = bisect.bisect_right(self.intervals, [block_number, float('inf')])
+            prev = self.intervals[idx - 1] if idx > 0 else None
+            succ = self.intervals[idx] if idx < len(self.intervals) else None
+            merge_prev = prev is not None and prev[1] == block_number - 1
+            merge_succ = succ is not None and succ[0] == block_number + 1
+            if merge_prev and merge_succ:
+                prev[1] = succ[1]
+                del self.intervals[idx]
+            elif merge_prev:
+                prev[1] = block_number
+            elif merge_succ:
+                succ[0] = block_number
+            else:
+                self.intervals.insert(idx, [block_number, block_number])
+
+    @property
+    def is_due(self) -> bool:
+        return time.monotonic() - self._last_save_time >= self.interval
+
+    def save(self, files: dict):
+        """
+        Save the checkpoint atomically.
+
+        :param files: the committed output files, i.e., basename -> {'offset': int, 'headers': list}
+        :return:
+        """
+        with self._lock:
+            self.files = files
+            self._last_save_time = time.monotonic()
+            data = json.dumps({'completed': self.intervals, 'files': self.files})
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, self.filename)
@@ -0,0 +1,57 @@
+import importlib
+import json
+from typing import Union
+
+from BlockchainSpider import settings
+
+
+def _load_backend():
+    # the backend is chosen by the setting `JSON_BACKEND`,
+    # or the fastest one installed if not specified
+    backends = getattr(settings, 'JSON_BACKEND', None)
+    backends = [backends] if backends is not None else ['orjson', 'simdjson']
+    for name in backends:
+        if name == 'json':
+            break
+        try:
+            module = importlib.import_module(name)
+        except ImportError:
+            continue
+        return name, module.loads
+    return 'json', None
+
+
+BACKEND, _loads = _load_backend()
+
+# the numbers which may exceed 64 bits, i.e., 19 digits or more before the end of a number,
+# where the digits are mapped to `0` and the ends to `E` for finding them in one pass
+_LARGE_INT_TABLE = bytes.maketrans(b'0123456789,]}\n\r\tE', b'0000000000EEEEEEx')
+_LARGE_INT_NEEDLE = b'0' * 19 + b'E'
+
+
+def _has_large_int(data: Union[bytes, str]) -> bool:
+    data = data.encode() if isinstance(data, str) else data
+    return data.translate(_LARGE_INT_TABLE).find(_LARGE_INT_NEEDLE) >= 0
+
+
+def loads(data: Union[bytes, str], exact_int: bool = False):
+    """
+    Parse the json data from bytes (e.g., `response.body`) directly,
+    which avoids decoding the whole body to a `str` before parsing.
+    Note that the fast backends parse the integers over 64 bits as floats,
+    which is fine for JSON-RPC since the quantities are hex strings.
+    Set `exact_int` for the bodies with decimal amounts (e.g., Tron and Solana),
+    where the bodies having the integers of 19 digits or more are parsed by the stdlib `json` instead.
+
+    :param data: the json bytes or string
+    :param exact_int: keep the large integers exact
+    :return:
+    """
+    if _loads is None or (exact_int and _has_large_int(data)):
+        return json.loads(data)
+    try:
+        return _loads(data)
+    except json.JSONDecodeError:
+        raise
+    except ValueError as e:
+        raise json.JSONDecodeError(str(e), '', 0) from e
@@ -0,0 +1,113 @@
+from typing import List, Tuple, Union
+
+from web3 import Web3
+
+# see https://github.com/mds1/multicall
+MULTICALL3_ADDRESS = '0xcA11bde05977b3631167028862bE2a173976CA11'
+MULTICALL3_AGGREGATE3 = 'aggregate3((address,bool,bytes)[])'
+
+_codec = Web3().codec
+
+
+def get_function_selector(func: str) -> str:
+    """
+    Get the 4-bytes selector of the function signature, e.g., `name()` -> `0x06fdde03`.
+
+    :param func: the function signature
+    :return:
+    """
+    data = Web3.keccak(text=func).hex()
+    data = data[2:2 + 8] if data.startswith('0x') else data[:8]
+    return '0x' + data
+
+
+def encode_aggregate3(calls: List[Tuple[str, str]]) -> str:
+    """
+    Encode the calls to the input data of Multicall3 `aggregate3`,
+    where every call is allowed to fail.
+
+    :param calls: the list of (target address, call data in hex)
+    :return:
+    """
+    data = _codec.encode(
+        ['(address,bool,bytes)[]'],
+        [[(Web3.to_checksum_address(target), True, bytes.fromhex(data[2:])) for target, data in calls]],
+    )
+    return get_function_selector(MULTICALL3_AGGREGATE3) + data.hex()
+
+
+def decode_aggregate3(data: str) -> Union[List[Tuple[bool, str]], None]:
+    """
+    Decode the return data of Multicall3 `aggregate3`.
+
+    :param data: the return data in hex
+    :return: the list of (success, return data in hex), none if failed
+    """
+    if not isinstance(data, str) or len(data) <= 2:
+        return
+    try:
+        results = _codec.decode(['(bool,bytes)[]'], bytes.fromhex(data[2:]))[0]
+    except:
+        return
+    return [(success, '0x' + rlt.hex()) for success, rlt in results]
+
+
+def get_tx_obj_aggregate3(calls: List[Tuple[str, str]], block_tag: str = 'latest') -> dict:
+    return {
+        "jsonrpc": "2.0",
+        "method": "eth_call",
+        "params": [
+            {"to": MULTICALL3_ADDRESS, "data": encode_aggregate3(calls)},
+            block_tag,
+        ],
+        "id": 1,
+    }
+
+
+def get_tx_objs_batch(calls: List[Tuple[str, str]], block_tag: str = 'latest') -> list:
+    return [{
+        "jsonrpc": "2.0",
+        "method": "eth_call",
+        "params": [{"to": target, "data": data}, block_tag],
+        "id": i,
+    } for i, (target, data) in enumerate(calls)]
+
+
+BATCH_UNSUPPORTED_KEYWORDS = ['batch', 'not supported', 'unsupported']
+
+
+def is_batch_unsupported(data) -> bool:
+    """
+    Check whether the response of a JSON-RPC batch definitively
+    says that the batch is not supported, i.e., a non-list reply
+    with a batch or unsupported error.
+
+    :param data: the loaded response
+    :return:
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('error'), dict):
+        return False
+    message = str(data['error'].get('message', '')).lower()
+    return any([keyword in message for keyword in BATCH_UNSUPPORTED_KEYWORDS])
+
+
+def parse_batch_results(data, size: int) -> Union[List[Tuple[bool, str]], None]:
+    """
+    Parse the response of the JSON-RPC batch from `get_tx_objs_batch`.
+
+    :param data: the loaded response
+    :param size: the number of calls
+    :return: the list of (success, return data in hex), none if the batch is not supported
+    """
+    if not isinstance(data, list):
+        return
+    idx2result = {
+        rlt['id']: rlt for rlt in data
+        if isinstance(rlt, dict) and isinstance(rlt.get('id'), int)
+    }
+    results = list()
+    for i in range(size):
+        rlt = idx2result.get(i, dict())
+        success = rlt.get('error') is None and isinstance(rlt.get('result'), str)
+        results.append((success, rlt['result'] if success else '0x'))
+    return results
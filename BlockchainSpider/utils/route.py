@@ -0,0 +1,272 @@
+import json
+import os
+from typing import Union, List
+
+from BlockchainSpider.utils.bucket import AsyncItemBucket
+
+
+class ProviderRoute:
+    def __init__(
+            self, pools: Union[str, List[str]], methods: List[str] = None, middlewares: List[str] = None,
+            min_block_age: int = None, max_block_age: int = None,
+    ):
+        self.pools = [pools] if isinstance(pools, str) else pools
+        self.methods = set(methods) if methods is not None else None
+        self.middlewares = set(middlewares) if middlewares is not None else None
+        self.min_block_age = min_block_age
+        self.max_block_age = max_block_age
+
+    def match(self, method: str, block_age: Union[int, None], middleware: str = None) -> bool:
+        if self.methods is not None and method not in self.methods:
+            return False
+        if self.middlewares is not None and middleware not in self.middlewares:
+            return False
+
+        # the routes with age limits are skipped if the age is unknown
+        if self.min_block_age is None and self.max_block_age is None:
+            return True
+        if block_age is None:
+            return False
+        if self.min_block_age is not None and block_age < self.min_block_age:
+            return False
+        if self.max_block_age is not None and block_age > self.max_block_age:
+            return False
+        return True
+
+
+class ProviderRouter:
+    """
+    Route the JSON-RPC requests to the provider pools by the method,
+    the middleware and the block age (i.e., the distance to the chain head).
+    Each pool has its own rate budget and cost weight, and the routes are
+    matched in order, the default pool is used if no route matched.
+
+    An example of the routing config:
+    {
+        "pools": {
+            "archive": {"providers": ["https://archive.node"], "qps": 2, "cost": 10},
+            "full": {"providers": ["https://full.node"], "qps": 20, "cost": 1, "batch_size": 10}
+        },
+        "routes": [
+            {"methods": ["debug_traceBlockByNumber", "debug_traceTransaction"], "pools": "archive"},
+            {"methods": ["eth_getBlockByNumber"], "max_block_age": 128, "pools": ["full", "archive"]}
+        ]
+    }
+    If a route has multiple pools, the cheapest pool is preferred,
+    and the others are used when the cheaper pools are exhausted.
+
+    If the capabilities of providers are probed, the pools and providers
+    not supporting the method are skipped, unless no provider supports it.
+    """
+    DEFAULT_POOL = 'default'
+
+    def __init__(self, default: AsyncItemBucket, pools: dict = None, routes: list = None):
+        self.pools = {self.DEFAULT_POOL: default, **(pools if pools is not None else dict())}
+        self.pool2cost = {name: 1.0 for name in self.pools.keys()}
+        self.pool2batch_size = dict()
+        self.routes = routes if routes is not None else list()
+        self.head = None
+        self.capabilities = None
+
+        # routing stats
+        self.pool2requests = {name: 0 for name in self.pools.keys()}
+        self.pool2spent = {name: 0.0 for name in self.pools.keys()}
+
+    @classmethod
+    def from_config(cls, config: Union[str, dict], default: AsyncItemBucket, qps: float = 1, shards: int = 1):
+        """
+        Load the router from a json file, a json string or a dict.
+
+        :param config: the routing config
+        :param default: the bucket of default pool
+        :param qps: the default qps of pools
+        :param shards: the number of processes sharing the qps of pools in the config
+        :return:
+        """
+        if isinstance(config, str):
+            if os.path.isfile(config):
+                with open(config, 'r') as f:
+                    config = json.load(f)
+            else:
+                config = json.loads(config)
+        router = cls(default=default)
+        for name, pool in config.get('pools', dict()).items():
+            router.add_pool(
+                name=name,
+                bucket=AsyncItemBucket(
+                    items=pool['providers'],
+                    qps=[q / shards for q in pool['qps']] if isinstance(pool.get('qps'), list)
+                    else pool['qps'] / shards if 'qps' in pool else qps,
+                    burst=pool.get('burst', 1),
+                ),
+                cost=pool.get('cost', 1.0),
+                batch_size=pool.get('batch_size'),
+            )
+        for route in config.get('routes', list()):
+            router.add_route(ProviderRoute(**route))
+        return router
+
+    def add_pool(self, name: str, bucket: AsyncItemBucket, cost: float = 1.0, batch_size: int = None):
+        self.pools[name] = bucket
+        self.pool2cost[name] = cost
+        self.pool2requests[name] = 0
+        self.pool2spent[name] = 0.0
+        if batch_size is not None:
+            for provider in bucket.items:
+                self.pool2batch_size[str(provider).rstrip('/')] = batch_size
+
+    def add_route(self, route: ProviderRoute, first: bool = False):
+        for name in route.pools:
+            assert name in self.pools, "unknown provider pool: %s" % name
+        if first:
+            self.routes.insert(0, route)
+        else:
+            self.routes.append(route)
+
+    @property
+    def buckets(self) -> List[AsyncItemBucket]:
+        buckets = list()
+        for bucket in self.pools.values():
+            if bucket not in buckets:
+                buckets.append(bucket)
+        return buckets
+
+    @property
+    def requires_head(self) -> bool:
+        return any([
+            route.min_block_age is not None or route.max_block_age is not None
+            for route in self.routes
+        ])
+
+    def update_head(self, block_number: int):
+        if self.head is None or block_number > self.head:
+            self.head = block_number
+
+    def route(self, method: str, block_number: int = None, middleware: str = None) -> AsyncItemBucket:
+        """
+        Choose the provider pool for the request.
+
+        :param method: the json-rpc method
+        :param block_number: the queried block number, none if latest
+        :param middleware: the name of middleware sending the request
+        :return: the bucket of chosen pool
+        """
+        names = self._match_pools(method, self._get_block_age(block_number), middleware)
+        return self.pools[self._choose_pool(names)]
+
+    async def get(self, method: str, block_number: int = None, middleware: str = None) -> str:
+        bucket = self.route(method, block_number, middleware)
+        return await bucket.get(excludes=self._get_unsupported(bucket, method))
+
+    async def get_hedge(self, method: str, block_number: int, provider: str) -> Union[str, None]:
+        """
+        Get another provider for hedging the request sent to the given provider,
+        which is chosen from the pools routed for the request.
+
+        :param method: the json-rpc method
+        :param block_number: the queried block number, none if latest
+        :param provider: the provider of the first attempt
+        :return: none if no other provider supports the method
+        """
+        # find the route of the first attempt, where the middleware is unknown
+        block_age = self._get_block_age(block_number)
+        middlewares = [None, *{m for route in self.routes if route.middlewares for m in route.middlewares}]
+        for middleware in middlewares:
+            names = self._match_pools(method, block_age, middleware)
+            if any([provider in self.pools[n] for n in names]):
+                break
+        else:
+            return None
+
+        # choose the pool having other providers supporting the method
+        name2excludes = dict()
+        for name in names:
+            bucket = self.pools[name]
+            excludes = {str(p).rstrip('/') for p in [provider, *self._get_unsupported(bucket, method)]}
+            if any([str(p).rstrip('/') not in excludes for p in bucket.items]):
+                name2excludes[name] = list(excludes)
+        if len(name2excludes) == 0:
+            return None
+        name = self._choose_pool(list(name2excludes.keys()))
+        return await self.pools[name].get(excludes=name2excludes[name])
+
+    @property
+    def providers(self) -> list:
+        providers = list()
+        for bucket in self.buckets:
+            providers.extend([p for p in bucket.items if p not in providers])
+        return providers
+
+    async def probe_capabilities(self, methods: List[str] = None, batch: bool = False):
+        """
+        Probe the capabilities of all providers lazily, i.e., the methods needed by the caller,
+        where the concurrent callers wait for the same probing.
+
+        :param methods: the probed methods
+        :param batch: probe the maximum batch size or not
+        :return:
+        """
+        if self.capabilities is None:
+            return
+        await self.capabilities.probe_all(self.providers, methods, batch)
+
+    def supports(self, method: str) -> Union[bool, None]:
+        """
+        Check if any provider supports the method.
+
+        :param method:
+        :return: none if unknown, e.g., not probed
+        """
+        if self.capabilities is None:
+            return None
+        supports = [self.capabilities.supports(p, method) for p in self.providers]
+        if any([support is True for support in supports]):
+            return True
+        if all([support is False for support in supports]):
+            return False
+        return None
+
+    def _get_block_age(self, block_number: int = None) -> Union[int, None]:
+        if block_number is None:
+            return 0
+        if self.head is None:
+            return None
+        return max(self.head - block_number, 0)
+
+    def _match_pools(self, method: str, block_age: Union[int, None], middleware: str = None) -> List[str]:
+        names = [self.DEFAULT_POOL]
+        for route in self.routes:
+            if route.match(method, block_age, middleware):
+                names = route.pools
+                break
+        return [n for n in names if self._pool_supports(n, method)] or names
+
+    def _choose_pool(self, names: List[str]) -> str:
+        # choose the cheapest pool that is ready now
+        names = sorted(names, key=lambda n: self.pool2cost[n])
+        name = next(
+            (n for n in names if self.pools[n].delay() <= 0),
+            min(names, key=lambda n: self.pools[n].delay()),
+        )
+
+        # record the routing
+        self.pool2requests[name] += 1
+        self.pool2spent[name] += self.pool2cost[name]
+        return name
+
+    def _get_unsupported(self, bucket: AsyncItemBucket, method: str) -> List[str]:
+        if self.capabilities is None:
+            return list()
+        return [p for p in bucket.items if self.capabilities.supports(p, method) is False]
+
+    def _pool_supports(self, name: str, method: str) -> bool:
+        if self.capabilities is None:
+            return True
+        return any([self.capabilities.supports(p, method) is not False for p in self.pools[name].items])
+
+    def get_stats(self) -> dict:
+        stats = dict()
+        for name in self.pools.keys():
+            stats['%s/requests' % name] = self.pool2requests[name]
+            stats['%s/cost' % name] = self.pool2spent[name]
+        return stats
@@ -0,0 +1,50 @@
+import os
+import pickle
+import sys
+import tempfile
+
+
+def estimate_item_size(item) -> int:
+    """
+    Estimate the memory size (in bytes) of an item roughly,
+    where the nested containers are not traversed.
+
+    :param item:
+    :return:
+    """
+    # the raw values of scrapy items, i.e., without decoding the lazy fields
+    values = getattr(item, '_values', item).values()
+    return sys.getsizeof(item) + sum([sys.getsizeof(value) for value in values])
+
+
+class SpillFile:
+    """
+    An append-only local file of pickled items, which keeps the items
+    out of memory and streams them back in the appended order.
+    """
+
+    def __init__(self, dirname: str = None, prefix: str = 'spill_'):
+        if dirname is not None and not os.path.exists(dirname):
+            os.makedirs(dirname)
+        fd, self.filename = tempfile.mkstemp(prefix=prefix, suffix='.pkl', dir=dirname)
+        self._file = os.fdopen(fd, 'wb')
+        self.count = 0
+
+    def append(self, key, item):
+        pickle.dump((key, item), self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.count += 1
+
+    def __iter__(self):
+        self._file.close()
+        with open(self.filename, 'rb') as f:
+            while True:
+                try:
+                    yield pickle.load(f)
+                except EOFError:
+                    break
+
+    def remove(self):
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
@@ -12,6 +12,7 @@ ERC1155_SINGLE_TRANSFER_TOPIC = '0xc3d58168c5ae7397731d063d5bbf3d657854427343f4c
 ERC1155_BATCH_TRANSFER_TOPIC = '0x4a39dc06d4c0dbc64b70af90fd698a233a518aa5d07e595d983b8c0526c8f7fb'
 TOKEN_APPROVE_TOPIC = '0x8c5be1e5ebec7d5bd14f71427d1e84f3dd0314c0f7b2291e5b200ac8c7c3b925'
 TOKEN_APPROVE_ALL_TOPIC = '0x17307eab39ab6107e8899845ad3d59bd9653f200f220920489ca2b5937696c31'
+ERC165_IS_TOKEN721_DATA = '0x01ffc9a780ac58cd00000000000000000000000000000000000000000000000000000000'
 
 
 @async_lru.alru_cache(maxsize=10240)
@@ -31,7 +32,7 @@ async def is_token721_contract(address: str, provider_bucket, timeout: int) -> b
             "method": "eth_call",
             "params": [{
                 'to': address,
-                "data": "0x01ffc9a780ac58cd00000000000000000000000000000000000000000000000000000000",
+                "data": ERC165_IS_TOKEN721_DATA,
             }, 'latest'
             ],
             "id": 1,
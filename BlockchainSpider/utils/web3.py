@@ -1,5 +1,5 @@
-import asyncio
 import json
+import time
 import traceback
 from typing import Union
 
@@ -7,40 +7,140 @@ import aiohttp
 from multidict import CIMultiDict
 from web3 import Web3
 
+from BlockchainSpider import settings
 
-async def web3_json_rpc(tx_obj: dict, provider: str, timeout: int):
+_provider2client = dict()  # provider -> aiohttp.ClientSession
+_client_stats = {
+    'requests': 0,
+    'failures': 0,
+    'latency': 0.0,
+    'connections_created': 0,
+    'connections_reused': 0,
+}
+
+
+async def _on_connection_create_end(session, context, params):
+    _client_stats['connections_created'] += 1
+
+
+async def _on_connection_reuseconn(session, context, params):
+    _client_stats['connections_reused'] += 1
+
+
+def _get_client(provider: str) -> aiohttp.ClientSession:
+    client = _provider2client.get(provider)
+    if client is not None and not client.closed:
+        return client
+
+    # one long-lived connection pool for each provider
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_end.append(_on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(_on_connection_reuseconn)
+    client = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit_per_host=getattr(settings, 'WEB3_CLIENT_LIMIT_PER_HOST', 8),
+            ttl_dns_cache=getattr(settings, 'WEB3_CLIENT_DNS_CACHE_TTL', 300),
+            keepalive_timeout=getattr(settings, 'WEB3_CLIENT_KEEPALIVE_TIMEOUT', 60),
+        ),
+        trace_configs=[trace_config],
+    )
+    _provider2client[provider] = client
+    return client
+
+
+async def close_web3_clients():
+    """
+    Close the connection pools of all providers,
+    which should be called when the spider is closed.
+
+    :return:
+    """
+    clients = list(_provider2client.values())
+    _provider2client.clear()
+    for client in clients:
+        await client.close()
+
+
+def get_web3_client_stats() -> dict:
+    """
+    Get the counters of the JSON-RPC client,
+    including the average latency (in seconds) and the connection reuse.
+
+    :return:
     """
-    Request the JSON-RPC of the web3 providers, and return the raw data of the `result`.
+    stats = dict(_client_stats)
+    stats['latency'] = stats['latency'] / stats['requests'] if stats['requests'] > 0 else 0
+    return stats
+
+
+async def web3_json_rpc(tx_obj: Union[dict, list], provider: str, timeout: int, raw: bool = False):
+    """
+    Request the JSON-RPC of the web3 providers, and return the raw data of the `result`,
+    or the list of raw responses if the `tx_obj` is a batch.
 
     :param tx_obj:
     :param provider:
     :param timeout:
-    :return:
+    :param raw: return the whole response (e.g., with the `error`) instead of the `result`
+    :return: none if the request failed
     """
-    client = aiohttp.ClientSession(
-        loop=asyncio.get_event_loop(),
-        timeout=aiohttp.ClientTimeout(total=timeout)
-    )
+    client = _get_client(provider)
+    start_time = time.time()
     try:
-        rsp = await client.request(
-            url=provider,
-            method='POST',
-            headers=CIMultiDict(**{'Content-Type': 'application/json'}),
-            data=json.dumps(tx_obj),
-        )
-        data = await rsp.read()
+        async with client.request(
+                url=provider,
+                method='POST',
+                headers=CIMultiDict(**{'Content-Type': 'application/json'}),
+                data=json.dumps(tx_obj),
+                timeout=aiohttp.ClientTimeout(total=timeout),
+        ) as rsp:
+            data = await rsp.read()
         data = data.decode()
         data = json.loads(data)
     except:
+        _client_stats['failures'] += 1
         traceback.print_exc()
         return
     finally:
-        await client.close()
+        _client_stats['requests'] += 1
+        _client_stats['latency'] += time.time() - start_time
 
     # parse response
+    if raw or isinstance(data, list):
+        return data
     return data.get('result')
 
 
+async def web3_subscribe(provider: str, params: list, heartbeat: int = 30):
+    """
+    Subscribe the events of the web3 websocket providers by `eth_subscribe`,
+    and yield the raw data of the `result` for each notification.
+    The generator returns if the connection is closed.
+
+    :param provider: the websocket provider, e.g., wss://...
+    :param params: the subscription params, e.g., ["newHeads"]
+    :param heartbeat: the seconds of the ping interval
+    :return:
+    """
+    client = _get_client(provider)
+    async with client.ws_connect(provider, heartbeat=heartbeat) as ws:
+        await ws.send_str(json.dumps({
+            "jsonrpc": "2.0",
+            "method": "eth_subscribe",
+            "params": params,
+            "id": 1,
+        }))
+        async for msg in ws:
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                break
+            data = json.loads(msg.data)
+            if data.get('error') is not None:
+                raise ConnectionError('Failed to subscribe {}: {}'.format(params, data['error']))
+            if data.get('method') != 'eth_subscription':
+                continue
+            yield data.get('params', dict()).get('result')
+
+
 def parse_bytes_data(data: bytes, output_types: list) -> Union[tuple, None]:
     """
     Parse the web3 bytes data from the given output types.
@@ -80,6 +180,20 @@ def hex_to_dec(hex_string: str) -> int:
         return -1
 
 
+def hex_to_dec_column(values: list) -> list:
+    """
+    Decode a column of hex strings in bulk, which is the same as `hex_to_dec` for each value,
+    where the other values (e.g., the decoded integers) are kept.
+
+    :param values:
+    :return:
+    """
+    try:
+        return [int(v, 16) if v.__class__ is str else (-1 if v is None else v) for v in values]
+    except ValueError:
+        return [hex_to_dec(v) if v is None or v.__class__ is str else v for v in values]
+
+
 def word_to_address(param: str) -> str:
     if param is None:
         return ''
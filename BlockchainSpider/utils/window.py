@@ -0,0 +1,71 @@
+import asyncio
+import collections
+import time
+
+
+class AdaptiveWindow:
+    """
+    An asynchronous sliding window, which limits the number of tasks (e.g., blocks) in flight.
+    A new task is admitted only when a task in the window is finished.
+
+    The window size is adapted by hill climbing on the completion rate, i.e.,
+    the size keeps moving in the same direction if the completion rate of the
+    last round (one window of completed tasks) increases, and turns back if decreases.
+    """
+
+    def __init__(
+            self, size: int, min_size: int = 1, max_size: int = None,
+            step: float = 1.25, tolerance: float = 0.05,
+    ):
+        self.min_size = max(1, min_size)
+        self.max_size = max(max_size, self.min_size) if max_size is not None else max(size, self.min_size)
+        self.size = float(min(max(size, self.min_size), self.max_size))
+        self.step = step
+        self.tolerance = tolerance
+
+        self.in_flight = 0
+        self._waiters = collections.deque()
+        self._direction = 1
+        self._round_start_time = time.monotonic()
+        self._round_completions = 0
+        self._last_rate = None
+
+    async def acquire(self):
+        while self.in_flight >= int(self.size):
+            future = asyncio.get_running_loop().create_future()
+            self._waiters.append(future)
+            await future
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight = max(0, self.in_flight - 1)
+        self._round_completions += 1
+        if self._round_completions >= int(self.size):
+            self._adapt()
+        self._wakeup()
+
+    def _adapt(self):
+        now = time.monotonic()
+        rate = self._round_completions / max(now - self._round_start_time, 1e-6)
+        self._round_start_time = now
+        self._round_completions = 0
+
+        # turn back if the completion rate decreases, hold if it is flat
+        if self._last_rate is not None:
+            if rate < self._last_rate * (1 - self.tolerance):
+                self._direction = -self._direction
+            elif rate <= self._last_rate * (1 + self.tolerance):
+                self._last_rate = rate
+                return
+        self._last_rate = rate
+        size = self.size * self.step if self._direction > 0 else self.size / self.step
+        self.size = min(max(size, self.min_size), self.max_size)
+
+    def _wakeup(self):
+        available = int(self.size) - self.in_flight
+        while len(self._waiters) > 0 and available > 0:
+            future = self._waiters.popleft()
+            if future.done():  # the waiter is cancelled
+                continue
+            future.set_result(None)
+            available -= 1
@@ -0,0 +1,269 @@
+import json
+import os
+from typing import Union
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from BlockchainSpider import settings
+from BlockchainSpider.items import SyncItem, ItemBatch
+from BlockchainSpider.items.evm import BlockItem, BlockReorgItem, TransactionItem, EventLogItem, TraceItem, \
+    ContractItem, Token721TransferItem, Token20TransferItem, Token1155TransferItem, TokenApprovalItem, \
+    TokenApprovalAllItem, TokenPropertyItem, NFTMetadataItem, TransactionReceiptItem, DCFGBlockItem, DCFGEdgeItem
+from BlockchainSpider.items.solana import SolanaBlockItem, SolanaTransactionItem, SolanaInstructionItem, \
+    SolanaLogItem, SolanaBalanceChangesItem, SPLTokenActionItem, ValidateVotingItem, SPLMemoItem
+from BlockchainSpider.items.tron import TronTransactionItem
+
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+# the integer fields which may exceed int64, e.g., uint256,
+# which are saved as decimal strings losslessly
+BIGINT_FIELDS = {
+    'value', 'amount', 'token_id', 'total_supply', 'balance', 'pre_balance', 'post_balance',
+    'difficulty', 'total_difficulty', 'gas_price', 'effective_gas_price',
+}
+
+
+def _infer_type(field: str, values: list) -> Union[pa.DataType, None]:
+    kinds = {type(v) for v in values if v is not None}
+    if len(kinds) == 0:
+        return None
+    if field in BIGINT_FIELDS and kinds <= {int}:
+        return pa.string()
+    if kinds == {str}:
+        return pa.string()
+    if kinds == {bool}:
+        return pa.bool_()
+    if kinds == {int}:
+        in_range = all([INT64_MIN <= v <= INT64_MAX for v in values if v is not None])
+        return pa.int64() if in_range else pa.string()
+    if kinds <= {int, float}:
+        return pa.float64()
+    if kinds == {list} and all([isinstance(e, str) for v in values if v is not None for e in v]):
+        return pa.list_(pa.string())
+    return pa.string()
+
+
+def _to_array(values: list, data_type: pa.DataType) -> pa.Array:
+    if data_type == pa.string():
+        values = [
+            v if v is None or isinstance(v, str)
+            else str(v) if isinstance(v, int) and not isinstance(v, bool)
+            else json.dumps(v)
+            for v in values
+        ]
+    return pa.array(values, type=data_type)
+
+
+class _PartitionWriter:
+    """
+    The parquet writer of a block range for an item class,
+    which starts a new part file if the schema is widened.
+    """
+
+    def __init__(self, dirname: str, compression: str):
+        self.dirname = dirname
+        self.compression = compression
+        self.schema = None
+        self._writer = None
+
+        # append a new part file if the partition is reopened, e.g., closed as the least recently used
+        self.part = 0
+        while os.path.exists(self._get_filename()):
+            self.part += 1
+
+    def write(self, columns: dict):
+        size = len(next(iter(columns.values())))
+        names = set(columns.keys())
+        if self.schema is not None:
+            names.update(self.schema.names)
+
+        # keep the column types if compatible, otherwise widen them, e.g., int64 to string
+        fields = list()
+        for name in sorted(names):
+            values = columns.get(name)
+            if values is None:
+                values = [None] * size
+                columns[name] = values
+            data_type = _infer_type(name, values)
+            old_type = self.schema.field(name).type \
+                if self.schema is not None and self.schema.get_field_index(name) >= 0 else None
+            if old_type is not None and any([
+                data_type is None, data_type == old_type, old_type == pa.string(),
+                old_type == pa.float64() and data_type == pa.int64(),
+            ]):
+                data_type = old_type
+            fields.append(pa.field(name, data_type if data_type is not None else pa.string()))
+        schema = pa.schema(fields)
+        if self.schema is not None and not schema.equals(self.schema):
+            self.close()
+            self.part += 1
+        if self._writer is None:
+            if not os.path.exists(self.dirname):
+                os.makedirs(self.dirname)
+            self.schema = schema
+            self._writer = pq.ParquetWriter(
+                where=self._get_filename(),
+                schema=schema,
+                compression=self.compression,
+                use_dictionary=[
+                    field for field in schema.names
+                    if 'address' in field or field in {'miner', 'block_hash'}
+                ],
+            )
+
+        # write a row group
+        self._writer.write_table(pa.table(
+            [_to_array(columns[f.name], f.type) for f in self.schema],
+            schema=self.schema,
+        ))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _get_filename(self) -> str:
+        return os.path.join(self.dirname, 'part-%05d.parquet' % self.part)
+
+
+class EVMTrans2parquetPipeline:
+    """
+    Write the items into typed parquet files, i.e., `<out>/<item class>/blocks=<start>-<end>/part-<n>.parquet`,
+    where a row group is written every `PARQUET_ROW_GROUP_BLOCKS` blocks, and
+    the files are partitioned by `PARQUET_PARTITION_BLOCKS` blocks.
+    """
+
+    def __init__(self):
+        self.accepted_item_cls = {
+            cls.__name__: True for cls in [
+                BlockItem, BlockReorgItem, TransactionItem, TransactionReceiptItem,
+                EventLogItem, TraceItem, ContractItem,
+                Token721TransferItem, Token20TransferItem, Token1155TransferItem,
+                TokenApprovalItem, TokenApprovalAllItem,
+                TokenPropertyItem, NFTMetadataItem,
+                DCFGBlockItem, DCFGEdgeItem
+            ]
+        }
+        self.deduplicate_item_cls = {
+            TokenPropertyItem.__name__: 'contract_address',
+        }
+        self._cls2seen = {cls_name: set() for cls_name in self.deduplicate_item_cls.keys()}
+
+        self.row_group_blocks = getattr(settings, 'PARQUET_ROW_GROUP_BLOCKS', 100)
+        self.partition_blocks = getattr(settings, 'PARQUET_PARTITION_BLOCKS', 100000)
+        self.max_open_partitions = getattr(settings, 'PARQUET_MAX_OPEN_PARTITIONS', 8)
+        self.compression = getattr(settings, 'PARQUET_COMPRESSION', 'zstd')
+
+        self.out_dir = None
+        self.buffers = dict()  # (cls_name, partition) -> field -> values
+        self.writers = dict()  # (cls_name, partition) -> _PartitionWriter, in the order of usage
+        self._buffered_blocks = 0
+
+    def open_spider(self, spider):
+        self.out_dir = getattr(spider, 'out_dir', None)
+        if self.out_dir is not None and not os.path.exists(self.out_dir):
+            os.makedirs(self.out_dir)
+
+    def process_item(self, item, spider):
+        if self.out_dir is None:
+            return item
+        if not isinstance(item, SyncItem):
+            self._buffer_items(item.__class__.__name__, [item], self._get_partition(item.get('block_number')))
+            return item
+
+        # buffer the items of a block, and write the row groups every n blocks
+        partition = self._get_partition(item['key'])
+        for cls_name, items in item['data'].items():
+            self._buffer_items(cls_name, items, partition)
+        self._buffered_blocks += 1
+        if self._buffered_blocks >= self.row_group_blocks:
+            self.flush()
+        return item
+
+    def close_spider(self, spider):
+        if self.out_dir is None:
+            return
+        self.flush()
+        for writer in self.writers.values():
+            writer.close()
+        self.writers.clear()
+
+    def flush(self):
+        # detach the buffers first, so that the failed ones are not written twice
+        buffers, self.buffers = self.buffers, dict()
+        self._buffered_blocks = 0
+        for key, columns in buffers.items():
+            if len(columns) == 0:
+                continue
+            writer = self.writers.pop(key, None)
+            if writer is None:
+                cls_name, partition = key
+                writer = _PartitionWriter(
+                    dirname=os.path.join(self.out_dir, cls_name, partition),
+                    compression=self.compression,
+                )
+            self.writers[key] = writer
+            writer.write(columns)
+
+        # close the least recently used partitions,
+        # which are written in a new part file if reopened
+        while len(self.writers) > self.max_open_partitions:
+            key = next(iter(self.writers.keys()))
+            self.writers.pop(key).close()
+
+    def _get_partition(self, block_number) -> str:
+        if not isinstance(block_number, int) or block_number < 0:
+            return 'blocks=unknown'
+        start_block = block_number - block_number % self.partition_blocks
+        return 'blocks=%d-%d' % (start_block, start_block + self.partition_blocks - 1)
+
+    def _buffer_items(self, cls_name: str, items, partition: str):
+        if self.accepted_item_cls.get(cls_name) is None or len(items) == 0:
+            return
+        columns = self.buffers.get((cls_name, partition))
+        if columns is None:
+            columns = dict()
+            self.buffers[(cls_name, partition)] = columns
+        size = len(next(iter(columns.values()))) if len(columns) > 0 else 0
+
+        # copy the columns of batch directly
+        dedup_field = self.deduplicate_item_cls.get(cls_name)
+        if isinstance(items, ItemBatch) and dedup_field is None:
+            for field in items.fields:
+                if columns.get(field) is None:
+                    columns[field] = [None] * size
+            for field, column in columns.items():
+                column.extend(items.get_column(field))
+            return
+
+        for item in items:
+            if dedup_field is not None:
+                if item[dedup_field] in self._cls2seen[cls_name]:
+                    continue
+                self._cls2seen[cls_name].add(item[dedup_field])
+            for field in item.keys():
+                if columns.get(field) is None:
+                    columns[field] = [None] * size
+            for field, column in columns.items():
+                column.append(item.get(field))
+            size += 1
+
+
+class SolanaTrans2parquetPipeline(EVMTrans2parquetPipeline):
+    def __init__(self):
+        super().__init__()
+        self.accepted_item_cls = {
+            cls.__name__: True for cls in [
+                SolanaBlockItem, SolanaTransactionItem,
+                SolanaBalanceChangesItem, SolanaLogItem,
+                SolanaInstructionItem, SPLTokenActionItem,
+                SPLMemoItem, ValidateVotingItem,
+            ]
+        }
+
+
+class TronTrans2parquetPipeline(EVMTrans2parquetPipeline):
+    def __init__(self):
+        super().__init__()
+        self.accepted_item_cls[TronTransactionItem.__name__] = True